@@ -0,0 +1,67 @@
+import os
+import timeit
+
+from aiorpcx import JSONRPCv2
+
+from electrumx.lib import jsonrpc
+from electrumx.lib.hash import hash_to_hex_str
+from electrumx.lib.jsonrpc import ENCODER, encoding_protocol, history_json
+
+# A 10k entry confirmed history
+history = [(os.urandom(32), 500_000 + n // 3) for n in range(10_000)]
+
+FastJSONRPCv2 = encoding_protocol(JSONRPCv2)
+
+
+# Old implementation: a list of dicts encoded with the json module
+def old_encode():
+    result = [{'tx_hash': hash_to_hex_str(tx_hash), 'height': height}
+              for tx_hash, height in history]
+    return JSONRPCv2.response_message(result, 1)
+
+
+# New implementation: the same list of dicts encoded with the fast encoder
+def new_encode_dicts():
+    result = [{'tx_hash': hash_to_hex_str(tx_hash), 'height': height}
+              for tx_hash, height in history]
+    return FastJSONRPCv2.response_message(result, 1)
+
+
+# New implementation: the result as history_json() builds it; a list of
+# dicts with orjson
+def new_encode_result():
+    return FastJSONRPCv2.response_message(history_json(history), 1)
+
+
+# New implementation without orjson: the result built directly as JSON
+def new_encode_raw():
+    orjson, jsonrpc.orjson = jsonrpc.orjson, None
+    try:
+        return FastJSONRPCv2.response_message(history_json(history), 1)
+    finally:
+        jsonrpc.orjson = orjson
+
+
+def check_correctness():
+    expected = old_encode()
+    assert new_encode_dicts() == expected, "Mismatch encoding dicts"
+    assert new_encode_result() == expected, "Mismatch encoding history_json()"
+    assert new_encode_raw() == expected, "Mismatch encoding raw JSON"
+    print("All correctness tests passed.")
+
+
+def benchmark():
+    check_correctness()
+    print(f"Fast encoder: {ENCODER}")
+
+    iterations = 50
+    for name, func in (('json list of dicts', old_encode),
+                       (f'{ENCODER} list of dicts', new_encode_dicts),
+                       (f'{ENCODER} history_json()', new_encode_result),
+                       ('json raw JSON result', new_encode_raw)):
+        elapsed = min(timeit.repeat(func, number=iterations, repeat=5))
+        print(f"{name}: {elapsed / iterations * 1000:.2f} ms per 10k entry response")
+
+
+if __name__ == "__main__":
+    benchmark()
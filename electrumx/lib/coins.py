@@ -46,7 +46,7 @@ from electrumx.server import daemon
 from electrumx.server.session import ElectrumX
 
 
-Block = namedtuple("Block", "raw header transactions")
+Block = namedtuple("Block", "raw header transactions tx_spans", defaults=(None, ))
 
 
 class CoinError(Exception):
@@ -188,8 +188,9 @@ class Coin:
     def block(cls, raw_block):
         '''Return a Block namedtuple given a raw block and its height.'''
         header = raw_block[:80]
-        txs = cls.DESERIALIZER(raw_block, start=len(header)).read_tx_block()
-        return Block(raw_block, header, txs)
+        deserializer = cls.DESERIALIZER(raw_block, start=len(header))
+        txs, tx_spans = deserializer.read_tx_block_and_spans()
+        return Block(raw_block, header, txs, tx_spans)
 
     @classmethod
     def decimal_value(cls, value):
@@ -148,6 +148,43 @@ def parse_glyph_envelope(data: bytes) -> Optional[Dict[str, Any]]:
         return None
 
 
+# Indexed envelope records start with the version, flags, height and output
+# value, followed by whichever of the commit hash, content root and
+# controller the envelope has.  The remaining length tells which.
+GLYPH_RECORD = struct.Struct('<BBIQ')
+
+
+def pack_glyph_record(envelope: Dict[str, Any], height: int, value: int) -> bytes:
+    """Pack a parsed envelope into a record for the index."""
+    parts = [GLYPH_RECORD.pack(envelope['version'], envelope['flags'], height, value)]
+    for field in ('commit_hash', 'content_root', 'controller'):
+        if field in envelope:
+            parts.append(bytes.fromhex(envelope[field]))
+    return b''.join(parts)
+
+
+def unpack_glyph_record(record: bytes) -> Dict[str, Any]:
+    """Unpack an index record into envelope fields with height and value."""
+    version, flags, height, value = GLYPH_RECORD.unpack_from(record)
+    result = {
+        'version': version,
+        'flags': flags,
+        'is_reveal': (flags & EnvelopeFlags.IS_REVEAL) != 0,
+        'height': height,
+        'value': value,
+    }
+    rest = record[GLYPH_RECORD.size:]
+    if rest:
+        result['commit_hash'] = rest[:32].hex()
+        rest = rest[32:]
+        if len(rest) in (32, 68):
+            result['content_root'] = rest[:32].hex()
+            rest = rest[32:]
+        if rest:
+            result['controller'] = rest.hex()
+    return result
+
+
 def get_protocol_name(protocol_id: int) -> str:
     """Get human-readable name for a protocol ID."""
     return PROTOCOL_NAMES.get(protocol_id, f'Unknown({protocol_id})')
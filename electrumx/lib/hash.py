@@ -73,7 +73,7 @@ def hash_to_hex_str(x):
 
     Display form of a binary hash is reversed and converted to hex.
     '''
-    return bytes(reversed(x)).hex()
+    return x[::-1].hex()
 
 
 def hex_str_to_hash(x):
@@ -0,0 +1,146 @@
+# Copyright (c) 2026, the ElectrumX authors
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''JSON encoding of RPC responses.
+
+orjson is used to encode responses if it is installed.  Without it, large
+results are built directly as JSON text with RawJSON, which is spliced into
+the response without being decoded again.  orjson encodes lists of dicts
+faster than they can be built as text, so with it they are left native.
+'''
+
+import json
+
+from aiorpcx import JSONRPCAutoDetect, JSONRPCConnection, ProtocolError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+ENCODER = 'orjson' if orjson else 'json'
+
+
+def dumps(obj):
+    '''Encode obj as compact JSON bytes.'''
+    if orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson rejects some things json accepts, e.g. integers
+            # over 64 bits and non-string keys
+            pass
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class RawJSON(object):
+    '''The JSON encoding of an RPC result.'''
+
+    __slots__ = ('json', )
+
+    def __init__(self, json_bytes):
+        self.json = json_bytes
+
+    @classmethod
+    def from_list(cls, items):
+        '''Return the RawJSON of a list of encoded items.'''
+        return cls(b''.join((b'[', b','.join(items), b']')))
+
+    @classmethod
+    def concat(cls, lists):
+        '''Concatenate several RawJSON lists.'''
+        lists = [raw for raw in lists if len(raw.json) > 2]
+        if len(lists) == 1:
+            return lists[0]
+        return cls.from_list([raw.json[1:-1] for raw in lists])
+
+
+_NULL_RESULT = b'"result":null'
+
+
+def encode_payload(cls, payload):
+    '''Encode an RPC payload as JSON bytes, splicing in a RawJSON result.'''
+    result = payload.get('result')
+    raw = isinstance(result, RawJSON)
+    if raw:
+        payload = dict(payload, result=None)
+    try:
+        message = dumps(payload)
+    except TypeError:
+        msg = f'JSON payload encoding error: {payload}'
+        raise ProtocolError(cls.INTERNAL_ERROR, msg) from None
+    if raw:
+        # Strings in the payload cannot contain the unescaped quotes
+        head, _, tail = message.partition(_NULL_RESULT)
+        message = b''.join((head, b'"result":', result.json, tail))
+    return message
+
+
+_protocols = {}
+
+
+def encoding_protocol(protocol):
+    '''Return a subclass of an aiorpcx JSON RPC protocol class that encodes
+    with encode_payload.'''
+    klass = _protocols.get(protocol)
+    if klass is None:
+        klass = type(protocol.__name__, (protocol, ),
+                     {'encode_payload': classmethod(encode_payload)})
+        _protocols[protocol] = klass
+    return klass
+
+
+class EncodingConnection(JSONRPCConnection):
+    '''An auto-detecting JSON RPC connection whose protocol encodes with
+    encode_payload.'''
+
+    def __init__(self):
+        super().__init__(JSONRPCAutoDetect)
+
+    @property
+    def protocol(self):
+        '''The JSON RPC protocol class messages are encoded with.'''
+        return self._protocol
+
+    def receive_message(self, message):
+        if self._protocol is JSONRPCAutoDetect:
+            self._protocol = encoding_protocol(JSONRPCAutoDetect.detect_protocol(message))
+        return super().receive_message(message)
+
+
+def concat_lists(lists):
+    '''Concatenate results that are lists or RawJSON lists.'''
+    if any(isinstance(items, RawJSON) for items in lists):
+        return RawJSON.concat([items if isinstance(items, RawJSON) else RawJSON(dumps(items))
+                               for items in lists])
+    return [item for items in lists for item in items]
+
+
+def history_json(history):
+    '''Return the result of confirmed history, a list of (tx_hash, height)
+    pairs; a list of dicts with orjson, otherwise RawJSON.'''
+    if orjson:
+        return [{'tx_hash': tx_hash[::-1].hex(), 'height': height}
+                for tx_hash, height in history]
+    return RawJSON.from_list([
+        b'{"tx_hash":"%s","height":%d}' % (tx_hash[::-1].hex().encode(), height)
+        for tx_hash, height in history])
+
+
+def utxos_json(utxos):
+    '''Return the result of UTXOs, a list of (tx_hash, tx_pos, height,
+    value, refs) tuples; a list of dicts with orjson, otherwise RawJSON.'''
+    if orjson:
+        return [{'tx_hash': tx_hash[::-1].hex(), 'tx_pos': tx_pos, 'height': height,
+                 'value': value, 'refs': refs or []}
+                for tx_hash, tx_pos, height, value, refs in utxos]
+    return RawJSON.from_list([
+        b'{"tx_hash":"%s","tx_pos":%d,"height":%d,"value":%d,"refs":%s}'
+        % (tx_hash[::-1].hex().encode(), tx_pos, height, value,
+           dumps(refs) if refs else b'[]')
+        for tx_hash, tx_pos, height, value, refs in utxos])
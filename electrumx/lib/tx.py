@@ -204,6 +204,19 @@ class Deserializer(object):
         # Some coins have excess data beyond the end of the transactions
         return [read() for _ in range(self._read_varint())]
 
+    def read_tx_block_and_spans(self):
+        '''Returns a pair (txs, spans).  txs is as for read_tx_block(); spans
+        is a list of (offset, length) pairs locating each raw transaction in
+        the binary.'''
+        read = self.read_tx_and_hash
+        txs = []
+        spans = []
+        for _ in range(self._read_varint()):
+            start = self.cursor
+            txs.append(read())
+            spans.append((start, self.cursor - start))
+        return txs, spans
+
     # Smallest possible serialized size of one input/output. Used only to
     # sanity-cap declared counts (P0.3) so a malformed varint count cannot make
     # us try to build billions of objects from a small buffer.
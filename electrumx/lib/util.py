@@ -32,6 +32,7 @@ import inspect
 from ipaddress import ip_address
 import logging
 import sys
+from collections import OrderedDict
 from collections.abc import Container, Mapping
 from struct import Struct
 
@@ -179,6 +180,54 @@ def increment_byte_string(bs):
     return None
 
 
+class SizedLRUCache(object):
+    '''An LRU cache of bytes-like values whose total length is kept within
+    max_size bytes.'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        '''Return the value for key, marking it most recently used.'''
+        value = self._items.get(key)
+        if value is None:
+            return default
+        self._items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        # Values larger than the whole cache are not cached
+        if len(value) > self.max_size:
+            return
+        self._items[key] = value
+        self.size += len(value)
+        while self.size > self.max_size:
+            _key, old = self._items.popitem(last=False)
+            self.size -= len(old)
+
+    def pop(self, key, default=None):
+        value = self._items.pop(key, None)
+        if value is None:
+            return default
+        self.size -= len(value)
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+
 class LogicalFile(object):
     '''A logical binary file split across several separate files on disk.'''
 
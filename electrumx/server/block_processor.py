@@ -17,12 +17,14 @@ from aiorpcx import TaskGroup, CancelledError
 
 import electrumx
 from electrumx.server.daemon import DaemonError
+from electrumx.lib.glyph import find_glyph_magic, pack_glyph_record, parse_glyph_envelope
 from electrumx.lib.hash import hash_to_hex_str, HASHX_LEN
 from electrumx.lib.script import is_unspendable_legacy, is_unspendable_genesis, Script, ScriptError
 from electrumx.lib.util import (
     class_logger, pack_le_uint32, pack_le_uint64, unpack_le_uint64, unpack_le_uint32_from
 )
 from electrumx.server.db import FlushData
+from electrumx.server.metrics import metrics
 
 class Prefetcher:
     '''Prefetches blocks (in the forward direction only).'''
@@ -197,6 +199,10 @@ class BlockProcessor:
         self.ref_loc_undo_infos = []
         self.data_cache = {}
         self.db_deletes = []
+        # hashX + value of UTXOs spent from the DB, for the balance index
+        self.db_spends = []
+        # outpoint + tx_num of UTXOs spent from the DB, for the ref UTXO index
+        self.db_ref_spends = []
 
     async def run_with_lock(self, coro):
         # Shielded so that cancellations from shutdown don't lose work.  Cancellation will
@@ -312,7 +318,7 @@ class BlockProcessor:
         assert self.state_lock.locked()
         return FlushData(self.height, self.tx_count, self.headers,
                          self.tx_hashes, self.undo_infos, self.ref_loc_undo_infos, self.utxo_cache, self.ref_cache, self.ref_mint_cache, self.ref_loc_cache, self.data_cache,
-                         self.db_deletes, self.tip)
+                         self.db_deletes, self.db_spends, self.db_ref_spends, self.tip)
 
     async def flush(self, flush_utxos):
         self.db.flush_dbs(self.flush_data(), flush_utxos, self.estimate_txs_remaining)
@@ -325,8 +331,11 @@ class BlockProcessor:
         one_MB = 1000*1000
         utxo_cache_size = len(self.utxo_cache) * 205
         ref_cache_size = len(self.ref_cache) * 38 + (37 * 3) # Assume there are on average 3 refs per utxo when at least 1 ref found
-        db_deletes_size = len(self.db_deletes) * 57
+        db_deletes_size = (len(self.db_deletes) * 57 + len(self.db_spends) * 52
+                           + len(self.db_ref_spends) * 74)
         hist_cache_size = self.db.history.unflushed_memsize()
+        if self.db.tx_store:
+            hist_cache_size += self.db.tx_store.unflushed_memsize()
         # Roughly ntxs * 32 + nblocks * 42
         tx_hash_size = ((self.tx_count - self.db.fs_tx_count) * 32
                         + (self.height - self.db.fs_height) * 42)
@@ -384,11 +393,15 @@ class BlockProcessor:
         height = self.height + 1
 
         is_unspendable = is_unspendable_legacy
-        undo_info, ref_loc_undo_info = self.advance_txs(block.transactions, is_unspendable)
+        with metrics.timer('advance block'):
+            undo_info, ref_loc_undo_info = self.advance_txs(block.transactions, is_unspendable)
         if height >= min_height:
             self.undo_infos.append((undo_info, height))
             self.ref_loc_undo_infos.append((ref_loc_undo_info, height))
             self.db.write_raw_block(block.raw, height)
+        if self.db.tx_store:
+            tx_hashes = [tx_hash for _tx, tx_hash in block.transactions]
+            self.db.tx_store.add_unflushed(height, block.raw, tx_hashes, block.tx_spans)
 
         self.height = height
         self.headers.append(block.header)
@@ -451,6 +464,7 @@ class BlockProcessor:
         to_le_uint32 = pack_le_uint32
         to_le_uint64 = pack_le_uint64
         mints = set()
+        height = self.height + 1
 
         for tx, tx_hash in txs:
             hashXs = []
@@ -469,6 +483,14 @@ class BlockProcessor:
 
             # Add the new UTXOs
             for idx, txout in enumerate(tx.outputs):
+                # Index Glyph envelopes, spendable or not.  Records are never
+                # changed, so the only undo is deleting them on backup
+                if find_glyph_magic(txout.pk_script) != -1:
+                    envelope = parse_glyph_envelope(txout.pk_script)
+                    if envelope:
+                        put_data(b'gl' + tx_hash + to_le_uint32(idx),
+                                 pack_glyph_record(envelope, height, txout.value))
+
                 # P0.4: Add the UTXO iff the SHARED predicate says it is
                 # indexable.  _backup_txs spends through the same predicate, so
                 # advance-add and backup-spend cover the identical output set ->
@@ -592,7 +614,8 @@ class BlockProcessor:
                                      self.height))
         self.tip = coin.header_prevhash(block.header)
         is_unspendable = is_unspendable_legacy
-        self._backup_txs(block.transactions, is_unspendable)
+        with metrics.timer('backup block'):
+            self._backup_txs(block.transactions, is_unspendable)
         self.height -= 1
         self.db.tx_counts.pop()
 
@@ -619,6 +642,10 @@ class BlockProcessor:
         mints = set() # Missing mints
         for tx, tx_hash in reversed(txs):
             for idx, txout in enumerate(tx.outputs):
+                if (find_glyph_magic(txout.pk_script) != -1
+                        and parse_glyph_envelope(txout.pk_script)):
+                    self.db_deletes.append(b'gl' + tx_hash + to_le_uint32(idx))
+
                 # P0.4: Spend the TX output iff the SHARED predicate marked it
                 # indexable on advance.  Using the IDENTICAL predicate (instead
                 # of the old is_unspendable_legacy-only test) guarantees backup
@@ -758,6 +785,16 @@ class BlockProcessor:
 
         4. Key: b'ri' + tx_hash + tx_idx
            Value: ref + ref + ...
+
+        5. Key: b'ru' + ref + tx_num + tx_idx
+           Value: hashX + the UTXO value as a 64-bit unsigned integer
+
+           Only unspent outputs have rows, so the UTXOs carrying a ref
+           are a prefix scan.
+
+        6. Key: b'gl' + tx_hash + tx_idx
+           Value: the Glyph envelope record of the output; see
+           pack_glyph_record()
     
 
 
@@ -809,6 +846,9 @@ class BlockProcessor:
                 # Remove all entries for this UTXO
                 self.db_deletes.append(hdb_key)
                 self.db_deletes.append(udb_key)
+                self.db_spends.append(hashX + utxo_value_packed)
+                # Its b'ru' rows are found from its b'ri' row on flush
+                self.db_ref_spends.append(tx_hash + idx_packed + tx_num_packed)
                 return hashX + codeScriptHash + tx_num_packed + utxo_value_packed
 
         raise ChainError('UTXO {} / {:,d} not found in "h" table'
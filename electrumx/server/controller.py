@@ -10,10 +10,13 @@ from asyncio import Event
 from aiorpcx import _version as aiorpcx_version, TaskGroup
 
 import electrumx
+from electrumx.lib.jsonrpc import ENCODER as json_encoder
 from electrumx.lib.server_base import ServerBase
 from electrumx.lib.util import version_string
 from electrumx.server.db import DB
+from electrumx.server.executors import INTERNAL
 from electrumx.server.mempool import MemPool, MemPoolAPI
+from electrumx.server.metrics import serve_metrics
 from electrumx.server.session import SessionManager
 
 
@@ -95,6 +98,7 @@ class Controller(ServerBase):
         self.logger.info(f'aiorpcX version: {version_string(aiorpcx_version)}')
         self.logger.info(f'supported protocol versions: {min_str}-{max_str}')
         self.logger.info(f'event loop policy: {env.loop_policy}')
+        self.logger.info(f'JSON encoder: {json_encoder}')
         self.logger.info(f'reorg limit is {env.reorg_limit:,d} blocks')
 
         notifications = Notifications()
@@ -112,13 +116,21 @@ class Controller(ServerBase):
             notifications.db_height = get_db_height
             notifications.cached_height = daemon.cached_height
             notifications.mempool_hashes = daemon.mempool_hashes
-            notifications.raw_transactions = daemon.getrawtransactions
             notifications.lookup_utxos = db.lookup_utxos
             MemPoolAPI.register(Notifications)
-            mempool = MemPool(env.coin, notifications)
+            mempool = MemPool(env.coin, notifications,
+                              runner=db.executors.runner(INTERNAL),
+                              zmq_url=env.daemon_zmq_url,
+                              reconcile_secs=env.mempool_reconcile_secs,
+                              processes=env.mempool_processes,
+                              snapshot_path='meta/mempool' if env.mempool_snapshot else None,
+                              snapshot_secs=env.mempool_snapshot_secs,
+                              max_mb=env.mempool_max_mb)
 
             session_mgr = SessionManager(env, db, bp, daemon, mempool,
                                          shutdown_event)
+            # Let the session manager cache the transactions the mempool fetches
+            notifications.raw_transactions = session_mgr.mempool_raw_transactions
 
             # Test daemon authentication, and also ensure it has a cached
             # height.  Do this before entering the task group.
@@ -132,11 +144,16 @@ class Controller(ServerBase):
                 await group.spawn(db.populate_header_merkle_cache())
                 await group.spawn(mempool.keep_synchronized(mempool_event))
 
-            async with TaskGroup() as group:
-                await group.spawn(session_mgr.serve(notifications, mempool_event))
-                await group.spawn(bp.fetch_and_process_blocks(caught_up_event))
-                await group.spawn(wait_for_catchup())
-
-                async for task in group:
-                    if not task.cancelled():
-                        task.result()
+            try:
+                async with TaskGroup() as group:
+                    await group.spawn(session_mgr.serve(notifications, mempool_event))
+                    await group.spawn(bp.fetch_and_process_blocks(caught_up_event))
+                    await group.spawn(wait_for_catchup())
+                    if env.metrics_port is not None:
+                        await group.spawn(serve_metrics(env.metrics_host, env.metrics_port))
+
+                    async for task in group:
+                        if not task.cancelled():
+                            task.result()
+            finally:
+                db.executors.shutdown()
@@ -14,27 +14,39 @@ import ast
 import os
 import time
 from bisect import bisect_right
+from struct import Struct
 from collections import namedtuple
+from functools import partial
 from glob import glob
 
 import attr
-from aiorpcx import run_in_thread, sleep
+import pylru
+from aiorpcx import sleep
 
 from electrumx.lib import util
+from electrumx.lib.glyph import unpack_glyph_record
 from electrumx.lib.hash import hash_to_hex_str, HASHX_LEN
 from electrumx.lib.merkle import Merkle, MerkleCache
 from electrumx.lib.util import (
     formatted_time, pack_be_uint16, pack_be_uint32, pack_le_uint32,
     unpack_le_uint32, unpack_be_uint32, unpack_le_uint64
 )
+from electrumx.server.executors import ExecutorPools, INTERNAL, CHEAP, EXPENSIVE
 from electrumx.server.storage import db_class
 from electrumx.server.history import History
+from electrumx.server.metrics import metrics
+from electrumx.server.tx_store import TxStore
 
 from electrumx.lib.util import (
     unpack_le_uint32_from
 )
 
 UTXO = namedtuple("UTXO", "tx_num tx_pos tx_hash height value")
+# A UTXO carrying a ref, with the hashX it pays to
+RefUTXO = namedtuple("RefUTXO", "tx_num tx_pos tx_hash height value hashX")
+
+# Value of a b'bal' + hashX row: confirmed value and UTXO count
+BALANCE = Struct('<QI')
 
 
 @attr.s(slots=True)
@@ -52,6 +64,11 @@ class FlushData(object):
     ref_locs = attr.ib()
     data_adds = attr.ib()
     deletes = attr.ib()
+    # hashX + value of each UTXO spent from the DB
+    spends = attr.ib()
+    # outpoint + tx_num of each UTXO spent from the DB, to delete its
+    # b'ru' rows
+    ref_spends = attr.ib()
     tip = attr.ib()
 
 
@@ -67,13 +84,26 @@ class DB(object):
     # b'U' + height, so b'RU' undo info from older DBs is missing/unusable for
     # reorg backup.
     #
-    # NOTE: bumping DB_VERSIONS does NOT trigger any automatic rebuild or
-    # migration.  Only versions listed here are accepted: opening a DB whose
-    # stored db_version is not in this list raises DBError in read_utxo_state()
-    # and the node REFUSES TO START.  Recovery is manual -- the operator must
-    # wipe the DB directory and resync from genesis.  Dropping pre-9 versions
-    # is therefore a hard stop for un-wiped old DBs, not an in-place upgrade.
-    DB_VERSIONS = [9]
+    # NOTE: only versions listed here are accepted: opening a DB whose
+    # stored db_version is not in this list raises DBError in
+    # read_utxo_state() and the node REFUSES TO START.  Recovery is manual --
+    # the operator must wipe the DB directory and resync from genesis.
+    # Dropping pre-9 versions is therefore a hard stop for un-wiped old DBs.
+    #
+    # Version 10 adds the b'bal' + hashX balance index, and version 11 the
+    # b'ru' + ref UTXO index.  Version 9 and 10 DBs are upgraded to 11 in
+    # place when opened: upgrade_db() builds the b'bal' rows from the b'u'
+    # rows (version 9 only), then the b'ru' rows from the b'ri' rows of
+    # unspent outputs, and writes the new version.
+    DB_VERSIONS = [9, 10, 11]
+
+    # Client queries expected to read at least this many rows go to the
+    # expensive pool
+    EXPENSIVE_ROWS = 1000
+    # Outputs of recent blocks kept in memory for mempool prevout lookups
+    HOT_OUTPUTS = 100_000
+    # Hashes of tx numbers at most this far apart are read together
+    HASH_READ_GAP = 64
 
     class DBError(Exception):
         '''Raised on general DB errors generally indicating corruption.'''
@@ -87,7 +117,16 @@ class DB(object):
         os.chdir(env.db_dir)
 
         self.db_class = db_class(self.env.db_engine)
+        self.executors = ExecutorPools(env.internal_threads, env.cheap_query_threads,
+                                       env.expensive_query_threads)
+        # Row counts of recent query results, keyed by query kind and hashX
+        self.query_rows = pylru.lrucache(100_000)
+        # The b'h' rows of outputs of recent blocks, keyed by outpoint:
+        # hashX + codeScriptHash + tx_idx + tx_num.  Replaced, not mutated,
+        # so the mempool can read it from another thread.
+        self.hot_outputs = {}
         self.history = History()
+        self.tx_store = TxStore(runner=self.executors.runner(CHEAP)) if env.tx_store else None
         self.utxo_db = None
         self.utxo_flush_count = 0
         self.fs_height = -1
@@ -101,6 +140,8 @@ class DB(object):
         self.wall_time = 0
         self.first_sync = True
         self.db_version = -1
+        # Glyph envelopes are indexed from this height up
+        self.glyph_height = 0
 
         self.logger.info(f'using {self.env.db_engine} for DB backend')
 
@@ -148,6 +189,10 @@ class DB(object):
                                                      compacting)
         self.clear_excess_undo_info()
 
+        # Then the optional transaction store
+        if self.tx_store:
+            self.tx_store.open_db(self.db_class, for_sync, self.db_height)
+
         # Read TX counts (requires meta directory)
         await self._read_tx_counts()
 
@@ -171,6 +216,8 @@ class DB(object):
             self.logger.info('closing DBs to re-open for serving')
             self.utxo_db.close()
             self.history.close_db()
+            if self.tx_store:
+                self.tx_store.close_db()
             self.utxo_db = None
         await self._open_dbs(False, False)
 
@@ -199,6 +246,7 @@ class DB(object):
         assert not flush_data.ref_adds
         assert not flush_data.data_adds
         assert not flush_data.deletes
+        assert not flush_data.spends
         assert not flush_data.undo_infos
         self.history.assert_flushed()
 
@@ -214,21 +262,30 @@ class DB(object):
         tx_delta = flush_data.tx_count - self.last_flush_tx_count
 
         # Flush to file system
-        self.flush_fs(flush_data)
+        with metrics.timer('flush fs'):
+            self.flush_fs(flush_data)
 
         # Then history
-        self.flush_history()
+        with metrics.timer('flush history'):
+            self.flush_history()
 
         # Flush state last as it reads the wall time.
-        with self.utxo_db.write_batch() as batch:
-            if flush_utxos:
-                self.flush_utxo_db(batch, flush_data)
-            self.flush_state(batch)
+        with metrics.timer('flush utxos' if flush_utxos else 'flush state'):
+            with self.utxo_db.write_batch() as batch:
+                if flush_utxos:
+                    self.flush_utxo_db(batch, flush_data)
+                self.flush_state(batch)
 
         # Update and put the wall time again - otherwise we drop the
         # time it took to commit the batch
         self.flush_state(self.utxo_db)
 
+        # The tx store is flushed after the UTXO state so it never gets
+        # ahead of it; if we crash first its missing blocks are served by
+        # the daemon.
+        if self.tx_store:
+            self.tx_store.flush()
+
         elapsed = self.last_flush - start_time
         self.logger.info(f'flush #{self.history.flush_count:,d} took '
                          f'{elapsed:.1f}s.  Height {flush_data.height:,d} '
@@ -298,6 +355,15 @@ class DB(object):
         data_add_count = len(flush_data.data_adds)
         spend_count = len(flush_data.deletes) // 2
 
+        # Balances, before the adds and spends are cleared
+        self.flush_balances(batch, flush_data.adds, flush_data.spends)
+        flush_data.spends.clear()
+
+        # The b'ri' rows of UTXOs spent from the DB are kept, but the UTXOs
+        # no longer carry their refs
+        self.flush_ref_spends(flush_data.deletes, flush_data.ref_spends)
+        flush_data.ref_spends.clear()
+
         # Spends
         batch_delete = batch.delete
         for key in sorted(flush_data.deletes):
@@ -306,6 +372,8 @@ class DB(object):
 
         # New UTXOs
         batch_put = batch.put
+        # Recently flushed outputs are worth keeping only when serving
+        hot_outputs = None if self.utxo_db.for_sync else {}
         for key, value in flush_data.adds.items():
             # suffix = tx_idx + tx_num
             hashX = value[:11]
@@ -313,7 +381,15 @@ class DB(object):
             suffix = key[-4:] + value[-13:-8]
             batch_put(b'h' + key[:4] + suffix, hashX + codeScriptHash)
             batch_put(b'u' + hashX + suffix, value[-8:])
+            if hot_outputs is not None:
+                hot_outputs[key] = value[:43] + suffix
+            refs_value = flush_data.ref_adds.get(key)
+            if refs_value:
+                for ru_key in self.ref_utxo_keys(refs_value, value[-13:-8] + key[-4:]):
+                    batch_put(ru_key, hashX + value[-8:])
         flush_data.adds.clear()
+        if hot_outputs is not None:
+            self._remember_hot_outputs(hot_outputs)
 
         # New Refs
         batch_put = batch.put
@@ -358,6 +434,59 @@ class DB(object):
         self.db_tx_count = flush_data.tx_count
         self.db_tip = flush_data.tip
 
+    def flush_ref_spends(self, deletes, ref_spends):
+        '''Add the b'ru' keys of UTXOs spent from the DB to deletes, reading
+        their b'ri' rows in one pass.'''
+        keys = [b'ri' + ref_spend[:36] for ref_spend in ref_spends]
+        for ref_spend, refs_value in zip(ref_spends, self.utxo_db.multi_get(keys)):
+            if refs_value:
+                # suffix = tx_num + tx_idx
+                deletes.extend(self.ref_utxo_keys(refs_value,
+                                                  ref_spend[36:] + ref_spend[32:36]))
+
+    @staticmethod
+    def ref_utxo_keys(refs_value, suffix):
+        '''Return the b'ru' keys of a UTXO from the refs of its b'ri' row.
+
+        Key: b'ru' + ref + tx_num + tx_idx
+        Value: hashX + the UTXO value as a 64-bit unsigned integer
+        '''
+        return [b'ru' + refs_value[n: n + 36] + suffix
+                for n in range(0, len(refs_value), 37)]
+
+    def _remember_hot_outputs(self, hot_outputs):
+        if len(self.hot_outputs) + len(hot_outputs) <= self.HOT_OUTPUTS:
+            hot_outputs = {**self.hot_outputs, **hot_outputs}
+        self.hot_outputs = hot_outputs
+
+    def flush_balances(self, batch, adds, spends):
+        '''Apply the balance changes of UTXO adds and spends to the batch.
+
+        Key: b'bal' + hashX
+        Value: confirmed value (64 bits) and UTXO count (32 bits)
+        '''
+        deltas = {}
+        for value in adds.values():
+            hashX = value[:HASHX_LEN]
+            amount, count = deltas.get(hashX, (0, 0))
+            deltas[hashX] = (amount + unpack_le_uint64(value[-8:])[0], count + 1)
+        for spend in spends:
+            hashX = spend[:HASHX_LEN]
+            amount, count = deltas.get(hashX, (0, 0))
+            deltas[hashX] = (amount - unpack_le_uint64(spend[-8:])[0], count - 1)
+
+        keys = [b'bal' + hashX for hashX in deltas]
+        for key, old, (amount, count) in zip(keys, self.utxo_db.multi_get(keys),
+                                             deltas.values()):
+            if old:
+                old_amount, old_count = BALANCE.unpack(old)
+                amount += old_amount
+                count += old_count
+            if count:
+                batch.put(key, BALANCE.pack(amount, count))
+            else:
+                batch.delete(key)
+
     def flush_state(self, batch):
         '''Flush chain state to the batch.'''
         now = time.time()
@@ -376,9 +505,20 @@ class DB(object):
         start_time = time.time()
         tx_delta = flush_data.tx_count - self.last_flush_tx_count
 
+        if self.tx_store:
+            # The hashes of the backed-up transactions are still on disk
+            tx_hashes = self.read_tx_hashes(flush_data.tx_count, self.db_tx_count)
+            self.tx_store.backup(tx_hashes, flush_data.height)
         self.backup_fs(flush_data.height, flush_data.tx_count)
         self.history.backup(touched, flush_data.tx_count)
-        with self.utxo_db.write_batch() as batch:
+        # The b'ri' rows of restored UTXOs were kept when they were spent;
+        # re-adding them restores their b'ru' rows
+        restored = [key for key in flush_data.adds if key not in flush_data.ref_adds]
+        for key, refs_value in zip(restored,
+                                   self.utxo_db.multi_get([b'ri' + key for key in restored])):
+            if refs_value:
+                flush_data.ref_adds[key] = refs_value
+        with metrics.timer('flush backup'), self.utxo_db.write_batch() as batch:
             self.flush_utxo_db(batch, flush_data)
             # Flush state last as it reads the wall time.
             self.flush_state(batch)
@@ -392,6 +532,8 @@ class DB(object):
         '''Back up during a reorg.  This just updates our pointers.'''
         self.fs_height = height
         self.fs_tx_count = tx_count
+        # Outputs of the backed-up blocks no longer exist
+        self.hot_outputs = {}
         # Truncate header_mc: header count is 1 more than the height.
         self.header_mc.truncate(height + 1)
 
@@ -424,7 +566,7 @@ class DB(object):
                 return self.headers_file.read(offset, size), disk_count
             return b'', 0
 
-        return await run_in_thread(read_headers)
+        return await self.executors.run(CHEAP, read_headers)
 
     def fs_tx_hash(self, tx_num):
         '''Return a pair (tx_hash, tx_height) for the given tx number.
@@ -437,6 +579,37 @@ class DB(object):
             tx_hash = self.hashes_file.read(tx_num * 32, 32)
         return tx_hash, tx_height
 
+    def fs_tx_hashes(self, tx_nums):
+        '''Return a dictionary mapping those of the sorted tx_nums that are
+        on disk to their tx hashes.
+
+        Nearby tx numbers are read from the hashes file together.'''
+        if self.db_height < 0:
+            return {}
+        end = self.tx_counts[self.db_height]
+        tx_nums = [tx_num for tx_num in tx_nums if tx_num < end]
+        tx_hashes = {}
+        start = 0
+        while start < len(tx_nums):
+            stop = start + 1
+            while (stop < len(tx_nums)
+                   and tx_nums[stop] - tx_nums[stop - 1] <= self.HASH_READ_GAP):
+                stop += 1
+            first = tx_nums[start]
+            hashes = self.hashes_file.read(first * 32, (tx_nums[stop - 1] + 1 - first) * 32)
+            for tx_num in tx_nums[start:stop]:
+                offset = (tx_num - first) * 32
+                tx_hashes[tx_num] = hashes[offset: offset + 32]
+            start = stop
+        return tx_hashes
+
+    def read_tx_hashes(self, start_tx_num, end_tx_num):
+        '''Return the list of tx hashes from start_tx_num up to but excluding
+        end_tx_num, read from the hashes file.'''
+        hashes = self.hashes_file.read(start_tx_num * 32,
+                                       (end_tx_num - start_tx_num) * 32)
+        return [hashes[n: n + 32] for n in range(0, len(hashes), 32)]
+
     def fs_tx_hashes_at_blockheight(self, block_height):
         '''Return a list of tx_hashes at given block height,
         in the same order as in the block.
@@ -454,7 +627,7 @@ class DB(object):
         return [tx_hashes[idx * 32: (idx+1) * 32] for idx in range(num_txs_in_block)]
 
     async def tx_hashes_at_blockheight(self, block_height):
-        return await run_in_thread(self.fs_tx_hashes_at_blockheight, block_height)
+        return await self.executors.run(CHEAP, self.fs_tx_hashes_at_blockheight, block_height)
 
     async def fs_block_hashes(self, height, count):
         headers_concat, headers_count = await self.read_headers(height, count)
@@ -470,6 +643,28 @@ class DB(object):
 
         return [self.coin.header_hash(header) for header in headers]
 
+    async def run_query(self, key, limit, func, estimate_rows=None):
+        '''Run a client query returning a list of rows, or a (list, other)
+        pair, in the cheap or expensive pool.
+
+        The cost of a query is estimated from the row count of its last
+        result, capped by limit if not None.  For the first query of key
+        it is estimated by estimate_rows(), a cheap blocking function, if
+        given.
+        '''
+        last_rows = self.query_rows.get(key)
+        if last_rows is None:
+            last_rows = await self.executors.run(CHEAP, estimate_rows) if estimate_rows else 0
+        estimate = last_rows if limit is None else min(last_rows, limit)
+        kind = EXPENSIVE if estimate >= self.EXPENSIVE_ROWS else CHEAP
+        result = await self.executors.run(kind, func)
+        rows = len(result[0] if isinstance(result, tuple) else result)
+        if limit is not None and rows >= limit:
+            # A truncated result says nothing about the full row count
+            rows = max(rows, last_rows)
+        self.query_rows[key] = rows
+        return result
+
     async def limited_history(self, hashX, *, limit=1000, reverse=False):
         '''Return an unpruned, sorted list of (tx_hash, height) tuples of
         confirmed transactions that touched the address, earliest in
@@ -483,12 +678,43 @@ class DB(object):
             return [fs_tx_hash(tx_num) for tx_num in tx_nums]
 
         while True:
-            history = await run_in_thread(read_history)
+            history = await self.run_query((b'h', hashX), limit, read_history,
+                                           partial(self.utxo_count, hashX))
             if all(hash is not None for hash, height in history):
                 return history
             self.logger.warning('limited_history: tx hash not found (reorg?), retrying...')
             await sleep(0.25)
 
+    async def history_page(self, hashX, start_tx_num, count):
+        '''Return a pair (history, next_tx_num) for one page of confirmed
+        history of a hashX beginning at start_tx_num.
+
+        History is a sorted list of at most count (tx_hash, height) tuples.
+        next_tx_num is the tx_num the following page starts at, or None if
+        this is the last page.
+        '''
+        def read_history():
+            tx_nums = list(self.history.get_txnums(hashX, count + 1,
+                                                   start_tx_num=start_tx_num))
+            next_tx_num = tx_nums.pop() if len(tx_nums) > count else None
+            fs_tx_hash = self.fs_tx_hash
+            return [fs_tx_hash(tx_num) for tx_num in tx_nums], next_tx_num
+
+        while True:
+            history, next_tx_num = await self.run_query((b'h', hashX), count, read_history,
+                                                        partial(self.utxo_count, hashX))
+            if all(hash is not None for hash, height in history):
+                return history, next_tx_num
+            self.logger.warning('history_page: tx hash not found (reorg?), retrying...')
+            await sleep(0.25)
+
+    def height_tx_num(self, height):
+        '''Return the tx_num of the first transaction at or after height.'''
+        if height <= 0:
+            return 0
+        height = min(height, len(self.tx_counts))
+        return self.tx_counts[height - 1]
+
     # -- Undo information
 
     def min_undo_height(self, max_height):
@@ -601,6 +827,7 @@ class DB(object):
             self.utxo_flush_count = 0
             self.wall_time = 0
             self.first_sync = True
+            self.glyph_height = 0
         else:
             state = ast.literal_eval(state.decode())
             if not isinstance(state, dict):
@@ -624,6 +851,8 @@ class DB(object):
             self.utxo_flush_count = state['utxo_flush_count']
             self.wall_time = state['wall_time']
             self.first_sync = state['first_sync']
+            # DBs from before the Glyph index only have the later blocks
+            self.glyph_height = state.get('glyph_height', self.db_height + 1)
 
         # These are our state as we move ahead of DB state
         self.fs_height = self.db_height
@@ -651,6 +880,16 @@ class DB(object):
         self.logger.info(f'UTXO DB version: {self.db_version}')
         self.logger.info('Upgrading your DB; this can take some time...')
 
+        if self.db_version in (9, 10):
+            if self.db_version == 9:
+                self.build_balances()
+            self.build_ref_utxos()
+            self.db_version = max(self.DB_VERSIONS)
+            with self.utxo_db.write_batch() as batch:
+                self.write_utxo_state(batch)
+            self.logger.info('DB upgraded successfully')
+            return
+
         def upgrade_u_prefix(prefix):
             count = 0
             with self.utxo_db.write_batch() as batch:
@@ -731,6 +970,138 @@ class DB(object):
             self.write_utxo_state(batch)
         self.logger.info('DB 2 of 3 upgraded successfully')
 
+    def build_balances(self):
+        '''Build the b'bal' balance index from the b'u' UTXO rows.'''
+        last = time.monotonic()
+        count = 0
+
+        def write_balances(balances):
+            with self.utxo_db.write_batch() as batch:
+                for hashX, (amount, utxo_count) in balances.items():
+                    batch.put(b'bal' + hashX, BALANCE.pack(amount, utxo_count))
+            balances.clear()
+
+        balances = {}
+        current, amount, utxo_count = None, 0, 0
+        # Key: b'u' + address_hashX + tx_idx + tx_num
+        # Rows are sorted by hashX so each hashX's rows are consecutive
+        for db_key, db_value in self.utxo_db.iterator(prefix=b'u'):
+            hashX = db_key[1:1 + HASHX_LEN]
+            if hashX != current:
+                if current is not None:
+                    balances[current] = (amount, utxo_count)
+                if len(balances) >= 100_000:
+                    write_balances(balances)
+                    now = time.monotonic()
+                    if now > last + 10:
+                        last = now
+                        self.logger.info(f'balance index: {count:,d} UTXOs read')
+                current, amount, utxo_count = hashX, 0, 0
+            amount += unpack_le_uint64(db_value)[0]
+            utxo_count += 1
+            count += 1
+        if current is not None:
+            balances[current] = (amount, utxo_count)
+        write_balances(balances)
+        self.logger.info(f'balance index built from {count:,d} UTXOs')
+
+    def build_ref_utxos(self):
+        '''Build the b'ru' ref UTXO index from the b'ri' rows of unspent
+        outputs.'''
+        last = time.monotonic()
+        count = 0
+        rows = {}
+
+        def write_rows():
+            with self.utxo_db.write_batch() as batch:
+                for key, value in rows.items():
+                    batch.put(key, value)
+            rows.clear()
+
+        # Key: b'ri' + tx_hash + tx_idx
+        # Value: ref + type + ref + type ...
+        for db_key, refs_value in self.utxo_db.iterator(prefix=b'ri'):
+            tx_hash, idx_packed = db_key[2:34], db_key[34:]
+            for h_key, hashX_with_codescripthash in self.utxo_db.iterator(
+                    prefix=b'h' + tx_hash[:4] + idx_packed):
+                tx_num, = unpack_le_uint64(h_key[-5:] + bytes(3))
+                if self.hashes_file.read(tx_num * 32, 32) != tx_hash:
+                    continue
+                hashX = hashX_with_codescripthash[:HASHX_LEN]
+                utxo_value = self.utxo_db.get(b'u' + hashX + h_key[-9:])
+                if utxo_value:
+                    for ru_key in self.ref_utxo_keys(refs_value, h_key[-5:] + idx_packed):
+                        rows[ru_key] = hashX + utxo_value
+                    count += 1
+                break
+            if len(rows) >= 100_000:
+                write_rows()
+                now = time.monotonic()
+                if now > last + 10:
+                    last = now
+                    self.logger.info(f'ref UTXO index: {count:,d} UTXOs indexed')
+        write_rows()
+        self.logger.info(f'ref UTXO index built from {count:,d} UTXOs')
+
+    async def get_utxos_by_ref(self, ref):
+        '''Return the confirmed UTXOs carrying ref, as RefUTXO named tuples
+        in blockchain order.'''
+        def read_utxos():
+            rows = []
+            # Key: b'ru' + ref + tx_num + tx_idx
+            # Value: hashX + the UTXO value as a 64-bit unsigned integer
+            for db_key, db_value in self.utxo_db.iterator(prefix=b'ru' + ref):
+                tx_num, = unpack_le_uint64(db_key[-9:-4] + bytes(3))
+                tx_pos, = unpack_le_uint32(db_key[-4:])
+                value, = unpack_le_uint64(db_value[HASHX_LEN:])
+                rows.append((tx_num, tx_pos, value, db_value[:HASHX_LEN]))
+            tx_hashes = self.fs_tx_hashes(sorted({row[0] for row in rows}))
+            tx_counts = self.tx_counts
+            return [RefUTXO(tx_num, tx_pos, tx_hashes.get(tx_num),
+                            bisect_right(tx_counts, tx_num), value, hashX)
+                    for tx_num, tx_pos, value, hashX in rows]
+
+        while True:
+            utxos = await self.run_query((b'ru', ref), None, read_utxos)
+            if all(utxo.tx_hash is not None for utxo in utxos):
+                return utxos
+            self.logger.warning('get_utxos_by_ref: tx hash not found (reorg?), retrying...')
+            await sleep(0.25)
+
+    async def glyph_record(self, outpoint):
+        '''Return the Glyph envelope record of an output, or None.'''
+        return await self.executors.run(CHEAP, self.utxo_db.get, b'gl' + outpoint)
+
+    async def tx_height(self, tx_hash):
+        '''Return the height of a confirmed transaction the indexes know, or
+        None.  Transactions with a Glyph envelope are in the Glyph index;
+        others are only known if the tx store holds them.'''
+        def read_height():
+            for _key, record in self.utxo_db.iterator(prefix=b'gl' + tx_hash):
+                return unpack_glyph_record(record)['height']
+            return None
+
+        height = await self.executors.run(CHEAP, read_height)
+        if height is None and self.tx_store:
+            height = await self.tx_store.tx_height(tx_hash)
+        return height
+
+    def utxo_count(self, hashX):
+        '''Return the confirmed UTXO count of hashX from the balance index.
+        Its history has at least as many transactions.  This function is
+        blocking.'''
+        value = self.utxo_db.get(b'bal' + hashX)
+        return BALANCE.unpack(value)[1] if value else 0
+
+    async def balance(self, hashX):
+        '''Return a (value, count) pair of the confirmed balance and UTXO
+        count of hashX.'''
+        def read_balance():
+            value = self.utxo_db.get(b'bal' + hashX)
+            return BALANCE.unpack(value) if value else (0, 0)
+
+        return await self.executors.run(CHEAP, read_balance)
+
     def write_utxo_state(self, batch):
         '''Write (UTXO) state to the batch.'''
         state = {
@@ -742,6 +1113,7 @@ class DB(object):
             'wall_time': self.wall_time,
             'first_sync': self.first_sync,
             'db_version': self.db_version,
+            'glyph_height': self.glyph_height,
         }
         batch.put(b'state', repr(state).encode())
 
@@ -767,12 +1139,47 @@ class DB(object):
             return utxos
 
         while True:
-            utxos = await run_in_thread(read_utxos)
+            utxos = await self.run_query((b'u', hashX), None, read_utxos,
+                                         partial(self.utxo_count, hashX))
             if all(utxo.tx_hash is not None for utxo in utxos):
                 return utxos
             self.logger.warning('all_utxos: tx hash not found (reorg?), retrying...')
             await sleep(0.25)
 
+    async def utxos_page(self, hashX, start_suffix, count):
+        '''Return a pair (utxos, next_suffix) for one page of the UTXOs of a
+        hashX in DB key order, beginning at the key suffix start_suffix.
+
+        At most count UTXOs are returned.  next_suffix is the tx_idx + tx_num
+        key suffix the following page starts at, or None if this is the last
+        page.
+        '''
+        def read_utxos():
+            utxos = []
+            utxos_append = utxos.append
+            next_suffix = None
+            # Key: b'u' + address_hashX + tx_idx + tx_num
+            # Value: the UTXO value as a 64-bit unsigned integer
+            prefix = b'u' + hashX
+            for db_key, db_value in self.utxo_db.iterator_from(prefix, prefix + start_suffix):
+                if len(utxos) == count:
+                    next_suffix = db_key[-9:]
+                    break
+                tx_pos, = unpack_le_uint32(db_key[-9:-5])
+                tx_num, = unpack_le_uint64(db_key[-5:] + bytes(3))
+                value, = unpack_le_uint64(db_value)
+                tx_hash, height = self.fs_tx_hash(tx_num)
+                utxos_append(UTXO(tx_num, tx_pos, tx_hash, height, value))
+            return utxos, next_suffix
+
+        while True:
+            utxos, next_suffix = await self.run_query((b'u', hashX), count, read_utxos,
+                                                      partial(self.utxo_count, hashX))
+            if all(utxo.tx_hash is not None for utxo in utxos):
+                return utxos, next_suffix
+            self.logger.warning('utxos_page: tx hash not found (reorg?), retrying...')
+            await sleep(0.25)
+
     async def codescripthash_all_utxos(self, codeScriptHash):
         '''Return all UTXOs for a codescripthash sorted in no particular order.'''
         def read_utxos():
@@ -790,7 +1197,7 @@ class DB(object):
             return utxos
 
         while True:
-            utxos = await run_in_thread(read_utxos)
+            utxos = await self.run_query((b'cu', codeScriptHash), None, read_utxos)
             if all(utxo.tx_hash is not None for utxo in utxos):
                 return utxos
             self.logger.warning('all_utxos: tx hash not found (reorg?), retrying...')
@@ -798,53 +1205,68 @@ class DB(object):
 
     async def lookup_utxos(self, prevouts):
         '''For each prevout, lookup it up in the DB and return a (hashX,
-        value) pair or None if not found.
+        value, codeScriptHash) tuple or None if not found.
 
         Used by the mempool code.
         '''
-        def lookup_hashXs():
-            '''Return (hashX, suffix) pairs, or None if not found,
-            for each prevout.
+        def lookup_rows():
+            '''Return (hashX, codeScriptHash, suffix) tuples, or None if not
+            found, for each prevout.
             '''
-            def lookup_hashX(tx_hash, tx_idx):
+            rows = [None] * len(prevouts)
+            hot_outputs = self.hot_outputs
+            # Key: b'h' + compressed_tx_hash + tx_idx + tx_num
+            # Value: hashX + codeScriptHash
+            misses = []
+            for n, (tx_hash, tx_idx) in enumerate(prevouts):
                 idx_packed = pack_le_uint32(tx_idx)
+                row = hot_outputs.get(tx_hash + idx_packed)
+                if row:
+                    rows[n] = (row[:HASHX_LEN], row[HASHX_LEN:-9], row[-9:])
+                else:
+                    misses.append((b'h' + tx_hash[:4] + idx_packed, n))
+
+            # Read the candidate rows in key order with a single iterator,
+            # then the hashes of all their tx numbers in batches
+            misses.sort()
+            groups = self.utxo_db.prefix_groups([prefix for prefix, _n in misses])
+            tx_nums = sorted({unpack_le_uint64(db_key[-5:] + bytes(3))[0]
+                              for group in groups for db_key, _value in group})
+            tx_hashes = self.fs_tx_hashes(tx_nums)
+
+            # Find which entry, if any, the tx hash matches.
+            for (_prefix, n), group in zip(misses, groups):
+                tx_hash = prevouts[n][0]
+                for db_key, value in group:
+                    tx_num, = unpack_le_uint64(db_key[-5:] + bytes(3))
+                    if tx_hashes.get(tx_num) == tx_hash:
+                        rows[n] = (value[:HASHX_LEN], value[HASHX_LEN:], db_key[-9:])
+                        break
+            return rows
+
+        def lookup_utxos():
+            # A prevout is not found when the daemon is a block ahead of
+            # us and has mempool txs spending outputs from that new block
+            rows = lookup_rows()
+            # Key: b'u' + address_hashX + tx_idx + tx_num
+            # Value: the UTXO value as a 64-bit unsigned integer
+            found = [row for row in rows if row]
+            values = self.utxo_db.multi_get([b'u' + hashX + suffix
+                                             for hashX, _code_hash, suffix in found])
+            utxos = dict(zip(found, values))
+            result = []
+            for row in rows:
+                db_value = utxos.get(row) if row else None
+                if db_value:
+                    hashX, codeScriptHash, _suffix = row
+                    value, = unpack_le_uint64(db_value)
+                    result.append((hashX, value, codeScriptHash))
+                else:
+                    # Hot outputs may have been spent since
+                    result.append(None)
+            return result
 
-                # Key: b'h' + compressed_tx_hash + tx_idx + tx_num
-                # Value: hashX
-                prefix = b'h' + tx_hash[:4] + idx_packed
-
-                # Find which entry, if any, the TX_HASH matches.
-                for db_key, hashX_with_codescripthash in self.utxo_db.iterator(prefix=prefix):
-                    hashX = hashX_with_codescripthash[:HASHX_LEN]
-                    tx_num_packed = db_key[-5:]
-                    tx_num, = unpack_le_uint64(tx_num_packed + bytes(3))
-                    fs_hash, _height = self.fs_tx_hash(tx_num)
-                    if fs_hash == tx_hash:
-                        return hashX, idx_packed + tx_num_packed
-                return None, None
-            return [lookup_hashX(*prevout) for prevout in prevouts]
-
-        def lookup_utxos(hashX_pairs):
-            def lookup_utxo(hashX, suffix):
-                if not hashX:
-                    # This can happen when the daemon is a block ahead
-                    # of us and has mempool txs spending outputs from
-                    # that new block
-                    return None
-                # Key: b'u' + address_hashX + tx_idx + tx_num
-                # Value: the UTXO value as a 64-bit unsigned integer
-                key = b'u' + hashX + suffix
-                db_value = self.utxo_db.get(key)
-                if not db_value:
-                    # This can happen if the DB was updated between
-                    # getting the hashXs and getting the UTXOs
-                    return None
-                value, = unpack_le_uint64(db_value)
-                return hashX, value
-            return [lookup_utxo(*hashX_pair) for hashX_pair in hashX_pairs]
-
-        hashX_pairs = await run_in_thread(lookup_hashXs)
-        return await run_in_thread(lookup_utxos, hashX_pairs)
+        return await self.executors.run(INTERNAL, lookup_utxos)
 
     def outpoint_to_str(self, outpoint):
         num, = unpack_le_uint32_from(outpoint[32:])
@@ -858,12 +1280,9 @@ class DB(object):
         key = b'rl' + ref
         return self.utxo_db.get(key)
 
-    def get_refs_by_outpoint(self, outpoint): 
+    def _refs(self, value):
+        '''Return the refs of a b'ri' row value.'''
         refs = []
-        key = b'ri' + outpoint
-        value = self.utxo_db.get(key)
-        if not value:
-            return []
         for x in range(0, len(value), 37):
             ref_id = self.outpoint_to_str(value[x : x + 36])
             type_byte = value[x + 36: x + 37]
@@ -878,4 +1297,20 @@ class DB(object):
                 'ref': ref_id,
                 'type': ref_type
             })
-        return refs
\ No newline at end of file
+        return refs
+
+    def get_refs_by_outpoint(self, outpoint):
+        key = b'ri' + outpoint
+        value = self.utxo_db.get(key)
+        if not value:
+            return []
+        return self._refs(value)
+
+    async def refs_by_outpoints(self, outpoints):
+        '''Return a list of the refs of each outpoint, read in one batch.'''
+        def read_refs():
+            values = self.utxo_db.multi_get([b'ri' + outpoint for outpoint in outpoints])
+            return [self._refs(value) if value else [] for value in values]
+
+        kind = EXPENSIVE if len(outpoints) >= self.EXPENSIVE_ROWS else CHEAP
+        return await self.executors.run(kind, read_refs)
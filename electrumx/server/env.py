@@ -72,6 +72,17 @@ class Env(EnvBase):
         self.drop_client = self.custom("DROP_CLIENT", None, re.compile)
         self.cache_MB = self.integer('CACHE_MB', 1200)
         self.reorg_limit = self.integer('REORG_LIMIT', self.coin.REORG_LIMIT)
+        self.tx_store = self.boolean('TX_STORE', False)
+        self.tx_cache_MB = self.integer('TX_CACHE_MB', 50)
+        self.daemon_zmq_url = self.default('DAEMON_ZMQ_URL', None)
+        self.mempool_reconcile_secs = self.integer('MEMPOOL_RECONCILE_SECS', 60)
+        self.mempool_processes = self.integer('MEMPOOL_PROCESSES', 0)
+        self.mempool_snapshot = self.boolean('MEMPOOL_SNAPSHOT', True)
+        self.mempool_snapshot_secs = self.integer('MEMPOOL_SNAPSHOT_SECS', 0)
+        self.mempool_max_mb = self.integer('MEMPOOL_MAX_MB', 0)
+        self.internal_threads = self.integer('INTERNAL_THREADS', 2)
+        self.cheap_query_threads = self.integer('CHEAP_QUERY_THREADS', 4)
+        self.expensive_query_threads = self.integer('EXPENSIVE_QUERY_THREADS', 2)
 
         # Server limits to help prevent DoS
 
@@ -93,6 +104,8 @@ class Env(EnvBase):
             self.ssl_certfile = self.required('SSL_CERTFILE')
             self.ssl_keyfile = self.required('SSL_KEYFILE')
         self.report_services = self.services_to_report()
+        self.metrics_host = self.default('METRICS_HOST', 'localhost')
+        self.metrics_port = self.integer('METRICS_PORT', None)
 
         # Fail-closed startup guards (env finalized above)
         self.check_startup_guards()
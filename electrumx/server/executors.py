@@ -0,0 +1,109 @@
+# Copyright (c) 2026, the ElectrumX authors
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Thread pools for blocking DB work.'''
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+# Pool names.  Internal work is done on behalf of the server itself, such as
+# mempool prevout lookups; client queries are split by their estimated cost
+# so cheap ones do not queue behind large scans.
+INTERNAL = 'internal'
+CHEAP = 'cheap'
+EXPENSIVE = 'expensive'
+
+
+class ExecutorPool(object):
+    '''A thread pool that keeps queue depth and latency statistics.
+
+    Statistics are only updated in the event loop thread.
+    '''
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix=f'{name}-pool')
+        self.pending = 0
+        self.completed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_latency = 0.0
+
+    async def run(self, func, *args):
+        '''Run func(*args) in the pool and return its result.'''
+        times = []
+
+        def timed_call():
+            times.append(time.monotonic())
+            try:
+                return func(*args)
+            finally:
+                times.append(time.monotonic())
+
+        loop = asyncio.get_event_loop()
+        submitted = time.monotonic()
+        self.pending += 1
+        try:
+            # A call still queued when the caller is cancelled is dropped
+            return await loop.run_in_executor(self.executor, timed_call)
+        finally:
+            self.pending -= 1
+            self._account(submitted, times)
+
+    def _account(self, submitted, times):
+        if len(times) != 2:
+            # Cancelled, or still running after its caller was cancelled
+            return
+        started, finished = times
+        self.completed += 1
+        self.wait_time += started - submitted
+        self.run_time += finished - started
+        self.max_latency = max(self.max_latency, finished - submitted)
+
+    def info(self):
+        completed = max(self.completed, 1)
+        return {
+            'threads': self.max_workers,
+            'pending': self.pending,
+            'completed': self.completed,
+            'avg wait ms': round(self.wait_time * 1000 / completed, 2),
+            'avg run ms': round(self.run_time * 1000 / completed, 2),
+            'max latency ms': round(self.max_latency * 1000, 2),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class ExecutorPools(object):
+    '''The internal, cheap and expensive pools.'''
+
+    def __init__(self, internal_threads, cheap_threads, expensive_threads):
+        self.pools = {
+            INTERNAL: ExecutorPool(INTERNAL, internal_threads),
+            CHEAP: ExecutorPool(CHEAP, cheap_threads),
+            EXPENSIVE: ExecutorPool(EXPENSIVE, expensive_threads),
+        }
+
+    async def run(self, kind, func, *args):
+        '''Run func(*args) in the pool named kind.'''
+        return await self.pools[kind].run(func, *args)
+
+    def runner(self, kind):
+        '''Return a function like aiorpcx's run_in_thread for pool kind.'''
+        return partial(self.run, kind)
+
+    def info(self):
+        return {name: pool.info() for name, pool in self.pools.items()}
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown()
@@ -20,8 +20,10 @@ from electrumx.lib.glyph import (
     is_dmint,
     format_glyph_id,
     parse_glyph_id,
+    unpack_glyph_record,
 )
-from electrumx.lib.hash import hash_to_hex_str
+from electrumx.lib.hash import hash_to_hex_str, hex_str_to_hash
+from electrumx.lib.util import pack_le_uint32
 
 
 class GlyphAPIMixin:
@@ -49,9 +51,41 @@ class GlyphAPIMixin:
         
         try:
             txid, vout = parse_glyph_id(glyph_id)
+            tx_hash = hex_str_to_hash(txid)
+            if len(tx_hash) != 32 or not 0 <= vout < 1 << 32:
+                raise ValueError(glyph_id)
         except (ValueError, IndexError):
             return {'error': 'Invalid glyph_id format. Expected txid:vout'}
         
+        # Envelopes are indexed during block and mempool processing
+        record = self.mempool.glyph_record(tx_hash, vout)
+        if record is None:
+            record = await self.db.glyph_record(tx_hash + pack_le_uint32(vout))
+        if record is not None:
+            envelope = unpack_glyph_record(record)
+            result = {
+                'glyph_id': glyph_id,
+                'txid': txid,
+                'vout': vout,
+                'value': envelope['value'],
+                'height': envelope['height'],
+                'version': envelope['version'],
+                'is_reveal': envelope['is_reveal'],
+            }
+            for field in ('commit_hash', 'content_root', 'controller'):
+                if field in envelope:
+                    result[field] = envelope[field]
+            return result
+
+        # Blocks from before the index was added are only in the daemon.
+        # Transactions the index has seen since then have no envelope at
+        # this output, so don't ask the daemon about them.
+        if not self.db.glyph_height or tx_hash in self.mempool.txs:
+            return None
+        height = await self.db.tx_height(tx_hash)
+        if height is not None and height >= self.db.glyph_height:
+            return None
+
         # Fetch the transaction
         try:
             raw_tx = await self.daemon_request('getrawtransaction', txid, True)
@@ -113,8 +147,15 @@ class GlyphAPIMixin:
         except ValueError:
             return {'error': 'Invalid hex in ref'}
         
-        # Query the database for UTXOs with this reference
+        # Query the database for UTXOs with this reference, dropping those
+        # spent in the mempool and adding unconfirmed ones
         utxos = await self.db.get_utxos_by_ref(ref_bytes)
+        utxos.extend(await self.mempool.ref_unordered_UTXOs(ref_bytes))
+        spends = set()
+        for hashX in {utxo.hashX for utxo in utxos}:
+            spends.update(await self.mempool.potential_spends(hashX))
+        utxos = [utxo for utxo in utxos if (utxo.tx_hash, utxo.tx_pos) not in spends]
+        self.bump_cost(len(utxos) / 50)
         
         result = []
         for utxo in utxos:
@@ -188,14 +188,24 @@ class History(object):
 
         self.logger.info(f'backing up removed {nremoves:,d} history entries')
 
-    def get_txnums(self, hashX, limit=1000, reverse=False):
+    def get_txnums(self, hashX, limit=1000, reverse=False, start_tx_num=None):
         '''Generator that returns an unpruned, sorted list of tx_nums in the
         history of a hashX.  Includes both spending and receiving
         transactions.  By default yields at most 1000 entries.  Set
-        limit to None to get them all.  '''
+        limit to None to get them all.
+
+        If start_tx_num is not None, the read begins at the first tx_num
+        at or after it (at or before it if reverse is True).  Rows that
+        lie wholly outside the range are skipped without unpacking them.
+        '''
         limit = util.resolve_limit(limit)
         chunks = util.chunks
         for _key, hist in self.db.iterator(prefix=hashX, reverse=reverse):
+            if start_tx_num is not None:
+                hist = self._trim_row(hist, start_tx_num, reverse)
+                if not hist:
+                    continue
+                start_tx_num = None
             for tx_numb in chunks(hist, 5, reverse):
                 if limit == 0:
                     return
@@ -203,6 +213,43 @@ class History(object):
                 yield tx_num
                 limit -= 1
 
+    @staticmethod
+    def _trim_row(hist, start_tx_num, reverse):
+        '''Return the part of a history row that lies in range of
+        start_tx_num.  Rows hold ascending 5-byte little-endian tx_nums.'''
+        def tx_num_at(n):
+            return unpack_le_uint64(hist[n * 5: n * 5 + 5] + bytes(3))[0]
+
+        count = len(hist) // 5
+        if reverse:
+            if tx_num_at(0) > start_tx_num:
+                return b''
+            if tx_num_at(count - 1) <= start_tx_num:
+                return hist
+            # First index whose tx_num exceeds start_tx_num
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if tx_num_at(mid) <= start_tx_num:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return hist[:lo * 5]
+
+        if tx_num_at(count - 1) < start_tx_num:
+            return b''
+        if tx_num_at(0) >= start_tx_num:
+            return hist
+        # First index whose tx_num is at least start_tx_num
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tx_num_at(mid) < start_tx_num:
+                lo = mid + 1
+            else:
+                hi = mid
+        return hist[lo * 5:]
+
     #
     # History compaction
     #
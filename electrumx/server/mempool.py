@@ -7,30 +7,189 @@
 
 '''Mempool handling.'''
 
+import asyncio
 import itertools
+import math
+import multiprocessing
+import os
+import pickle
 import time
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heapify, heappop, heappush
+from struct import Struct
+from sys import getsizeof
 
 import attr
-from aiorpcx import TaskGroup, run_in_thread, sleep
+from aiorpcx import Event, TaskGroup, ignore_after, run_in_thread, sleep
 
-from electrumx.lib.hash import hash_to_hex_str, hex_str_to_hash
+from electrumx.lib.glyph import find_glyph_magic, pack_glyph_record, parse_glyph_envelope
+from electrumx.lib.hash import HASHX_LEN, hash_to_hex_str, hex_str_to_hash
 from electrumx.lib.util import class_logger, chunks, pack_le_uint32, unpack_le_uint32_from
 from electrumx.lib.script import Script
-from electrumx.server.db import UTXO
+from electrumx.server.db import RefUTXO, UTXO
+from electrumx.server.metrics import metrics
+
+try:
+    import zmq
+    import zmq.asyncio
+except ImportError:
+    zmq = None
+
+
+# A pair is a (hashX, value) tuple.  Those of a transaction are stored
+# packed in a bytes object.
+PAIR = Struct(f'<{HASHX_LEN}sQ')
+unpack_pairs = PAIR.iter_unpack
+
+
+def pack_pairs(pairs):
+    '''Return the packed form of an iterable of (hashX, value) pairs.'''
+    pack = PAIR.pack
+    return b''.join(pack(hashX, value) for hashX, value in pairs)
+
+
+def encode_refs(all_refs, normal_refs, singleton_refs):
+    '''Return the refs of an output script, as returned by
+    Script.get_push_input_refs, encoded as for outpointToRefs: each ref
+    followed by a type byte, 0 for normal and 1 for singleton.'''
+    normal_refs_dedup = Script.dedup_refs(normal_refs)
+    singleton_refs_dedup = Script.dedup_refs(singleton_refs)
+    parts = []
+    for ref_id in Script.dedup_refs(all_refs):
+        # check if it's a singleton ref by first ensuring it's not in the normal refs map
+        if normal_refs_dedup.get(ref_id):
+            parts.append(ref_id + b'\0')
+        else:
+            assert singleton_refs_dedup.get(ref_id)
+            parts.append(ref_id + b'\1')
+    return b''.join(parts)
 
 
 @attr.s(slots=True)
 class MemPoolTx(object):
     prevouts = attr.ib()
-    # A pair is a (hashX, value) tuple
+    # Packed pairs; in_pairs is None until the tx is accepted
     in_pairs = attr.ib()
     out_pairs = attr.ib()
     fee = attr.ib()
     size = attr.ib()
-    out_srefs = attr.ib()
-    idx_to_script = attr.ib()   # Track full output script at given output index
+    # The distinct hashXs of refs minted or carried by the outputs
+    sref_hashXs = attr.ib()
+    # (output index, encoded refs) pairs of the outputs with refs
+    out_refs = attr.ib()
+    # The concatenated codeScriptHashes of the outputs
+    out_code_hashes = attr.ib(default=b'')
+    # The distinct codeScriptHashes of the inputs and outputs; set when
+    # the tx is accepted
+    code_hashes = attr.ib(default=())
+    # (output index, Glyph envelope record) pairs
+    glyphs = attr.ib(default=())
+
+    def out_pair(self, index):
+        '''Return the packed pair of an output.  Raises KeyError if there
+        is no such output.'''
+        start = index * PAIR.size
+        pair = self.out_pairs[start: start + PAIR.size]
+        if len(pair) != PAIR.size:
+            raise KeyError(index)
+        return pair
+
+    def out_code_hash(self, index):
+        '''Return the codeScriptHash of an output.'''
+        return self.out_code_hashes[index * 32: index * 32 + 32]
+
+    def memsize(self):
+        '''Return the approximate memory used by the transaction.'''
+        return (getsizeof(self) + getsizeof(self.prevouts)
+                + sum(getsizeof(prevout) + getsizeof(prevout[0]) + getsizeof(prevout[1])
+                      for prevout in self.prevouts)
+                + getsizeof(self.in_pairs) + getsizeof(self.out_pairs)
+                + getsizeof(self.sref_hashXs)
+                + sum(getsizeof(hashX) for hashX in self.sref_hashXs)
+                + getsizeof(self.out_refs)
+                + sum(getsizeof(item) + getsizeof(item[1]) for item in self.out_refs)
+                + getsizeof(self.out_code_hashes) + getsizeof(self.code_hashes)
+                + sum(getsizeof(code_hash) for code_hash in self.code_hashes)
+                + getsizeof(self.glyphs)
+                + sum(getsizeof(item) + getsizeof(item[1]) for item in self.glyphs))
+
+
+# Fee rates, in sats per byte, are grouped in buckets about 5% wide.  A
+# bucket is keyed by its lowest rate to 3 significant figures.
+FEE_BUCKET_LOG = math.log(1.05)
+
+
+def fee_bucket(fee, size):
+    '''Return the histogram bucket of a transaction's fee rate.'''
+    rate = fee / size
+    if rate < 1:
+        return 0.0
+    return float(f'{math.exp(math.floor(math.log(rate) / FEE_BUCKET_LOG) * FEE_BUCKET_LOG):.3g}')
+
+
+def deserialize_txs(coin, hashes, raw_txs):
+    '''Return a map from tx hash to MemPoolTx of the raw transactions.
+    If hashes is None the hashes are calculated.
+
+    This function is pure so can run in another thread or process.'''
+    to_hashX = coin.hashX_from_script
+    to_code_hash = coin.codeScriptHash_from_script
+    deserializer = coin.DESERIALIZER
+
+    txs = {}
+    if hashes is None:
+        hashes = itertools.repeat(None)
+    for tx_hash, raw_tx in zip(hashes, raw_txs):
+        # The daemon may have evicted the tx from its
+        # mempool or it may have gotten in a block
+        if not raw_tx:
+            continue
+        if tx_hash is None:
+            tx, tx_hash = deserializer(raw_tx).read_tx_and_hash()
+            tx_size = len(raw_tx)
+        else:
+            tx, tx_size = deserializer(raw_tx).read_tx_and_vsize()
+        # Convert the inputs and outputs into (hashX, value) pairs
+        # Drop generation-like inputs from MemPoolTx.prevouts
+        txin_pairs = tuple((txin.prev_hash, txin.prev_idx)
+                           for txin in tx.inputs
+                           if not txin.is_generation())
+        txout_pairs = pack_pairs((to_hashX(Script.zero_refs(txout.pk_script)), txout.value)
+                                 for txout in tx.outputs)
+        out_code_hashes = b''.join(to_code_hash(txout.pk_script) for txout in tx.outputs)
+
+        sref_hashXs = {}
+        out_refs = []
+        glyphs = []
+        for out_idx, txout in enumerate(tx.outputs):
+            if find_glyph_magic(txout.pk_script) != -1:
+                envelope = parse_glyph_envelope(txout.pk_script)
+                if envelope:
+                    glyphs.append((out_idx, pack_glyph_record(envelope, 0, txout.value)))
+
+            all_refs, normal_refs, singleton_refs = Script.get_push_input_refs(txout.pk_script)
+            if not all_refs:
+                continue
+            out_refs.append((out_idx, encode_refs(all_refs, normal_refs, singleton_refs)))
+
+            normal_mints = []
+            for ref in normal_refs[0:3]:
+                for txin in tx.inputs:
+                    if txin.prev_hash == ref[:32] and pack_le_uint32(txin.prev_idx) == ref[32:]:
+                        normal_mints.append(ref)
+
+            # Track all refs
+            for ref in normal_mints + singleton_refs:
+                sref_hashXs[to_hashX(ref)] = None
+
+        txs[tx_hash] = MemPoolTx(txin_pairs, None, txout_pairs, 0, tx_size,
+                                 tuple(sref_hashXs), tuple(out_refs), out_code_hashes,
+                                 glyphs=tuple(glyphs))
+
+    return txs
+
 
 @attr.s(slots=True)
 class MemPoolTxSummary(object):
@@ -75,8 +234,8 @@ class MemPoolAPI(ABC):
 
     @abstractmethod
     async def lookup_utxos(self, prevouts):
-        '''Return a list of (hashX, value) pairs each prevout if unspent,
-        otherwise return None if spent or not found.
+        '''Return a list of (hashX, value, codeScriptHash) tuples for each
+        prevout if unspent, otherwise return None if spent or not found.
 
         prevouts - an iterable of (hash, index) pairs
         '''
@@ -102,18 +261,73 @@ class MemPool(object):
        hashXs: hashX   -> set of all hashes of txs touching the hashX
     '''
 
-    def __init__(self, coin, api, refresh_secs=5.0, log_status_secs=60.0):
+    # Pushed transactions held before a reconciliation is forced instead
+    MAX_PUSHED = 10_000
+    # Pushed transactions are accepted once the feed has been quiet this
+    # long, or once the first has waited PUSH_MAX_DELAY seconds
+    PUSH_QUIET_SECS = 0.1
+    PUSH_MAX_DELAY = 1.0
+    SNAPSHOT_VERSION = 3
+    # Approximate memory of an index entry: a slot in a set or dict and its
+    # share of the container
+    INDEX_ENTRY_SIZE = 100
+
+    def __init__(self, coin, api, refresh_secs=5.0, log_status_secs=60.0,
+                 runner=run_in_thread, zmq_url=None, reconcile_secs=60.0,
+                 processes=0, snapshot_path=None, snapshot_secs=0, max_mb=0):
         assert isinstance(api, MemPoolAPI)
         self.coin = coin
         self.api = api
+        # Runs blocking work in another thread
+        self.runner = runner
+        # If non-zero, transactions are deserialized in a pool of this many
+        # processes while synchronized
+        self.processes = processes
+        self._process_pool = None
         self.logger = class_logger(__name__, self.__class__.__name__)
         self.txs = {}
         self.hashXs = defaultdict(set)              # None can be a key
-        self.outpointToRefs = defaultdict(set)      # None can be a key
-        self.codeScriptHashes = defaultdict(set)    # None can be a key
-        self.srefs = defaultdict(list) # Ordered list to keep track of first and last srefs transactions
+        self.outpointToRefs = {}
+        # ref -> set of the unconfirmed outpoints carrying it
+        self.refToOutpoints = defaultdict(set)
+        # codeScriptHash -> set of hashes of txs spending or paying to it
+        self.codeScriptHashes = defaultdict(set)
+        # tx_hash -> set of hashes of the mempool txs spending its outputs
+        self.spenders = defaultdict(set)
+        # Ordered sets, as dicts, to keep track of first and last srefs transactions
+        self.srefs = defaultdict(dict)
+        # Fee rate bucket -> total size of txs; see fee_bucket()
+        self.fee_histogram = defaultdict(int)
+        self.cached_compact_histogram = []
+        self._histogram_time = 0
         self.refresh_secs = refresh_secs
         self.log_status_secs = log_status_secs
+        # If set, transactions are pushed by the daemon's ZMQ feed and the
+        # full mempool is only reconciled every reconcile_secs, or when a
+        # block arrives
+        self.zmq_url = zmq_url
+        self.reconcile_secs = reconcile_secs
+        self._pushed = []
+        self._refresh_requested = False
+        self._wakeup = Event()
+        # Transactions dropped because an input could not be found
+        self.orphan_count = 0
+        # If snapshot_path is set the mempool is saved there on shutdown,
+        # and every snapshot_secs if non-zero, and loaded on startup
+        self.snapshot_path = snapshot_path
+        self.snapshot_secs = snapshot_secs
+        # The DB height the mempool was last synchronized at
+        self.synced_height = None
+        # If max_memsize is non-zero, transactions are evicted from the
+        # indexes to keep their approximate memory, memsize, within it
+        self.max_memsize = max_mb * 1_000_000
+        self.memsize = 0
+        # A heap of (fee rate, tx_hash) pairs of the txs, kept if there is a
+        # budget.  Entries of removed txs are skipped when popped.
+        self._fee_order = []
+        # Hashes of daemon mempool txs not indexed because of the budget,
+        # mapped to their (fee rate, memsize) pairs
+        self.evicted = {}
 
     async def _logging(self, synchronized_event):
         '''Print regular logs of mempool stats.'''
@@ -125,38 +339,70 @@ class MemPool(object):
         self.logger.info(f'synced in {elapsed:.2f}s')
         while True:
             mempool_size = sum(tx.size for tx in self.txs.values()) / 1_000_000
+            tx_memsize = self.memsize // max(len(self.txs), 1)
             self.logger.info(f'{len(self.txs):,d} txs {mempool_size:.2f} MB '
-                             f'touching {len(self.hashXs):,d} addresses')
+                             f'touching {len(self.hashXs):,d} addresses, '
+                             f'{tx_memsize:,d} bytes of memory per tx')
+            if self.evicted:
+                self.logger.info(f'{len(self.evicted):,d} txs not indexed to keep '
+                                 f'within the memory budget')
             await sleep(self.log_status_secs)
             await synchronized_event.wait()
 
+    @staticmethod
+    def _topological_order(tx_map):
+        '''Return the hashes of the transactions in tx_map ordered so that
+        each comes after any parents in tx_map.  Transactions in a cycle,
+        which cannot be valid, are omitted.'''
+        children = defaultdict(list)
+        parent_counts = {}
+        for tx_hash, tx in tx_map.items():
+            parents = {prev_hash for prev_hash, _ in tx.prevouts if prev_hash in tx_map}
+            parent_counts[tx_hash] = len(parents)
+            for parent in parents:
+                children[parent].append(tx_hash)
+
+        order = [tx_hash for tx_hash, count in parent_counts.items() if not count]
+        # The list grows as it is iterated
+        for tx_hash in order:
+            for child in children.get(tx_hash, ()):
+                parent_counts[child] -= 1
+                if not parent_counts[child]:
+                    order.append(child)
+        return order
+
     def _accept_transactions(self, tx_map, utxo_map, touched):
         '''Accept transactions in tx_map to the mempool if all their inputs
         can be found in the existing mempool or a utxo_map from the
-        DB.
+        DB.  Transactions are accepted in topological order, so one pass
+        suffices.
 
         Returns an (unprocessed tx_map, unspent utxo_map) pair.
         '''
-        hashXs = self.hashXs
-        outpointToRefs = self.outpointToRefs
-        codeScriptHashes = self.codeScriptHashes # not used yet
-        srefs = self.srefs
         txs = self.txs
-        to_le_uint32 = pack_le_uint32
+        pack_pair = PAIR.pack
 
-        deferred = {}
+        order = self._topological_order(tx_map)
+        deferred = {tx_hash: tx_map[tx_hash] for tx_hash in set(tx_map).difference(order)}
         unspent = set(utxo_map)
         # Try to find all prevouts so we can accept the TX
-        for tx_hash, tx in tx_map.items():
+        for tx_hash in order:
+            tx = tx_map[tx_hash]
             in_pairs = []
+            code_hashes = {}
             try:
                 for prevout in tx.prevouts:
                     utxo = utxo_map.get(prevout)
-                    if not utxo:
+                    if utxo:
+                        hashX, value, code_hash = utxo
+                        in_pairs.append(pack_pair(hashX, value))
+                    else:
                         prev_hash, prev_index = prevout
                         # Raises KeyError if prev_hash is not in txs
-                        utxo = txs[prev_hash].out_pairs[prev_index]
-                    in_pairs.append(utxo)
+                        parent = txs[prev_hash]
+                        in_pairs.append(parent.out_pair(prev_index))
+                        code_hash = parent.out_code_hash(prev_index)
+                    code_hashes[code_hash] = None
             except KeyError:
                 deferred[tx_hash] = tx
                 continue
@@ -165,46 +411,16 @@ class MemPool(object):
             unspent.difference_update(tx.prevouts)
 
             # Save the in_pairs, compute the fee and accept the TX
-            tx.in_pairs = tuple(in_pairs)
+            tx.in_pairs = b''.join(in_pairs)
             # Avoid negative fees if dealing with generation-like transactions
             # because some in_parts would be missing
-            tx.fee = max(0, (sum(v for _, v in tx.in_pairs) -
-                             sum(v for _, v in tx.out_pairs)))
-            txs[tx_hash] = tx
-
-            for hashX, _value in itertools.chain(tx.in_pairs, tx.out_pairs):
-                touched.add(hashX)
-                hashXs[hashX].add(tx_hash)
-
-            for ref_hashes in tx.out_srefs:
-                if ref_hashes:
-                    for ref_hash in ref_hashes:
-                        touched.add(ref_hash)
-                        hashXs[ref_hash].add(tx_hash)
-                        if tx_hash not in srefs[ref_hash]:
-                            srefs[ref_hash].append(tx_hash)
-
-            # Check every output script for refs to build up the outpointToRefs map for quickly enumering which refs
-            # are associated with each outpoint for the purposes of returning refs for unconfirmed utxos in mempool
-            out_idx = 0
-            for pk_script in tx.idx_to_script:
-                all_refs, normal_refs, singleton_refs = Script.get_push_input_refs(pk_script)
-                all_refs_dedup = Script.dedup_refs(all_refs)
-                normal_refs_dedup = Script.dedup_refs(normal_refs)
-                singleton_refs_dedup = Script.dedup_refs(singleton_refs)
-                # Save all the refs if any for the utxo
-                refs_value = b''
-                for ref_id in all_refs_dedup.keys():
-                    enc_ref_type = 0
-                    # check if it's a singleton ref by first ensuring it's not in the normal refs map
-                    if not normal_refs_dedup.get(ref_id):
-                        assert singleton_refs_dedup.get(ref_id)
-                        enc_ref_type = 1
-                    refs_value += ref_id + (enc_ref_type).to_bytes(1, "little")
-                # cache the refs for the outpoint
-                if len(refs_value):
-                    outpointToRefs[tx_hash + to_le_uint32(out_idx)] = refs_value
-                out_idx += 1 
+            tx.fee = max(0, (sum(v for _, v in unpack_pairs(tx.in_pairs)) -
+                             sum(v for _, v in unpack_pairs(tx.out_pairs))))
+            out_code_hashes = tx.out_code_hashes
+            for start in range(0, len(out_code_hashes), 32):
+                code_hashes[out_code_hashes[start: start + 32]] = None
+            tx.code_hashes = tuple(code_hashes)
+            self._add_tx(tx_hash, tx, touched)
 
         return deferred, {prevout: utxo_map[prevout] for prevout in unspent}
 
@@ -214,61 +430,338 @@ class MemPool(object):
         # call transfers ownership
         touched = set()
         while True:
+            self._refresh_requested = False
             height = self.api.cached_height()
             hex_hashes = await self.api.mempool_hashes()
             if height != await self.api.height():
                 continue
             hashes = set(hex_str_to_hash(hh) for hh in hex_hashes)
             try:
-                await self._process_mempool(hashes, touched, height)
+                with metrics.timer('mempool refresh'):
+                    await self._process_mempool(hashes, touched, height)
             except DBSyncError:
                 # The UTXO DB is not at the same height as the
                 # mempool; wait and try again
                 self.logger.debug('waiting for DB to sync')
             else:
+                self.synced_height = height
+                self._update_compact_histogram()
                 synchronized_event.set()
                 synchronized_event.clear()
                 await self.api.on_mempool(touched, height)
                 touched = set()
+            await self._wait_for_refresh()
+
+    async def _wait_for_refresh(self):
+        '''Wait until the next full refresh is due.  Transactions pushed by
+        the daemon are accepted meanwhile.'''
+        if self.zmq_url is None:
             await sleep(self.refresh_secs)
+            return
+
+        deadline = time.monotonic() + self.reconcile_secs
+        while not self._refresh_requested:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or not await ignore_after(timeout, self._wakeup.wait()):
+                break
+            self._wakeup.clear()
+            await self._wait_for_quiet_feed()
+            raw_txs, self._pushed = self._pushed, []
+            if raw_txs and not self._refresh_requested:
+                touched = set()
+                height = self.api.cached_height()
+                if await self._process_pushed(raw_txs, touched, height):
+                    if time.monotonic() - self._histogram_time >= self.refresh_secs:
+                        self._update_compact_histogram()
+                    await self.api.on_mempool(touched, height)
+
+    async def _wait_for_quiet_feed(self):
+        '''Wait for a lull in the daemon's feed.  It publishes every
+        transaction of a new block just before the block itself, and those
+        are dropped when the block arrives rather than accepted.'''
+        deadline = time.monotonic() + self.PUSH_MAX_DELAY
+        while not self._refresh_requested:
+            timeout = min(self.PUSH_QUIET_SECS, deadline - time.monotonic())
+            if timeout <= 0 or not await ignore_after(timeout, self._wakeup.wait()):
+                break
+            self._wakeup.clear()
+
+    def _on_push(self, topic, body):
+        '''Handle a message from the daemon's ZMQ feed.'''
+        if topic == b'rawtx' and len(self._pushed) < self.MAX_PUSHED:
+            self._pushed.append(body)
+        else:
+            # The transactions of a new block are published just before
+            # it; drop those pending and reconcile with the daemon
+            self._pushed.clear()
+            self._refresh_requested = True
+        self._wakeup.set()
+
+    async def _zmq_feed(self):
+        '''Receive rawtx and hashblock messages from the daemon.'''
+        context = zmq.asyncio.Context.instance()
+        socket = context.socket(zmq.SUB)
+        try:
+            socket.connect(self.zmq_url)
+            for topic in (b'rawtx', b'hashblock'):
+                socket.setsockopt(zmq.SUBSCRIBE, topic)
+            self.logger.info(f'subscribed to ZMQ feed at {self.zmq_url}')
+            while True:
+                topic, body, *_rest = await socket.recv_multipart()
+                self._on_push(topic, body)
+        finally:
+            socket.close(linger=0)
+
+    async def _process_pushed(self, raw_txs, touched, mempool_height):
+        '''Accept raw transactions pushed by the daemon.  Those already in
+        the mempool, evicted from it, or coinbases are ignored.
+
+        Returns False if the DB is not synced with the daemon; the next
+        full refresh accepts the transactions instead.
+        '''
+        if mempool_height != self.api.db_height():
+            return False
+        tx_map = await self._deserialize(None, raw_txs)
+        txs = self.txs
+        evicted = self.evicted
+        # A tx without prevouts is a coinbase published with its block
+        for tx_hash in [tx_hash for tx_hash, tx in tx_map.items()
+                        if tx_hash in txs or tx_hash in evicted or not tx.prevouts]:
+            del tx_map[tx_hash]
 
-    async def _process_mempool(self, all_hashes, touched, mempool_height):
-        # Re-sync with the new set of hashes
+        prevouts = tuple(prevout for tx in tx_map.values()
+                         for prevout in tx.prevouts
+                         if prevout[0] not in txs and prevout[0] not in tx_map)
+        utxos = await self.api.lookup_utxos(prevouts)
+        if mempool_height != self.api.db_height():
+            return False
+        utxo_map = {prevout: utxo for prevout, utxo in zip(prevouts, utxos)}
+
+        tx_map, _utxo_map = self._accept_transactions(tx_map, utxo_map, touched)
+        self._drop_orphans(tx_map)
+        self._evict(touched)
+        return True
+
+    def _drop_orphans(self, tx_map):
+        '''Drop transactions that could not be accepted.  Descendants of
+        evicted transactions are evicted too.  The others are orphans, with
+        an input neither in the DB nor the mempool; count and log them.'''
+        evicted = self.evicted
+        if evicted:
+            for tx_hash in self._topological_order(tx_map):
+                tx = tx_map[tx_hash]
+                if any(prev_hash in evicted for prev_hash, _ in tx.prevouts):
+                    # Its fee is not known
+                    evicted[tx_hash] = (0, tx.memsize())
+            orphans = len(set(tx_map).difference(evicted))
+        else:
+            orphans = len(tx_map)
+        if orphans:
+            self.orphan_count += orphans
+            self.logger.error(f'{orphans:,d} orphan txs dropped')
+
+    def _evict(self, touched):
+        '''If over the memory budget, remove the transactions with the lowest
+        fee rates, and their descendants, from the indexes until within 90%
+        of it.  The daemon's mempool is unaffected.'''
+        if not self.max_memsize or self.memsize <= self.max_memsize:
+            return
         txs = self.txs
+        fee_order = self._fee_order
+        target = self.max_memsize * 0.9
+        count = 0
+        while self.memsize > target and fee_order:
+            _fee_rate, tx_hash = heappop(fee_order)
+            stack = [tx_hash]
+            while stack:
+                tx_hash = stack.pop()
+                tx = txs.get(tx_hash)
+                if tx is not None:
+                    stack.extend(self._children(tx_hash))
+                    self.evicted[tx_hash] = (tx.fee / tx.size, self._indexed_memsize(tx))
+                    self._remove_tx(tx_hash, touched)
+                    count += 1
+        self.logger.warning(f'evicted {count:,d} txs with the lowest fee rates to keep '
+                            f'within the {self.max_memsize // 1_000_000:,d} MB budget')
+
+    def _children(self, tx_hash):
+        '''Return the hashes of the mempool txs spending outputs of tx_hash.'''
+        return set(self.spenders.get(tx_hash, ()))
+
+    def _forget_evicted(self):
+        '''Forget the evicted txs, highest fee rate first, that there is now
+        room for so that they are fetched again.'''
+        room = self.max_memsize * 0.9 - self.memsize
+        if room <= 0:
+            return
+        evicted = self.evicted
+        for tx_hash, (_fee_rate, memsize) in sorted(evicted.items(), reverse=True,
+                                                    key=lambda item: item[1][0]):
+            if memsize > room:
+                break
+            room -= memsize
+            del evicted[tx_hash]
+
+    def _indexed_memsize(self, tx):
+        '''Return the approximate memory used by an accepted transaction and
+        its entries in the indexes.'''
+        tx_hashXs = set(hashX for hashX, _value in unpack_pairs(tx.in_pairs))
+        tx_hashXs.update(hashX for hashX, _value in unpack_pairs(tx.out_pairs))
+        ref_count = sum(len(refs_value) // 37 for _out_idx, refs_value in tx.out_refs)
+        prev_hashes = set(prev_hash for prev_hash, _ in tx.prevouts)
+        # hashXs and srefs, codeScriptHashes, spenders, outpointToRefs and
+        # refToOutpoints
+        entries = (len(tx_hashXs) + 2 * len(tx.sref_hashXs) + len(tx.code_hashes)
+                   + len(prev_hashes) + len(tx.out_refs) + ref_count)
+        # The outpoint and ref keys
+        keys = (len(tx.out_refs) + ref_count) * getsizeof(bytes(36))
+        return tx.memsize() + entries * self.INDEX_ENTRY_SIZE + keys
+
+    def _add_tx(self, tx_hash, tx, touched):
+        '''Add an accepted transaction to the mempool and its indexes.'''
         hashXs = self.hashXs
-        codeScriptHashes = self.codeScriptHashes # not used yet
+        self.txs[tx_hash] = tx
+        self.memsize += self._indexed_memsize(tx)
+        self.fee_histogram[fee_bucket(tx.fee, tx.size)] += tx.size
+        if self.max_memsize:
+            fee_order = self._fee_order
+            if len(fee_order) > 2 * len(self.txs) + 1000:
+                # Drop the entries of removed txs
+                fee_order[:] = [(other.fee / other.size, other_hash)
+                                for other_hash, other in self.txs.items()
+                                if other_hash != tx_hash]
+                heapify(fee_order)
+            heappush(fee_order, (tx.fee / tx.size, tx_hash))
+
+        for hashX, _value in itertools.chain(unpack_pairs(tx.in_pairs),
+                                             unpack_pairs(tx.out_pairs)):
+            touched.add(hashX)
+            hashXs[hashX].add(tx_hash)
+
+        srefs = self.srefs
+        for ref_hash in tx.sref_hashXs:
+            touched.add(ref_hash)
+            hashXs[ref_hash].add(tx_hash)
+            srefs[ref_hash][tx_hash] = None
+
+        codeScriptHashes = self.codeScriptHashes
+        for code_hash in tx.code_hashes:
+            codeScriptHashes[code_hash].add(tx_hash)
+
+        spenders = self.spenders
+        for prev_hash, _prev_idx in tx.prevouts:
+            spenders[prev_hash].add(tx_hash)
+
+        # Cache the refs of outputs for quickly returning refs for
+        # unconfirmed utxos in mempool
         outpointToRefs = self.outpointToRefs
-        to_le_uint32 = pack_le_uint32
+        refToOutpoints = self.refToOutpoints
+        for out_idx, refs_value in tx.out_refs:
+            outpoint = tx_hash + pack_le_uint32(out_idx)
+            outpointToRefs[outpoint] = refs_value
+            for n in range(0, len(refs_value), 37):
+                refToOutpoints[refs_value[n: n + 36]].add(outpoint)
+
+    def _remove_tx(self, tx_hash, touched):
+        '''Remove a transaction from the mempool and its indexes.'''
+        hashXs = self.hashXs
         srefs = self.srefs
+        tx = self.txs.pop(tx_hash)
+        self.memsize -= self._indexed_memsize(tx)
+        tx_hashXs = set(hashX for hashX, value in unpack_pairs(tx.in_pairs))
+        tx_hashXs.update(hashX for hashX, value in unpack_pairs(tx.out_pairs))
+        tx_hashXs.update(tx.sref_hashXs)
+        for hashX in tx_hashXs:
+            hashXs[hashX].remove(tx_hash)
+            if not hashXs[hashX]:
+                del hashXs[hashX]
+        touched.update(tx_hashXs)
+
+        for ref_hash in tx.sref_hashXs:
+            tx_hashes = srefs[ref_hash]
+            tx_hashes.pop(tx_hash, None)
+            if not tx_hashes:
+                del srefs[ref_hash]
+
+        codeScriptHashes = self.codeScriptHashes
+        for code_hash in tx.code_hashes:
+            codeScriptHashes[code_hash].remove(tx_hash)
+            if not codeScriptHashes[code_hash]:
+                del codeScriptHashes[code_hash]
+
+        spenders = self.spenders
+        for prev_hash in set(prev_hash for prev_hash, _ in tx.prevouts):
+            spenders[prev_hash].remove(tx_hash)
+            if not spenders[prev_hash]:
+                del spenders[prev_hash]
+
+        # Remove the outpoints that have disappeared from the mempool from
+        # outpointToRefs, so it only holds unconfirmed outpoints with refs
+        refToOutpoints = self.refToOutpoints
+        for out_idx, refs_value in tx.out_refs:
+            outpoint = tx_hash + pack_le_uint32(out_idx)
+            self.outpointToRefs.pop(outpoint, None)
+            for n in range(0, len(refs_value), 37):
+                ref = refs_value[n: n + 36]
+                outpoints = refToOutpoints.get(ref)
+                if outpoints is not None:
+                    outpoints.discard(outpoint)
+                    if not outpoints:
+                        del refToOutpoints[ref]
+
+        bucket = fee_bucket(tx.fee, tx.size)
+        self.fee_histogram[bucket] -= tx.size
+        if not self.fee_histogram[bucket]:
+            del self.fee_histogram[bucket]
+
+    def _update_compact_histogram(self, bin_size=100_000):
+        '''Recompute the compact fee histogram from the fee rate buckets.
+
+        The compact histogram is a list of (fee_rate, size) pairs in
+        decreasing fee rate order, where size is the total size of txs
+        with fee rates from fee_rate up to the previous pair's.  Pairs
+        cover at least bin_size bytes, the size growing by 10% each
+        pair, so the list is short.
+        '''
+        compact = []
+        cum_size = 0
+        prev_fee_rate = None
+        for fee_rate, size in sorted(self.fee_histogram.items(), reverse=True):
+            # Emit the previous bucket first if this one is a big lump
+            if size > 2 * bin_size and prev_fee_rate is not None and cum_size > 0:
+                compact.append([prev_fee_rate, cum_size])
+                cum_size = 0
+                bin_size *= 1.1
+            cum_size += size
+            if cum_size > bin_size:
+                compact.append([fee_rate, cum_size])
+                cum_size = 0
+                bin_size *= 1.1
+            prev_fee_rate = fee_rate
+        self.cached_compact_histogram = compact
+        self._histogram_time = time.monotonic()
+
+    async def _process_mempool(self, all_hashes, touched, mempool_height):
+        # Re-sync with the new set of hashes
+        txs = self.txs
 
         if mempool_height != self.api.db_height():
             raise DBSyncError
 
         # First handle txs that have disappeared
         for tx_hash in set(txs).difference(all_hashes):
-            tx = txs.pop(tx_hash)
-            tx_hashXs = set(hashX for hashX, value in tx.in_pairs)
-            tx_hashXs.update(hashX for hashX, value in tx.out_pairs)
-            tx_hashXs.update(ref_hash for ref_hashes in tx.out_srefs for ref_hash in ref_hashes)
-            for hashX in tx_hashXs:
-                hashXs[hashX].remove(tx_hash)
-                if not hashXs[hashX]:
-                    del hashXs[hashX]
-                if tx_hash in srefs[hashX]:
-                    srefs[hashX].remove(tx_hash)
-                if not srefs[hashX]:
-                    del srefs[hashX]
-            touched.update(tx_hashXs)
-
-            # Handle the outpoints that have disappeared from the mempool to remove the entries in outpointToRefs
-            # This maintains the outpointToRefs to always contain the unconfirmed mempool outpoints which contain refs
-            out_idx = 0
-            for _pk_script in enumerate(tx.idx_to_script):
-                outpointToRefs.pop(tx_hash + to_le_uint32(out_idx), None)
-                out_idx += 1
-                  
+            self._remove_tx(tx_hash, touched)
+
+        evicted = self.evicted
+        if evicted:
+            for tx_hash in [tx_hash for tx_hash in evicted if tx_hash not in all_hashes]:
+                del evicted[tx_hash]
+            # After a block there may be room for some of them again
+            if mempool_height != self.synced_height:
+                self._forget_evicted()
+
         # Process new transactions
-        new_hashes = list(all_hashes.difference(txs))
+        new_hashes = list(all_hashes.difference(txs).difference(evicted))
         if new_hashes:
             group = TaskGroup()
             for hashes in chunks(new_hashes, 200):
@@ -282,69 +775,105 @@ class MemPool(object):
                 tx_map.update(deferred)
                 utxo_map.update(unspent)
 
-            prior_count = 0
-            # FIXME: this is not particularly efficient
-            while tx_map and len(tx_map) != prior_count:
-                prior_count = len(tx_map)
-                tx_map, utxo_map = self._accept_transactions(tx_map, utxo_map,
-                                                             touched)
-            if tx_map:
-                self.logger.error(f'{len(tx_map)} txs dropped')
+            # Transactions deferred by a chunk are those with a parent in
+            # another chunk, or orphans
+            tx_map, utxo_map = self._accept_transactions(tx_map, utxo_map, touched)
+            self._drop_orphans(tx_map)
+            self._evict(touched)
 
         return touched
 
+    def _snapshot(self):
+        '''Return the mempool state to save in a snapshot.'''
+        return {
+            'version': self.SNAPSHOT_VERSION,
+            'height': self.synced_height,
+            'txs': [(tx_hash, attr.astuple(tx, recurse=False))
+                    for tx_hash, tx in self.txs.items()],
+            'evicted': list(self.evicted.items()),
+        }
+
+    def _write_snapshot(self, snapshot):
+        '''Write a snapshot atomically.  This function is blocking.'''
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _read_snapshot(self):
+        '''Read and delete the snapshot, so it cannot be loaded twice.
+        Return None if there is none.  This function is blocking.'''
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.warning(f'ignoring unreadable mempool snapshot: {e}')
+            snapshot = None
+        os.remove(self.snapshot_path)
+        return snapshot
+
+    async def _load_snapshot(self):
+        '''Load the mempool from the snapshot if it was taken at the DB
+        height.  The first refresh then only fetches new transactions.'''
+        snapshot = await self.runner(self._read_snapshot)
+        if snapshot is None:
+            return
+        if snapshot.get('version') != self.SNAPSHOT_VERSION:
+            self.logger.info('ignoring mempool snapshot of an old version')
+            return
+        if snapshot['height'] != self.api.db_height():
+            self.logger.info(f'ignoring mempool snapshot taken at height '
+                             f'{snapshot["height"]:,d}')
+            return
+        touched = set()
+        for tx_hash, fields in snapshot['txs']:
+            self._add_tx(tx_hash, MemPoolTx(*fields), touched)
+        if self.max_memsize:
+            self.evicted.update(snapshot['evicted'])
+        self.logger.info(f'loaded {len(self.txs):,d} txs from mempool snapshot')
+
+    async def _save_snapshot(self):
+        if self.synced_height is None:
+            return
+        snapshot = self._snapshot()
+        try:
+            await self.runner(self._write_snapshot, snapshot)
+        except OSError as e:
+            self.logger.error(f'error saving mempool snapshot: {e}')
+
+    async def _save_snapshots(self):
+        '''Save a snapshot periodically.'''
+        while True:
+            await sleep(self.snapshot_secs)
+            await self._save_snapshot()
+
+    def _save_snapshot_on_shutdown(self):
+        if self.synced_height is None:
+            return
+        try:
+            self._write_snapshot(self._snapshot())
+        except OSError as e:
+            self.logger.error(f'error saving mempool snapshot: {e}')
+        else:
+            self.logger.info(f'saved {len(self.txs):,d} txs to mempool snapshot')
+
+    async def _deserialize(self, hashes, raw_txs):
+        '''Run deserialize_txs in the process pool if there is one, otherwise
+        in another thread, so as not to block.'''
+        if self._process_pool is None:
+            return await self.runner(deserialize_txs, self.coin, hashes, raw_txs)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._process_pool, deserialize_txs,
+                                          self.coin, hashes, raw_txs)
+
     async def _fetch_and_accept(self, hashes, all_hashes, touched):
         '''Fetch a list of mempool transactions.'''
         hex_hashes_iter = (hash_to_hex_str(hash) for hash in hashes)
         raw_txs = await self.api.raw_transactions(hex_hashes_iter)
 
-        def deserialize_txs():    # This function is pure
-            to_hashX = self.coin.hashX_from_script
-            deserializer = self.coin.DESERIALIZER
-
-            txs = {}
-            for tx_hash, raw_tx in zip(hashes, raw_txs):
-                # The daemon may have evicted the tx from its
-                # mempool or it may have gotten in a block
-                if not raw_tx:
-                    continue
-                tx, tx_size = deserializer(raw_tx).read_tx_and_vsize()
-                # Convert the inputs and outputs into (hashX, value) pairs
-                # Drop generation-like inputs from MemPoolTx.prevouts
-                txin_pairs = tuple((txin.prev_hash, txin.prev_idx)
-                                   for txin in tx.inputs
-                                   if not txin.is_generation())
-                txout_pairs = tuple((to_hashX(Script.zero_refs(txout.pk_script)), txout.value)
-                                    for txout in tx.outputs)
-
-                out_srefs = []
-                out_idx_to_scripts = []
-                for txout in tx.outputs:
-                    out_idx_to_scripts.append(txout.pk_script)
-                    normal_refs, singleton_refs = Script.get_push_input_refs(txout.pk_script)[1:]
-
-                    normal_mints = []
-                    for ref in normal_refs[0:3]:
-                        for txin in tx.inputs:
-                            if txin.prev_hash == ref[:32] and pack_le_uint32(txin.prev_idx) == ref[32:]:
-                                normal_mints.append(ref)
-
-                    # Track all refs
-                    track_refs = normal_mints + singleton_refs
-
-                    if len(track_refs) > 0:
-                        ref_hashes = [to_hashX(ref) for ref in track_refs]
-                        out_srefs.append(ref_hashes)
-                    else:
-                        out_srefs.append([])
-
-                txs[tx_hash] = MemPoolTx(txin_pairs, None, txout_pairs,
-                                         0, tx_size, out_srefs, out_idx_to_scripts)
-
-            return txs
-
-        # Thread this potentially slow operation so as not to block
-        tx_map = await run_in_thread(deserialize_txs)
+        tx_map = await self._deserialize(hashes, raw_txs)
 
         # Determine all prevouts not in the mempool, and fetch the
         # UTXO information from the database.  Failed prevout lookups
@@ -393,13 +922,52 @@ class MemPool(object):
     
     async def keep_synchronized(self, synchronized_event):
         '''Keep the mempool synchronized with the daemon.'''
-        async with TaskGroup() as group:
-            await group.spawn(self._refresh_hashes(synchronized_event))
-            await group.spawn(self._logging(synchronized_event))
-
-            async for task in group:
-                if not task.cancelled():
-                    task.result()
+        if self.zmq_url is not None and zmq is None:
+            self.logger.error('pyzmq is not installed; polling the daemon mempool '
+                              'instead of subscribing to its ZMQ feed')
+            self.zmq_url = None
+        if self.snapshot_path is not None:
+            await self._load_snapshot()
+        if self.processes:
+            # Forking would copy the event loop, threads and DB handles
+            # of this process into the workers
+            method = ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                      else 'spawn')
+            self._process_pool = ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context(method))
+        try:
+            async with TaskGroup() as group:
+                await group.spawn(self._refresh_hashes(synchronized_event))
+                await group.spawn(self._logging(synchronized_event))
+                if self.zmq_url is not None:
+                    await group.spawn(self._zmq_feed())
+                if self.snapshot_path is not None and self.snapshot_secs:
+                    await group.spawn(self._save_snapshots())
+
+                async for task in group:
+                    if not task.cancelled():
+                        task.result()
+        finally:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False)
+                self._process_pool = None
+            if self.snapshot_path is not None:
+                self._save_snapshot_on_shutdown()
+
+    def info(self):
+        '''Return a dictionary of mempool statistics.'''
+        return {
+            'txs': len(self.txs),
+            'memory MB': round(self.memsize / 1_000_000, 2),
+            'memory budget MB': self.max_memsize // 1_000_000,
+            'evicted txs': len(self.evicted),
+            'orphan txs': self.orphan_count,
+        }
+
+    async def compact_fee_histogram(self):
+        '''Return the compact fee histogram of the mempool, as a list of
+        [fee_rate, size] pairs.  It is recomputed once each refresh.'''
+        return self.cached_compact_histogram
 
     async def balance_delta(self, hashX):
         '''Return the unconfirmed amount in the mempool for hashX.
@@ -410,8 +978,8 @@ class MemPool(object):
         if hashX in self.hashXs:
             for hash_ in self.hashXs[hashX]:
                 tx = self.txs[hash_]
-                value -= sum(v for h168, v in tx.in_pairs if h168 == hashX)
-                value += sum(v for h168, v in tx.out_pairs if h168 == hashX)
+                value -= sum(v for h168, v in unpack_pairs(tx.in_pairs) if h168 == hashX)
+                value += sum(v for h168, v in unpack_pairs(tx.out_pairs) if h168 == hashX)
         return value
 
     async def potential_spends(self, hashX):
@@ -435,7 +1003,9 @@ class MemPool(object):
         actual spends of it (in the DB or mempool) will be included.
         '''
         result = set()
-        # Not implemented yet either
+        for tx_hash in self.codeScriptHashes.get(codeScriptHash, ()):
+            tx = self.txs[tx_hash]
+            result.update(tx.prevouts)
         return result
     
     async def transaction_summaries(self, hashX):
@@ -457,24 +1027,59 @@ class MemPool(object):
         utxos = []
         for tx_hash in self.hashXs.get(hashX, ()):
             tx = self.txs.get(tx_hash)
-            for pos, (hX, value) in enumerate(tx.out_pairs):
+            for pos, (hX, value) in enumerate(unpack_pairs(tx.out_pairs)):
                 if hX == hashX:
                     utxos.append(UTXO(-1, pos, tx_hash, 0, value))
         return utxos
     
+    def glyph_record(self, tx_hash, index):
+        '''Return the Glyph envelope record of a mempool tx output, or None.'''
+        tx = self.txs.get(tx_hash)
+        if tx is not None:
+            for out_idx, record in tx.glyphs:
+                if out_idx == index:
+                    return record
+        return None
+
+    async def ref_unordered_UTXOs(self, ref):
+        '''Return an unordered list of RefUTXO named tuples from mempool
+        transaction outputs carrying ref.
+
+        This does not consider if any other mempool transactions spend
+        the outputs.
+        '''
+        utxos = []
+        for outpoint in self.refToOutpoints.get(ref, ()):
+            tx_hash = outpoint[:32]
+            pos, = unpack_le_uint32_from(outpoint, 32)
+            hashX, value = PAIR.unpack(self.txs[tx_hash].out_pair(pos))
+            utxos.append(RefUTXO(-1, pos, tx_hash, 0, value, hashX))
+        return utxos
+
     async def codescripthash_unordered_UTXOs(self, codeScriptHash):
-        # todo: this should be implemented for the codeScripthash
-        return []
+        '''Return an unordered list of UTXO named tuples from mempool
+        transactions that pay to codeScriptHash.
+
+        This does not consider if any other mempool transactions spend
+        the outputs.
+        '''
+        utxos = []
+        for tx_hash in self.codeScriptHashes.get(codeScriptHash, ()):
+            tx = self.txs[tx_hash]
+            for pos, (_hashX, value) in enumerate(unpack_pairs(tx.out_pairs)):
+                if tx.out_code_hash(pos) == codeScriptHash:
+                    utxos.append(UTXO(-1, pos, tx_hash, 0, value))
+        return utxos
 
     async def first_last_summaries(self, hashX):
         '''Return first and last UTXO tuples from mempool transactions that contain a singleton ref hash.'''
-        tx_hashes = self.srefs.get(hashX, [])
+        tx_hashes = self.srefs.get(hashX)
         if not tx_hashes:
             return []
 
         result = []
         # Get first and last, remove duplicate if there is only 1
-        for tx_hash in list(dict.fromkeys([tx_hashes[0], tx_hashes[-1]])):
+        for tx_hash in dict.fromkeys((next(iter(tx_hashes)), next(reversed(tx_hashes)))):
             tx = self.txs[tx_hash]
             has_ui = any(hash in self.txs for hash, idx in tx.prevouts)
             result.append(MemPoolTxSummary(tx_hash, tx.fee, has_ui))
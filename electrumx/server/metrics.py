@@ -0,0 +1,185 @@
+# Copyright (c) 2026, the ElectrumX authors
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Request and processing metrics.'''
+
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from aiohttp import web
+from aiorpcx import Event
+
+from electrumx.lib.util import class_logger
+
+
+class Histogram(object):
+    '''A histogram with HDR-style buckets: each power of two from lowest up
+    to highest is split into sub_buckets linear buckets, so the relative
+    error of a recorded value is bounded whatever its magnitude.'''
+
+    def __init__(self, lowest, highest, sub_buckets=4):
+        bounds = []
+        base = lowest
+        while base < highest:
+            bounds.extend(base * (1 + n / sub_buckets) for n in range(sub_buckets))
+            base *= 2
+        bounds.append(base)
+        # Upper bounds of the buckets; the last bucket has no upper bound
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        '''Return the upper bound of the bucket holding the given fraction
+        of recorded values, or the maximum if it is the last bucket.'''
+        target = fraction * self.count
+        running = 0
+        for bound, count in zip(self.bounds, self.counts):
+            running += count
+            if running >= target and running:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+    def cumulative_buckets(self):
+        '''Yield (upper_bound, cumulative_count) pairs, ending with
+        (None, count) for the unbounded last bucket.'''
+        running = 0
+        for bound, count in zip(self.bounds, self.counts):
+            running += count
+            yield bound, running
+        yield None, self.count
+
+
+# Per-request accumulator of the cost charged while handling a request
+request_cost = ContextVar('request_cost', default=None)
+
+
+class Metrics(object):
+    '''Metrics of client requests and of block and mempool processing.
+
+    Latencies and durations are in seconds, sizes in bytes.
+    '''
+
+    def __init__(self):
+        self.method_latency = defaultdict(partial(Histogram, 0.0001, 100))
+        self.method_size = defaultdict(partial(Histogram, 64, 64_000_000))
+        self.method_cost = defaultdict(float)
+        self.method_errors = defaultdict(int)
+        self.stages = defaultdict(partial(Histogram, 0.0001, 1000))
+
+    def record_request(self, method, elapsed, cost, error):
+        self.method_latency[method].record(elapsed)
+        self.method_cost[method] += cost
+        if error:
+            self.method_errors[method] += 1
+
+    def record_result_size(self, method, size):
+        self.method_size[method].record(size)
+
+    @contextmanager
+    def timer(self, stage):
+        '''Context manager recording the duration of a processing stage.'''
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[stage].record(time.monotonic() - start)
+
+    def info(self):
+        '''Return a dictionary summarising the metrics.'''
+        methods = {}
+        for method, latency in self.method_latency.items():
+            methods[method] = {
+                'latency': latency.summary(),
+                'result bytes': self.method_size[method].summary(),
+                'cost': round(self.method_cost[method], 2),
+                'errors': self.method_errors[method],
+            }
+        return {
+            'methods': methods,
+            'stages': {stage: histogram.summary()
+                       for stage, histogram in self.stages.items()},
+        }
+
+    def prometheus_text(self):
+        '''Return the metrics in the Prometheus text exposition format.'''
+        lines = []
+
+        def histogram_lines(name, help_text, label, histograms):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in sorted(histograms.items()):
+                labels = f'{label}="{key}"'
+                for bound, count in histogram.cumulative_buckets():
+                    le = '+Inf' if bound is None else f'{bound:g}'
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f'{name}_sum{{{labels}}} {histogram.sum:g}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        def counter_lines(name, help_text, label, values):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{{{label}="{key}"}} {value:g}')
+
+        histogram_lines('electrumx_request_seconds', 'Request latency by method',
+                        'method', self.method_latency)
+        histogram_lines('electrumx_result_bytes', 'Encoded result size by method',
+                        'method', self.method_size)
+        counter_lines('electrumx_request_cost_total', 'Session cost charged by method',
+                      'method', self.method_cost)
+        counter_lines('electrumx_request_errors_total', 'Error responses by method',
+                      'method', self.method_errors)
+        histogram_lines('electrumx_stage_seconds', 'Duration of block and mempool '
+                        'processing stages', 'stage', self.stages)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+async def serve_metrics(host, port):
+    '''Serve the metrics in Prometheus format over HTTP until cancelled.'''
+    logger = class_logger(__name__, 'Metrics')
+
+    async def handle(_request):
+        return web.Response(text=metrics.prometheus_text(),
+                            content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f'serving metrics on http://{host}:{port}/metrics')
+        await Event().wait()
+    finally:
+        await runner.cleanup()
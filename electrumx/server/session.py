@@ -7,11 +7,13 @@
 
 '''Classes for local RPC server and remote client TCP/SSL servers.'''
 
+import asyncio
 import codecs
 import itertools
 import json
 import math
 import os
+import re
 import ssl
 import time
 from collections import defaultdict
@@ -20,9 +22,9 @@ from ipaddress import IPv4Address, IPv6Address, ip_address
 
 import attr
 from aiorpcx import (
-    RPCSession, JSONRPCAutoDetect, JSONRPCConnection, serve_rs, serve_ws, NewlineFramer,
-    TaskGroup, handler_invocation, RPCError, Request, sleep, Event, ReplyAndDisconnect,
-    timeout_after
+    RPCSession, serve_rs, serve_ws, NewlineFramer,
+    TaskGroup, handler_invocation, RPCError, Request, Notification, sleep, Event,
+    ReplyAndDisconnect, timeout_after
 )
 from electrumx.lib.util import (
     pack_le_uint32
@@ -31,6 +33,9 @@ from electrumx.lib.util import (
 import pylru
 
 import electrumx
+from electrumx.lib.jsonrpc import (
+    EncodingConnection, RawJSON, concat_lists, dumps, history_json, utxos_json
+)
 from electrumx.lib.merkle import MerkleCache
 from electrumx.lib.text import sessions_lines
 from electrumx.lib import util
@@ -38,12 +43,17 @@ from electrumx.lib.hash import (sha256, hash_to_hex_str, hex_str_to_hash, HASHX_
                                 double_sha256)
 from electrumx.lib.util import hex_to_bytes
 from electrumx.server.daemon import DaemonError
+from electrumx.server.executors import INTERNAL, CHEAP
+from electrumx.server.metrics import metrics, request_cost
 from electrumx.server.peers import PeerManager
 
 
 BAD_REQUEST = 1
 DAEMON_ERROR = 2
 
+# A history page continuation token: a tx number as formatted by history_page
+HISTORY_CURSOR = re.compile('[0-9a-f]{1,10}')
+
 
 def scripthash_to_hashX(scripthash):
     try:
@@ -141,8 +151,18 @@ class SessionManager:
         self.logger = util.class_logger(__name__, self.__class__.__name__)
         self.servers = {}           # service->server
         self.sessions = {}          # session->iterable of its SessionGroups
+        self.hashX_sessions = defaultdict(set)  # hashX->subscribed sessions
         self.session_groups = {}    # group name->SessionGroup instance
         self.txs_sent = 0
+        # Raw transactions by binary hash, and in-progress fetches of them
+        self._tx_cache = util.SizedLRUCache(env.tx_cache_MB * 1_000_000)
+        self._tx_lookups = 0
+        self._tx_hits = 0
+        # Heights of new blocks whose transactions are yet to be cached
+        self._blocks_to_cache = asyncio.Queue()
+        # (method, key) -> future shared by concurrent identical queries
+        self._flights = {}
+        self._flight_joins = 0
         # Would use monotonic time, but aiorpcx sessions use Unix time:
         self.start_time = time.time()
         self._method_counts = defaultdict(int)
@@ -160,15 +180,24 @@ class SessionManager:
         self._merkle_cache = pylru.lrucache(1000)
         self._merkle_lookups = 0
         self._merkle_hits = 0
+        # hashX -> (status, has_mempool, cost); shared by all sessions
+        self._status_cache = pylru.lrucache(50000)
+        self._status_lookups = 0
+        self._status_hits = 0
+        # Bumped on every invalidation so a status computed across one is
+        # not cached
+        self._status_generation = 0
         self.notified_height = None
         self.hsub_results = None
+        # JSON RPC protocol class -> encoded headers notification
+        self._hsub_messages = {}
         self._sslc = None
         # Event triggered when electrumx is listening for incoming requests.
         self.server_listening = Event()
         self.session_event = Event()
 
         # Set up the RPC request handlers
-        cmds = ('add_peer daemon_url disconnect getinfo groups log peers '
+        cmds = ('add_peer daemon_url disconnect getinfo groups log metrics peers '
                 'query reorg sessions stop'.split())
         self.rpc_request_handlers = {cmd: getattr(self, 'rpc_' + cmd)
                                      for cmd in cmds}
@@ -282,10 +311,14 @@ class SessionManager:
         '''Clear caches on chain reorgs.'''
         while True:
             await self.bp.backed_up_event.wait()
-            self.logger.info('reorg signalled; clearing tx_hashes and merkle caches')
+            self.logger.info('reorg signalled; clearing tx_hashes, merkle and tx caches')
             self._reorg_count += 1
             self._tx_hashes_cache.clear()
             self._merkle_cache.clear()
+            self._tx_cache.clear()
+            # In-flight queries may have read pre-reorg state; their callers retry
+            for flight in self._flights.values():
+                flight.cancel()
 
     async def _recalc_concurrency(self):
         '''Periodically recalculate session concurrency.'''
@@ -318,20 +351,25 @@ class SessionManager:
         cache_fmt = '{:,d} lookups {:,d} hits {:,d} entries'
         sessions = self.sessions
         return {
+            'coalesced queries': self._flight_joins,
             'coin': self.env.coin.__name__,
             'daemon': self.daemon.logged_url(),
             'daemon height': self.daemon.cached_height(),
             'db height': self.db.db_height,
             'db_flush_count': self.db.history.flush_count,
+            'executor pools': self.db.executors.info(),
             'groups': len(self.session_groups),
             'history cache': cache_fmt.format(
                 self._history_lookups, self._history_hits, len(self._history_cache)),
+            'mempool': self.mempool.info(),
             'merkle cache': cache_fmt.format(
                 self._merkle_lookups, self._merkle_hits, len(self._merkle_cache)),
             'pid': os.getpid(),
             'peers': self.peer_mgr.info(),
             'request counts': self._method_counts,
             'request total': sum(self._method_counts.values()),
+            'status cache': cache_fmt.format(
+                self._status_lookups, self._status_hits, len(self._status_cache)),
             'sessions': {
                 'count': len(sessions),
                 'count with subs': sum(len(getattr(s, 'hashX_subs', ())) > 0 for s in sessions),
@@ -340,6 +378,8 @@ class SessionManager:
                 'pending requests': sum(s.unanswered_request_count() for s in sessions),
                 'subs': sum(s.sub_count() for s in sessions),
             },
+            'tx cache': cache_fmt.format(
+                self._tx_lookups, self._tx_hits, len(self._tx_cache)),
             'tx hashes cache': cache_fmt.format(
                 self._tx_hashes_lookups, self._tx_hashes_hits, len(self._tx_hashes_cache)),
             'txs sent': self.txs_sent,
@@ -393,8 +433,21 @@ class SessionManager:
         height = min(height, self.db.db_height)
         raw = await self.raw_header(height)
         self.hsub_results = {'hex': raw.hex(), 'height': height}
+        self._hsub_messages.clear()
         self.notified_height = height
 
+    def headers_notification(self, protocol):
+        '''Return the headers notification for notified_height encoded by
+        protocol, a JSON RPC protocol class.  It is encoded once per height
+        and shared by all sessions using that protocol.'''
+        message = self._hsub_messages.get(protocol)
+        if message is None:
+            notification = Notification('blockchain.headers.subscribe',
+                                        (self.hsub_results, ))
+            message = protocol.notification_message(notification)
+            self._hsub_messages[protocol] = message
+        return message
+
     def _session_references(self, items, special_strings):
         '''Return a SessionReferences object.'''
         if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
@@ -516,6 +569,10 @@ class SessionManager:
         '''Return summary information about the server process.'''
         return self._get_info()
 
+    async def rpc_metrics(self):
+        '''Return per-method request metrics and processing stage timings.'''
+        return metrics.info()
+
     async def rpc_groups(self):
         '''Return statistics about the session groups.'''
         return self._group_data()
@@ -644,6 +701,7 @@ class SessionManager:
                 await group.spawn(self._recalc_concurrency())
                 await group.spawn(self._log_sessions())
                 await group.spawn(self._manage_servers())
+                await group.spawn(self._cache_new_blocks())
 
                 async for task in group:
                     if not task.cancelled():
@@ -748,7 +806,7 @@ class SessionManager:
         async def get_txid_or_tx_field(tx_hash):
             txid = hash_to_hex_str(tx_hash)
             if txid_or_tx == "tx":
-                rawtx = await self.daemon_request('getrawtransaction', txid, False)
+                rawtx = await self.raw_transaction(tx_hash)
                 cost = 1.0
                 txid_or_tx_field = rawtx
             else:
@@ -833,6 +891,70 @@ class SessionManager:
             raise RPCError(BAD_REQUEST, f'height {height:,d} '
                            'out of range') from None
 
+    async def raw_transaction(self, tx_hash):
+        '''Return the raw transaction with the given binary hash as a hex
+        string.
+
+        Recently seen transactions are served from a cache.  Otherwise they
+        come from the local tx store if enabled, else the daemon; concurrent
+        requests for the same transaction share a single fetch.'''
+        self._tx_lookups += 1
+        raw_tx = self._tx_cache.get(tx_hash)
+        if raw_tx is not None:
+            self._tx_hits += 1
+            return raw_tx.hex()
+
+        raw_tx = await self._single_flight(
+            'raw_transaction', tx_hash, partial(self._fetch_raw_transaction, tx_hash))
+        return raw_tx.hex()
+
+    async def _fetch_raw_transaction(self, tx_hash):
+        reorg_count = self._reorg_count
+        raw_tx = None
+        if self.db.tx_store:
+            raw_tx = await self.db.tx_store.raw_tx(tx_hash)
+        if raw_tx is None:
+            hex_tx = await self.daemon_request('getrawtransaction',
+                                               hash_to_hex_str(tx_hash), False)
+            raw_tx = bytes.fromhex(hex_tx)
+        if reorg_count == self._reorg_count:
+            self._tx_cache[tx_hash] = raw_tx
+        return raw_tx
+
+    async def mempool_raw_transactions(self, hex_hashes):
+        '''Fetch the raw transactions the mempool asks for from the daemon,
+        keeping copies in the tx cache.'''
+        hex_hashes = list(hex_hashes)
+        raw_txs = await self.daemon.getrawtransactions(hex_hashes)
+        cache = self._tx_cache
+        for hex_hash, raw_tx in zip(hex_hashes, raw_txs):
+            if raw_tx:
+                cache[hex_str_to_hash(hex_hash)] = raw_tx
+        return raw_txs
+
+    async def _cache_block_transactions(self, height):
+        '''Add the transactions of the block at height to the tx cache.'''
+        def block_transactions():
+            try:
+                raw_block = self.db.read_raw_block(height)
+            except FileNotFoundError:
+                return []
+            block = self.env.coin.block(raw_block)
+            return [(tx_hash, raw_block[start: start + length])
+                    for (_tx, tx_hash), (start, length)
+                    in zip(block.transactions, block.tx_spans)]
+
+        cache = self._tx_cache
+        for tx_hash, raw_tx in await self.db.executors.run(INTERNAL, block_transactions):
+            cache[tx_hash] = raw_tx
+
+    async def _cache_new_blocks(self):
+        '''Cache the transactions of new blocks once their notifications
+        have gone out, so that warming never delays them.'''
+        while True:
+            height = await self._blocks_to_cache.get()
+            await self._cache_block_transactions(height)
+
     async def broadcast_transaction(self, raw_tx):
         hex_hash = await self.daemon.broadcast_transaction(raw_tx)
         self.txs_sent += 1
@@ -851,16 +973,183 @@ class SessionManager:
             result = self._history_cache[hashX]
             self._history_hits += 1
         except KeyError:
-            result = await self.db.limited_history(hashX, limit=limit)
-            cost += 0.1 + len(result) * 0.001
-            if len(result) >= limit:
-                result = RPCError(BAD_REQUEST, 'history too large', cost=cost)
-            self._history_cache[hashX] = result
+            result, read_cost = await self._single_flight(
+                'limited_history', hashX, partial(self._read_history, hashX, limit))
+            cost += read_cost
 
         if isinstance(result, Exception):
             raise result
         return result, cost
 
+    async def _read_history(self, hashX, limit):
+        generation = self._status_generation
+        result = await self.db.limited_history(hashX, limit=limit)
+        cost = 0.1 + len(result) * 0.001
+        if limit is not None and len(result) >= limit:
+            result = RPCError(BAD_REQUEST, 'history too large', cost=cost)
+        # Don't cache history read across an invalidation
+        if limit is not None and generation == self._status_generation:
+            self._history_cache[hashX] = result
+        return result, cost
+
+    async def all_utxos(self, hashX):
+        '''Return the confirmed UTXOs of hashX.'''
+        return await self._single_flight('all_utxos', hashX,
+                                         partial(self.db.all_utxos, hashX))
+
+    async def _single_flight(self, method, key, func):
+        '''Return the result of awaiting func(), sharing a single call with any
+        concurrent callers for the same method and key.  Failures are raised
+        to all of them.  If a reorg cancels the call it is retried.'''
+        flight_key = (method, key)
+        while True:
+            flight = self._flights.get(flight_key)
+            if flight is None:
+                flight = asyncio.ensure_future(func())
+                self._flights[flight_key] = flight
+                flight.add_done_callback(partial(self._on_flight_done, flight_key))
+            else:
+                self._flight_joins += 1
+            try:
+                # Shielded so one caller being cancelled doesn't cancel the others
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+
+    def _on_flight_done(self, flight_key, flight):
+        if self._flights.get(flight_key) is flight:
+            del self._flights[flight_key]
+        # Retrieve any exception so it is not reported as never retrieved if
+        # all callers have gone
+        if not flight.cancelled():
+            flight.exception()
+
+    async def history_page(self, hashX, cursor, page_size):
+        '''Returns a triple (history, next_cursor, cost).
+
+        History is a sorted list of at most page_size (tx_hash, height)
+        tuples.  cursor is None to start at the beginning of the history,
+        an integer block height, or a continuation token returned as
+        next_cursor by a previous call.  next_cursor is None on the last
+        page.'''
+        # The same DoS limit as limited_history applies to each page
+        max_page_size = self.env.max_send // 99
+        if page_size is None:
+            page_size = max_page_size
+        else:
+            page_size = non_negative_integer(page_size)
+            if not 0 < page_size <= max_page_size:
+                raise RPCError(BAD_REQUEST, f'page size must be between 1 '
+                               f'and {max_page_size:,d}')
+
+        if cursor is None:
+            start_tx_num = 0
+        elif isinstance(cursor, str):
+            if not HISTORY_CURSOR.fullmatch(cursor):
+                raise RPCError(BAD_REQUEST, f'invalid cursor {cursor}')
+            start_tx_num = int(cursor, 16)
+        else:
+            start_tx_num = self.db.height_tx_num(non_negative_integer(cursor))
+
+        history, next_tx_num = await self.db.history_page(hashX, start_tx_num,
+                                                          page_size)
+        cost = 0.1 + len(history) * 0.001
+        next_cursor = None if next_tx_num is None else f'{next_tx_num:010x}'
+        return history, next_cursor, cost
+
+    async def utxos_page(self, hashX, cursor, page_size):
+        '''Returns a triple (utxos, next_cursor, cost).
+
+        utxos is a list of at most page_size confirmed UTXOs in DB key
+        order.  cursor is None to start at the beginning, or a continuation
+        token returned as next_cursor by a previous call.  next_cursor is
+        None on the last page.'''
+        # Allow for a few refs per UTXO in a response of at most max_send
+        max_page_size = self.env.max_send // 250
+        if page_size is None:
+            page_size = max_page_size
+        else:
+            page_size = non_negative_integer(page_size)
+            if not 0 < page_size <= max_page_size:
+                raise RPCError(BAD_REQUEST, f'page size must be between 1 '
+                               f'and {max_page_size:,d}')
+
+        if cursor is None:
+            start_suffix = b''
+        else:
+            try:
+                start_suffix = bytes.fromhex(cursor)
+            except (TypeError, ValueError):
+                start_suffix = None
+            if start_suffix is None or len(start_suffix) != 9:
+                raise RPCError(BAD_REQUEST, f'invalid cursor {cursor}')
+
+        utxos, next_suffix = await self.db.utxos_page(hashX, start_suffix, page_size)
+        cost = 0.1 + len(utxos) * 0.002
+        next_cursor = None if next_suffix is None else next_suffix.hex()
+        return utxos, next_cursor, cost
+
+    async def address_status(self, hashX):
+        '''Returns a triple (status, has_mempool, cost) for a hashX.
+
+        Status is a hex string, or None if there is no history.  has_mempool
+        is True if the status includes mempool transactions.  Statuses are
+        shared by all sessions until the hashX is next touched.'''
+        self._status_lookups += 1
+        try:
+            status, has_mempool, _cost = self._status_cache[hashX]
+            self._status_hits += 1
+            return status, has_mempool, 0.1
+        except KeyError:
+            pass
+
+        generation = self._status_generation
+        # Note history is ordered and mempool unordered in electrum-server
+        # For mempool, height is -1 if it has unconfirmed inputs, otherwise 0
+        try:
+            db_history, cost = await self.limited_history(hashX)
+        except RPCError:
+            # History too large for send limit, but we only need it for
+            # status hash computation (never sent raw to client).
+            # Fetch unlimited history directly from DB.
+            db_history, cost = await self._single_flight(
+                'full_history', hashX, partial(self._read_history, hashX, None))
+        mempool = await self.mempool.transaction_summaries(hashX)
+
+        status = ''.join(f'{hash_to_hex_str(tx_hash)}:'
+                         f'{height:d}:'
+                         for tx_hash, height in db_history)
+        status += ''.join(f'{hash_to_hex_str(tx.hash)}:'
+                          f'{-tx.has_unconfirmed_inputs:d}:'
+                          for tx in mempool)
+
+        # Add status hashing cost
+        cost += 0.1 + len(status) * 0.00002
+
+        if status:
+            status = sha256(status.encode()).hex()
+        else:
+            status = None
+
+        result = (status, bool(mempool), cost)
+        if generation == self._status_generation:
+            self._status_cache[hashX] = result
+        return result
+
+    def _invalidate_statuses(self, touched, height_changed):
+        '''Drop cached statuses of touched hashXs.  On a new block the
+        statuses including mempool transactions are dropped too, as they
+        depend on the confirmed state of other transactions.'''
+        self._status_generation += 1
+        cache = self._status_cache
+        stale = set(cache).intersection(touched)
+        if height_changed:
+            stale.update(hashX for hashX, (_status, has_mempool, _cost)
+                         in cache.items() if has_mempool)
+        for hashX in stale:
+            del cache[hashX]
+
     async def ref_get_db(self, ref):
         '''Returns the mint and location for a ref'''
         cost = 0.1
@@ -869,20 +1158,30 @@ class SessionManager:
             result = self._ref_get_cache[ref]
             self._ref_get_hits += 1
         except KeyError:
-            mint = self.db.get_ref_mint(ref)
-            loc = self.db.get_ref_location(ref)
+            result = await self._single_flight('ref_get', ref,
+                                               partial(self._read_ref, ref))
             cost += 0.202
-            result = [mint, loc]
-            self._ref_get_cache[ref] = result
 
         if isinstance(result, Exception):
             raise result
         return result, cost
 
+    async def _read_ref(self, ref):
+        def read_ref():
+            return [self.db.get_ref_mint(ref), self.db.get_ref_location(ref)]
+
+        result = await self.db.executors.run(CHEAP, read_ref)
+        self._ref_get_cache[ref] = result
+        return result
+
     async def _notify_sessions(self, height, touched):
         '''Notify sessions about height changes and touched addresses.'''
         height_changed = height != self.notified_height
+        new_blocks = ()
         if height_changed:
+            # Clients commonly fetch the transactions of a new block
+            if self.notified_height is not None:
+                new_blocks = range(max(self.notified_height + 1, height - 5), height + 1)
             await self._refresh_hsub_results(height)
             # Invalidate our history cache for touched hashXs
             cache = self._history_cache
@@ -891,10 +1190,48 @@ class SessionManager:
             cache = self._ref_get_cache
             for hashX in set(cache).intersection(touched):
                 del cache[hashX]
+        self._invalidate_statuses(touched, height_changed)
 
-        async with TaskGroup() as group:
+        with metrics.timer('notify sessions'):
+            async with TaskGroup() as group:
+                for session, session_touched in self._sessions_to_notify(
+                        touched, height_changed).items():
+                    await group.spawn(session.notify, session_touched, height_changed)
+
+        for block_height in new_blocks:
+            self._blocks_to_cache.put_nowait(block_height)
+
+    def _sessions_to_notify(self, touched, height_changed):
+        '''Return a map from each session needing notification to the touched
+        hashXs it subscribes to.'''
+        result = defaultdict(set)
+        hashX_sessions = self.hashX_sessions
+        for hashX in touched.intersection(hashX_sessions):
+            for session in hashX_sessions[hashX]:
+                result[session].add(hashX)
+        if height_changed:
+            # Header subscribers, and sessions whose statuses include mempool
+            # transactions whose confirmed state may have changed
             for session in self.sessions:
-                await group.spawn(session.notify, touched, height_changed)
+                if (getattr(session, 'subscribe_headers', False)
+                        or getattr(session, 'mempool_statuses', None)):
+                    result[session]
+        return result
+
+    def subscribe_hashX(self, session, hashX):
+        '''Record that a session subscribes to a hashX.  Sessions that have
+        disconnected, perhaps while their subscription was computing the
+        status, are ignored; remove_session has already run for them.'''
+        if session in self.sessions and not session.is_closing():
+            self.hashX_sessions[hashX].add(session)
+
+    def unsubscribe_hashX(self, session, hashX):
+        '''Record that a session no longer subscribes to a hashX.'''
+        sessions = self.hashX_sessions.get(hashX)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self.hashX_sessions[hashX]
 
     def _ip_addr_group_name(self, session):
         host = session.remote_address().host
@@ -939,6 +1276,8 @@ class SessionManager:
         for group in groups:
             group.retained_cost += session.cost
             group.sessions.remove(session)
+        for hashX in getattr(session, 'hashX_subs', ()):
+            self.unsubscribe_hashX(session, hashX)
 
 
 class SessionBase(RPCSession):
@@ -953,8 +1292,7 @@ class SessionBase(RPCSession):
     log_new = False
 
     def __init__(self, session_mgr, db, mempool, peer_mgr, kind, transport):
-        connection = JSONRPCConnection(JSONRPCAutoDetect)
-        super().__init__(transport, connection=connection)
+        super().__init__(transport, connection=EncodingConnection())
         self.session_mgr = session_mgr
         self.db = db
         self.mempool = mempool
@@ -1017,6 +1355,14 @@ class SessionBase(RPCSession):
     def sub_count(self):
         return 0
 
+    async def send_raw_notification(self, message):
+        '''Send a notification message that is already JSON encoded for this
+        session's protocol.  The transport frames it as usual.
+
+        This uses aiorpcx's private _send_message, which is why aiorpcX is
+        pinned to a minor version in requirements.txt.'''
+        await self._send_message(message)
+
     async def handle_request(self, request):
         '''Handle an incoming request.  ElectrumX doesn't receive
         notifications from client sessions.
@@ -1028,7 +1374,35 @@ class SessionBase(RPCSession):
         method = 'invalid method' if handler is None else request.method
         self.session_mgr._method_counts[method] += 1
         coro = handler_invocation(handler, request)()
-        return await coro
+
+        if isinstance(request, Request):
+            send_result = request.send_result
+
+            def sized_send_result(result):
+                message = send_result(result)
+                # Batch items return the batch message with the last item
+                if message:
+                    metrics.record_result_size(method, len(message))
+                return message
+
+            request.send_result = sized_send_result
+
+        cost = [0.0]
+        request_cost.set(cost)
+        start = time.monotonic()
+        error = True
+        try:
+            result = await coro
+            error = False
+            return result
+        finally:
+            metrics.record_request(method, time.monotonic() - start, cost[0], error)
+
+    def bump_cost(self, delta):
+        cost = request_cost.get()
+        if cost is not None:
+            cost[0] += delta
+        super().bump_cost(delta)
 
 
 class ElectrumX(SessionBase):
@@ -1101,6 +1475,7 @@ class ElectrumX(SessionBase):
 
     def unsubscribe_hashX(self, hashX):
         self.mempool_statuses.pop(hashX, None)
+        self.session_mgr.unsubscribe_hashX(self, hashX)
         return self.hashX_subs.pop(hashX, None)
 
     async def notify(self, touched, height_changed):
@@ -1116,8 +1491,8 @@ class ElectrumX(SessionBase):
         updates or new blocks) and height.
         '''
         if height_changed and self.subscribe_headers:
-            args = (await self.subscribe_headers_result(), )
-            await self.send_notification('blockchain.headers.subscribe', args)
+            message = self.session_mgr.headers_notification(self.connection.protocol)
+            await self.send_raw_notification(message)
 
         touched = touched.intersection(self.hashX_subs)
         if touched or (height_changed and self.mempool_statuses):
@@ -1173,34 +1548,10 @@ class ElectrumX(SessionBase):
 
         Status is a hex string, but must be None if there is no history.
         '''
-        # Note history is ordered and mempool unordered in electrum-server
-        # For mempool, height is -1 if it has unconfirmed inputs, otherwise 0
-        try:
-            db_history, cost = await self.session_mgr.limited_history(hashX)
-        except RPCError:
-            # History too large for send limit, but we only need it for
-            # status hash computation (never sent raw to client).
-            # Fetch unlimited history directly from DB.
-            db_history = await self.db.limited_history(hashX, limit=None)
-            cost = 0.1 + len(db_history) * 0.001
-        mempool = await self.mempool.transaction_summaries(hashX)
-
-        status = ''.join(f'{hash_to_hex_str(tx_hash)}:'
-                         f'{height:d}:'
-                         for tx_hash, height in db_history)
-        status += ''.join(f'{hash_to_hex_str(tx.hash)}:'
-                          f'{-tx.has_unconfirmed_inputs:d}:'
-                          for tx in mempool)
-
-        # Add status hashing cost
-        self.bump_cost(cost + 0.1 + len(status) * 0.00002)
-
-        if status:
-            status = sha256(status.encode()).hex()
-        else:
-            status = None
+        status, has_mempool, cost = await self.session_mgr.address_status(hashX)
+        self.bump_cost(cost)
 
-        if mempool:
+        if has_mempool:
             self.mempool_statuses[hashX] = status
         else:
             self.mempool_statuses.pop(hashX, None)
@@ -1216,30 +1567,32 @@ class ElectrumX(SessionBase):
             self.unsubscribe_hashX(hashX)
             return None
 
-    def get_refs_by_outpoint(self, outpoint):
-        '''Get refs by the outpoint
-        '''
-        refs = self.mempool.get_refs_by_outpoint(outpoint)
-        if len(refs):
-            return refs
-        # Not found in the mempool, check the database
-        return self.db.get_refs_by_outpoint(outpoint)
+    async def refs_by_utxos(self, utxos):
+        '''Return a list of the refs of each UTXO.  Mempool refs are used if
+        present, and the rest are read from the DB in one batch.'''
+        get_mempool_refs = self.mempool.get_refs_by_outpoint
+        outpoints = [utxo.tx_hash + pack_le_uint32(utxo.tx_pos) for utxo in utxos]
+        refs = [get_mempool_refs(outpoint) for outpoint in outpoints]
+        missing = [n for n, item in enumerate(refs) if not item]
+        if missing:
+            db_refs = await self.db.refs_by_outpoints([outpoints[n] for n in missing])
+            for n, item in zip(missing, db_refs):
+                refs[n] = item
+        return refs
 
     async def hashX_listunspent(self, hashX):
         '''Return the list of UTXOs of a script hash, including mempool
         effects.'''
-        utxos = await self.db.all_utxos(hashX)
+        utxos = await self.session_mgr.all_utxos(hashX)
         utxos = sorted(utxos)
         utxos.extend(await self.mempool.unordered_UTXOs(hashX))
         self.bump_cost(1.0 + len(utxos) / 50)
         spends = await self.mempool.potential_spends(hashX)
+        utxos = [utxo for utxo in utxos if (utxo.tx_hash, utxo.tx_pos) not in spends]
+        refs = await self.refs_by_utxos(utxos)
 
-        return [{'tx_hash': hash_to_hex_str(utxo.tx_hash),
-                 'tx_pos': utxo.tx_pos,
-                 'height': utxo.height, 'value': utxo.value, 
-                 'refs': self.get_refs_by_outpoint(utxo.tx_hash + pack_le_uint32(utxo.tx_pos))}
-                for utxo in utxos
-                if (utxo.tx_hash, utxo.tx_pos) not in spends]
+        return utxos_json((utxo.tx_hash, utxo.tx_pos, utxo.height, utxo.value, utxo_refs)
+                          for utxo, utxo_refs in zip(utxos, refs))
 
     async def codescripthash_listunspent(self, codeScriptHash):
         '''Return the list of UTXOs of a code script hash, including mempool
@@ -1247,31 +1600,26 @@ class ElectrumX(SessionBase):
         hashX = hex_to_bytes(codeScriptHash)
         utxos = await self.db.codescripthash_all_utxos(hashX)
         utxos = sorted(utxos)
-        # the following codescripthash_unordered_UTXOs is not implemented yet
-        # Need a way to track codescripthash and hashX together
         utxos.extend(await self.mempool.codescripthash_unordered_UTXOs(hashX))
         self.bump_cost(1.0 + len(utxos) / 50)
-         # the following codescripthash_potential_spends is not implemented yet either
         spends = await self.mempool.codescripthash_potential_spends(hashX)
+        utxos = [utxo for utxo in utxos if (utxo.tx_hash, utxo.tx_pos) not in spends]
+        refs = await self.refs_by_utxos(utxos)
 
-        return [{'tx_hash': hash_to_hex_str(utxo.tx_hash),
-                 'tx_pos': utxo.tx_pos,
-                 'height': utxo.height, 'value': utxo.value, 
-                 'refs': self.get_refs_by_outpoint(utxo.tx_hash + pack_le_uint32(utxo.tx_pos))}
-                for utxo in utxos
-                if (utxo.tx_hash, utxo.tx_pos) not in spends]
+        return utxos_json((utxo.tx_hash, utxo.tx_pos, utxo.height, utxo.value, utxo_refs)
+                          for utxo, utxo_refs in zip(utxos, refs))
     
     async def hashX_subscribe(self, hashX, alias):
         # Store the subscription only after address_status succeeds
         result = await self.address_status(hashX)
         self.hashX_subs[hashX] = alias
+        self.session_mgr.subscribe_hashX(self, hashX)
         return result
 
     async def get_balance(self, hashX):
-        utxos = await self.db.all_utxos(hashX)
-        confirmed = sum(utxo.value for utxo in utxos)
+        confirmed, _utxo_count = await self.db.balance(hashX)
         unconfirmed = await self.mempool.balance_delta(hashX)
-        self.bump_cost(1.0 + len(utxos) / 50)
+        self.bump_cost(1.0)
         return {'confirmed': confirmed, 'unconfirmed': unconfirmed}
 
     async def scripthash_get_balance(self, scripthash):
@@ -1293,15 +1641,35 @@ class ElectrumX(SessionBase):
         # Note history is ordered but unconfirmed is unordered in e-s
         history, cost = await self.session_mgr.limited_history(hashX)
         self.bump_cost(cost)
-        conf = [{'tx_hash': hash_to_hex_str(tx_hash), 'height': height}
-                for tx_hash, height in history]
-        return conf + await self.unconfirmed_history(hashX)
+        # The confirmed history can be very long
+        return concat_lists([history_json(history),
+                             await self.unconfirmed_history(hashX)])
 
     async def scripthash_get_history(self, scripthash):
         '''Return the confirmed and unconfirmed history of a scripthash.'''
         hashX = scripthash_to_hashX(scripthash)
         return await self.confirmed_and_unconfirmed_history(hashX)
 
+    async def scripthash_get_history_page(self, scripthash, cursor=None,
+                                          page_size=None):
+        '''Return a page of the confirmed and unconfirmed history of a
+        scripthash.
+
+        cursor: None, a block height, or a continuation token from a
+          previous page
+        page_size: maximum number of confirmed transactions to return
+        '''
+        hashX = scripthash_to_hashX(scripthash)
+        history, next_cursor, cost = await self.session_mgr.history_page(
+            hashX, cursor, page_size)
+        self.bump_cost(cost)
+        conf = [{'tx_hash': hash_to_hex_str(tx_hash), 'height': height}
+                for tx_hash, height in history]
+        # Mempool transactions follow the confirmed history on the last page
+        if next_cursor is None:
+            conf += await self.unconfirmed_history(hashX)
+        return {'history': conf, 'cursor': next_cursor}
+
     async def scripthash_get_mempool(self, scripthash):
         '''Return the mempool transactions touching a scripthash.'''
         hashX = scripthash_to_hashX(scripthash)
@@ -1312,6 +1680,31 @@ class ElectrumX(SessionBase):
         hashX = scripthash_to_hashX(scripthash)
         return await self.hashX_listunspent(hashX)
 
+    async def scripthash_listunspent_page(self, scripthash, cursor=None,
+                                          page_size=None):
+        '''Return a page of the UTXOs of a scripthash.
+
+        cursor: None, or a continuation token from a previous page
+        page_size: maximum number of confirmed UTXOs to return
+        '''
+        hashX = scripthash_to_hashX(scripthash)
+        utxos, next_cursor, cost = await self.session_mgr.utxos_page(
+            hashX, cursor, page_size)
+        self.bump_cost(cost)
+        # Mempool UTXOs follow the confirmed UTXOs on the last page
+        if next_cursor is None:
+            utxos.extend(await self.mempool.unordered_UTXOs(hashX))
+        spends = await self.mempool.potential_spends(hashX)
+        utxos = [utxo for utxo in utxos if (utxo.tx_hash, utxo.tx_pos) not in spends]
+        refs = await self.refs_by_utxos(utxos)
+
+        utxos = utxos_json((utxo.tx_hash, utxo.tx_pos, utxo.height, utxo.value, utxo_refs)
+                           for utxo, utxo_refs in zip(utxos, refs))
+        if isinstance(utxos, RawJSON):
+            return RawJSON(b''.join((b'{"utxos":', utxos.json, b',"cursor":',
+                                     dumps(next_cursor), b'}')))
+        return {'utxos': utxos, 'cursor': next_cursor}
+
     async def scripthash_subscribe(self, scripthash):
         '''Subscribe to a script hash.
 
@@ -1508,11 +1901,13 @@ class ElectrumX(SessionBase):
         tx_hash: the transaction hash as a hexadecimal string
         verbose: passed on to the daemon
         '''
-        assert_tx_hash(tx_hash)
+        raw_hash = assert_tx_hash(tx_hash)
         if verbose not in (True, False):
             raise RPCError(BAD_REQUEST, '"verbose" must be a boolean')
 
         self.bump_cost(1.0)
+        if not verbose:
+            return await self.session_mgr.raw_transaction(raw_hash)
         return await self.daemon_request('getrawtransaction', tx_hash, verbose)
 
     async def transaction_merkle(self, tx_hash, height):
@@ -1587,7 +1982,7 @@ class ElectrumX(SessionBase):
 
     async def compact_fee_histogram(self):
         self.bump_cost(1.0)
-        return []
+        return await self.mempool.compact_fee_histogram()
 
     async def wave_resolve(self, name):
         '''Resolve a WAVE name to its target address.
@@ -1620,8 +2015,10 @@ class ElectrumX(SessionBase):
             'blockchain.relayfee': self.relayfee,
             'blockchain.scripthash.get_balance': self.scripthash_get_balance,
             'blockchain.scripthash.get_history': self.scripthash_get_history,
+            'blockchain.scripthash.get_history_page': self.scripthash_get_history_page,
             'blockchain.scripthash.get_mempool': self.scripthash_get_mempool,
             'blockchain.scripthash.listunspent': self.scripthash_listunspent,
+            'blockchain.scripthash.listunspent_page': self.scripthash_listunspent_page,
             'blockchain.scripthash.subscribe': self.scripthash_subscribe,
             'blockchain.transaction.broadcast': self.transaction_broadcast,
             'blockchain.transaction.get': self.transaction_get,
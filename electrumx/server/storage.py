@@ -49,6 +49,12 @@ class Storage(object):
     def put(self, key, value):
         raise NotImplementedError
 
+    def multi_get(self, keys):
+        '''Return a list of the values of keys, with None for those not
+        present.'''
+        get = self.get
+        return [get(key) for key in keys]
+
     def write_batch(self):
         '''Return a context manager that provides `put` and `delete`.
 
@@ -67,6 +73,34 @@ class Storage(object):
         '''
         raise NotImplementedError
 
+    def iterator_from(self, prefix, start):
+        '''Return an iterator that yields (key, value) pairs from the
+        database sorted by key, of keys starting with `prefix` that are
+        not less than `start`.
+        '''
+        raise NotImplementedError
+
+    def prefix_groups(self, prefixes):
+        '''Return a list, for each prefix, of the (key, value) pairs of keys
+        starting with it.
+
+        Engines that can seek use one iterator for all the prefixes,
+        which is quickest when the prefixes are sorted.
+        '''
+        return [list(self.iterator(prefix=prefix)) for prefix in prefixes]
+
+
+def _seek_prefix(iterator, prefix):
+    '''Seek iterator to prefix and return the pairs with keys starting
+    with it.'''
+    iterator.seek(prefix)
+    pairs = []
+    for key, value in iterator:
+        if not key.startswith(prefix):
+            break
+        pairs.append((key, value))
+    return pairs
+
 # pylint:disable=W0223
 
 
@@ -90,6 +124,17 @@ class LevelDB(Storage):
         self.write_batch = partial(self.db.write_batch, transaction=True,
                                    sync=True)
 
+    def iterator_from(self, prefix, start):
+        stop = util.increment_byte_string(prefix)
+        iterator = self.db.iterator(start=max(prefix, start), stop=stop)
+        if stop is None:
+            return ((key, value) for key, value in iterator if key.startswith(prefix))
+        return iterator
+
+    def prefix_groups(self, prefixes):
+        with self.db.iterator() as iterator:
+            return [_seek_prefix(iterator, prefix) for prefix in prefixes]
+
 
 # pylint:disable=E1101
 
@@ -123,12 +168,23 @@ class RocksDB(Storage):
         import gc
         gc.collect()
 
+    def multi_get(self, keys):
+        values = self.db.multi_get(keys)
+        return [values.get(key) for key in keys]
+
     def write_batch(self):
         return RocksDBWriteBatch(self.db)
 
     def iterator(self, prefix=b'', reverse=False):
         return RocksDBIterator(self.db, prefix, reverse)
 
+    def iterator_from(self, prefix, start):
+        return RocksDBIterator(self.db, prefix, False, start=max(prefix, start))
+
+    def prefix_groups(self, prefixes):
+        iterator = self.db.iteritems()
+        return [_seek_prefix(iterator, prefix) for prefix in prefixes]
+
 
 class RocksDBWriteBatch(object):
     '''A write batch for RocksDB.'''
@@ -148,7 +204,7 @@ class RocksDBWriteBatch(object):
 class RocksDBIterator(object):
     '''An iterator for RocksDB.'''
 
-    def __init__(self, db, prefix, reverse):
+    def __init__(self, db, prefix, reverse, start=None):
         self.prefix = prefix
         if reverse:
             self.iterator = reversed(db.iteritems())
@@ -163,7 +219,7 @@ class RocksDBIterator(object):
                 self.iterator.seek_to_last()
         else:
             self.iterator = db.iteritems()
-            self.iterator.seek(prefix)
+            self.iterator.seek(prefix if start is None else start)
 
     def __iter__(self):
         return self
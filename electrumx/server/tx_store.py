@@ -0,0 +1,159 @@
+# Copyright (c) 2026, the ElectrumX authors
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Optional store of raw confirmed transactions.'''
+
+import ast
+import struct
+
+from aiorpcx import run_in_thread
+
+from electrumx.lib import util
+
+
+# Index value: height, offset into the data file, length
+INDEX_STRUCT = struct.Struct('<IQI')
+
+
+class TxStore(object):
+    '''Raw transactions of confirmed blocks, so they can be served without
+    asking the daemon.
+
+    Raw transactions are appended to a logical file split into segment
+    files.  A database maps each tx hash to its (height, offset, length)
+    in that file.  Like the history, transactions are held in memory
+    until flushed.
+    '''
+
+    def __init__(self, runner=run_in_thread):
+        self.logger = util.class_logger(__name__, self.__class__.__name__)
+        self.data_file = util.LogicalFile('meta/txstore', 4, 128_000_000)
+        # Each entry is (height, raw_block, tx_hashes, tx_spans)
+        self.unflushed = []
+        self.unflushed_size = 0
+        self.height = -1
+        self.size = 0
+        # Runs disk reads in another thread
+        self.runner = runner
+        self.db = None
+
+    def open_db(self, db_class, for_sync, db_height):
+        self.db = db_class('txstore', for_sync)
+        self.read_state()
+        if self.height < db_height:
+            self.logger.warning(f'transactions of blocks {self.height + 1:,d}-'
+                                f'{db_height:,d} are not stored; they will be '
+                                f'served by the daemon')
+        self.height = db_height
+
+    def close_db(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    def read_state(self):
+        state = self.db.get(b'state')
+        if state:
+            state = ast.literal_eval(state.decode())
+            if not isinstance(state, dict):
+                raise RuntimeError('failed reading state from tx store DB')
+            self.height = state['height']
+            self.size = state['size']
+        self.logger.info(f'tx store height {self.height:,d} size {self.size:,d} bytes')
+
+    def write_state(self, batch):
+        '''Write state to the tx store DB.'''
+        state = {
+            'height': self.height,
+            'size': self.size,
+        }
+        batch.put(b'state', repr(state).encode())
+
+    def add_unflushed(self, height, raw_block, tx_hashes, tx_spans):
+        '''Add the transactions of a block.  tx_spans is a list of
+        (offset, length) pairs of each raw transaction in raw_block.'''
+        self.unflushed.append((height, raw_block, tx_hashes, tx_spans))
+        self.unflushed_size += len(raw_block)
+
+    def unflushed_memsize(self):
+        return self.unflushed_size
+
+    def assert_flushed(self):
+        assert not self.unflushed
+
+    def flush(self):
+        if not self.unflushed:
+            return
+
+        start_size = self.size
+        offset = self.size
+        parts = []
+        pack = INDEX_STRUCT.pack
+        with self.db.write_batch() as batch:
+            for height, raw_block, tx_hashes, tx_spans in self.unflushed:
+                for tx_hash, (start, length) in zip(tx_hashes, tx_spans):
+                    parts.append(raw_block[start: start + length])
+                    batch.put(tx_hash, pack(height, offset, length))
+                    offset += length
+                self.height = height
+            # Write the data before the index refers to it
+            self.data_file.write(self.size, b''.join(parts))
+            self.size = offset
+            self.write_state(batch)
+
+        count = sum(len(tx_hashes) for _, _, tx_hashes, _ in self.unflushed)
+        self.logger.debug(f'flushed {count:,d} transactions, '
+                          f'{self.size - start_size:,d} bytes')
+        self.unflushed.clear()
+        self.unflushed_size = 0
+
+    def backup(self, tx_hashes, height):
+        '''Remove the given transactions of blocks above height, and reclaim
+        their space.'''
+        self.assert_flushed()
+        unpack = INDEX_STRUCT.unpack
+        size = self.size
+        with self.db.write_batch() as batch:
+            for tx_hash in tx_hashes:
+                value = self.db.get(tx_hash)
+                if value is None:
+                    continue
+                tx_height, offset, _length = unpack(value)
+                if tx_height > height:
+                    batch.delete(tx_hash)
+                    size = min(size, offset)
+            self.size = size
+            self.height = height
+            self.write_state(batch)
+
+    def _read_raw_tx(self, tx_hash):
+        value = self.db.get(tx_hash)
+        if value is None:
+            return None
+        _height, offset, length = INDEX_STRUCT.unpack(value)
+        raw_tx = self.data_file.read(offset, length)
+        if len(raw_tx) != length:
+            self.logger.error(f'tx store data file is truncated at offset {offset:,d}')
+            return None
+        return raw_tx
+
+    def _read_height(self, tx_hash):
+        value = self.db.get(tx_hash)
+        if value is None:
+            return None
+        height, _offset, _length = INDEX_STRUCT.unpack(value)
+        return height
+
+    async def tx_height(self, tx_hash):
+        '''Return the height of the block of a stored transaction, or None
+        if it is not stored.'''
+        return await self.runner(self._read_height, tx_hash)
+
+    async def raw_tx(self, tx_hash):
+        '''Return the raw transaction with the given hash, or None if it is
+        not stored.'''
+        return await self.runner(self._read_raw_tx, tx_hash)
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from aiorpcx import JSONRPCv1, JSONRPCv2, JSONRPCLoose, ProtocolError, RPCError
+
+from electrumx.lib import jsonrpc
+from electrumx.lib.hash import hash_to_hex_str
+from electrumx.lib.jsonrpc import (
+    EncodingConnection, RawJSON, concat_lists, dumps, encoding_protocol, history_json,
+    utxos_json
+)
+
+
+HISTORY = [(bytes(range(32)), 5), (bytes(32), 600_000)]
+UTXOS = [
+    (bytes(range(32)), 1, 5, 1_000, []),
+    (bytes(32), 0, 600_000, 2**63, [{'ref': 'ab' * 32 + 'i0', 'type': 'normal'}]),
+]
+
+
+@pytest.fixture(params=[True, False], ids=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(jsonrpc, 'orjson', None)
+    elif jsonrpc.orjson is None:
+        pytest.skip('orjson not installed')
+    return request.param
+
+
+def decode(result):
+    return json.loads(result.json) if isinstance(result, RawJSON) else result
+
+
+def test_history_json(encoder):
+    expected = [{'tx_hash': hash_to_hex_str(tx_hash), 'height': height}
+                for tx_hash, height in HISTORY]
+    result = history_json(HISTORY)
+    # RawJSON is only built for the json module
+    assert isinstance(result, RawJSON) is not encoder
+    assert decode(result) == expected
+    assert decode(history_json([])) == []
+
+
+def test_utxos_json(encoder):
+    expected = [{'tx_hash': hash_to_hex_str(tx_hash), 'tx_pos': tx_pos,
+                 'height': height, 'value': value, 'refs': refs}
+                for tx_hash, tx_pos, height, value, refs in UTXOS]
+    assert decode(utxos_json(UTXOS)) == expected
+
+
+def test_concat_lists(encoder):
+    history = history_json(HISTORY)
+    mempool = [{'tx_hash': 'ff', 'height': 0, 'fee': 10}]
+    assert decode(concat_lists([history, mempool])) == decode(history) + mempool
+    assert decode(concat_lists([history, []])) == decode(history)
+
+
+def test_concat():
+    history = RawJSON(dumps([{'tx_hash': 'ab', 'height': 5}]))
+    mempool = RawJSON(dumps([{'tx_hash': 'ff', 'height': 0, 'fee': 10}]))
+    empty = RawJSON(b'[]')
+    assert RawJSON.concat([history, empty]) is history
+    assert RawJSON.concat([empty, empty]).json == b'[]'
+    assert (json.loads(RawJSON.concat([history, mempool]).json)
+            == json.loads(history.json) + json.loads(mempool.json))
+
+
+def test_dumps_fallback():
+    # Too large for orjson
+    assert dumps([2**70]) == b'[1180591620717411303424]'
+    assert dumps({1: 'a'}) == b'{"1":"a"}'
+
+
+@pytest.mark.parametrize('protocol', [JSONRPCv1, JSONRPCv2, JSONRPCLoose])
+def test_response_message(protocol):
+    fast = encoding_protocol(protocol)
+    assert encoding_protocol(protocol) is fast
+    assert issubclass(fast, protocol)
+    result = [{'tx_hash': 'ab', 'height': 1}, 'x' * 10]
+    for request_id in (1, 'id', '"result":null'):
+        message = fast.response_message(result, request_id)
+        assert json.loads(message) == json.loads(protocol.response_message(result, request_id))
+        raw = fast.response_message(RawJSON(dumps(result)), request_id)
+        assert raw == message
+    error = RPCError(1, 'bad')
+    assert fast.response_message(error, 2) == protocol.response_message(error, 2)
+
+
+def test_response_message_error():
+    with pytest.raises(ProtocolError):
+        encoding_protocol(JSONRPCv2).response_message(object(), 1)
+
+
+@pytest.mark.asyncio
+async def test_connection_detects_protocol():
+    # aiorpcx connections need an event loop
+    connection = EncodingConnection()
+    requests = connection.receive_message(
+        b'{"jsonrpc": "2.0", "method": "server.ping", "params": [], "id": 3}')
+    assert connection.protocol is encoding_protocol(JSONRPCv2)
+    assert len(requests) == 1
+
+
+def test_without_orjson(monkeypatch):
+    monkeypatch.setattr(jsonrpc, 'orjson', None)
+    fast = encoding_protocol(JSONRPCv2)
+    result = [{'a': 1}]
+    assert fast.response_message(result, 1) == JSONRPCv2.response_message(result, 1)
+    assert fast.response_message(RawJSON(dumps(result)), 1) == \
+        JSONRPCv2.response_message(result, 1)
@@ -35,3 +35,15 @@ def test_tx_serialiazation():
         deser = tx_lib.Deserializer(test)
         tx = deser.read_tx()
         assert tx.serialize() == test
+
+
+def test_read_tx_block_and_spans():
+    raw_txs = [bytes.fromhex(test) for test in tests]
+    header = bytes(80)
+    raw_block = header + bytes([len(raw_txs)]) + b''.join(raw_txs)
+    deser = tx_lib.Deserializer(raw_block, start=len(header))
+    txs, spans = deser.read_tx_block_and_spans()
+    assert len(txs) == len(spans) == len(raw_txs)
+    for (tx, _tx_hash), (start, length), raw_tx in zip(txs, spans, raw_txs):
+        assert raw_block[start: start + length] == raw_tx
+        assert tx.serialize() == raw_tx
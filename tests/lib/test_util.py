@@ -216,3 +216,27 @@ def test_pack_varbytes():
         data = util.pack_varbytes(test)
         deser = tx.Deserializer(data)
         assert deser._read_varbytes() == test
+
+
+def test_sized_lru_cache():
+    cache = util.SizedLRUCache(10)
+    cache['a'] = b'1234'
+    cache['b'] = b'5678'
+    assert cache.size == 8
+    assert cache.get('a') == b'1234'
+    # 'b' is now least recently used
+    cache['c'] = b'90'
+    cache['d'] = b'x'
+    assert 'b' not in cache
+    assert cache.size == 7 and len(cache) == 3
+    # Replacing a value updates the size
+    cache['a'] = b'12'
+    assert cache.size == 5
+    # Values larger than the cache are dropped
+    cache['e'] = b'y' * 11
+    assert 'e' not in cache
+    assert cache.pop('c') == b'90'
+    assert cache.pop('c') is None
+    assert cache.get('missing') is None
+    cache.clear()
+    assert cache.size == 0 and len(cache) == 0
@@ -0,0 +1,35 @@
+import os
+import types
+
+import pylru
+import pytest
+
+from electrumx.lib import util
+from electrumx.server.db import DB
+from electrumx.server.executors import ExecutorPools
+from electrumx.server.storage import db_class
+
+
+@pytest.fixture
+def db(tmpdir):
+    '''A DB with an empty LevelDB UTXO database and hashes file in tmpdir,
+    and no history.  Modules override it to add their rows.'''
+    try:
+        klass = db_class('leveldb')
+    except ImportError:
+        pytest.skip('leveldb not installed')
+    cwd = os.getcwd()
+    os.chdir(str(tmpdir))
+    db = DB.__new__(DB)
+    db.logger = util.class_logger(__name__, 'DB')
+    db.utxo_db = klass('utxo', False)
+    db.executors = ExecutorPools(1, 1, 1)
+    db.query_rows = pylru.lrucache(100)
+    db.history = types.SimpleNamespace(flush_count=0)
+    db.hot_outputs = {}
+    os.mkdir('meta')
+    db.hashes_file = util.LogicalFile('meta/hashes', 4, 16000000)
+    yield db
+    db.utxo_db.close()
+    db.executors.shutdown()
+    os.chdir(cwd)
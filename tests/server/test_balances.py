@@ -0,0 +1,52 @@
+import pytest
+
+from electrumx.lib.util import pack_le_uint32, pack_le_uint64
+from electrumx.server.db import BALANCE
+
+
+HASHX1 = bytes(range(11))
+HASHX2 = bytes(range(1, 12))
+CSH = bytes(32)
+
+
+def _add(tx_num, value):
+    return pack_le_uint64(tx_num)[:5] + pack_le_uint64(value)
+
+
+def _flush(db, adds, spends):
+    with db.utxo_db.write_batch() as batch:
+        db.flush_balances(batch, adds, spends)
+
+
+@pytest.mark.asyncio
+async def test_flush_balances(db):
+    adds = {
+        b'a' * 36: HASHX1 + CSH + _add(1, 100),
+        b'b' * 36: HASHX1 + CSH + _add(2, 50),
+        b'c' * 36: HASHX2 + CSH + _add(2, 7),
+    }
+    _flush(db, adds, [])
+    assert await db.balance(HASHX1) == (150, 2)
+    assert await db.balance(HASHX2) == (7, 1)
+    assert await db.balance(bytes(11)) == (0, 0)
+    assert db.utxo_count(HASHX1) == 2 and db.utxo_count(bytes(11)) == 0
+
+    adds = {b'd' * 36: HASHX2 + CSH + _add(3, 3)}
+    spends = [HASHX1 + pack_le_uint64(100), HASHX2 + pack_le_uint64(7)]
+    _flush(db, adds, spends)
+    assert await db.balance(HASHX1) == (50, 1)
+    assert await db.balance(HASHX2) == (3, 1)
+
+    # Spending the last UTXO removes the row
+    _flush(db, {}, [HASHX1 + pack_le_uint64(50)])
+    assert db.utxo_db.get(b'bal' + HASHX1) is None
+
+
+def test_build_balances(db):
+    rows = [(HASHX1, 0, 5), (HASHX1, 1, 6), (HASHX2, 0, 1 << 40), (HASHX2, 3, 1)]
+    for hashX, tx_num, value in rows:
+        key = b'u' + hashX + pack_le_uint32(0) + pack_le_uint64(tx_num)[:5]
+        db.utxo_db.put(key, pack_le_uint64(value))
+    db.build_balances()
+    assert BALANCE.unpack(db.utxo_db.get(b'bal' + HASHX1)) == (11, 2)
+    assert BALANCE.unpack(db.utxo_db.get(b'bal' + HASHX2)) == ((1 << 40) + 1, 2)
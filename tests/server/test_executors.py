@@ -0,0 +1,65 @@
+import threading
+
+import pylru
+import pytest
+
+from electrumx.server.db import DB
+from electrumx.server.executors import ExecutorPools, INTERNAL, CHEAP, EXPENSIVE
+
+
+@pytest.mark.asyncio
+async def test_pools_run_in_own_threads():
+    pools = ExecutorPools(1, 2, 1)
+    names = {}
+    for kind in (INTERNAL, CHEAP, EXPENSIVE):
+        names[kind] = await pools.run(kind, lambda: threading.current_thread().name)
+    assert all(names[kind].startswith(f'{kind}-pool') for kind in names)
+
+    info = pools.info()
+    assert info[CHEAP]['threads'] == 2
+    assert all(info[kind]['completed'] == 1 for kind in info)
+    assert all(info[kind]['pending'] == 0 for kind in info)
+    pools.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pool_exception():
+    pools = ExecutorPools(1, 1, 1)
+
+    def fail():
+        raise ValueError('bad')
+
+    with pytest.raises(ValueError):
+        await pools.run(CHEAP, fail)
+    assert pools.info()[CHEAP]['completed'] == 1
+    pools.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_query_routed_by_estimated_cost():
+    db = DB.__new__(DB)
+    db.executors = ExecutorPools(1, 1, 1)
+    db.query_rows = pylru.lrucache(100)
+
+    def read(count):
+        return [threading.current_thread().name] * count
+
+    async def query(key, limit, count):
+        return (await db.run_query(key, limit, lambda: read(count)))[0]
+
+    # Unknown queries are cheap; a large result makes the next one expensive
+    assert (await query(b'a', None, 2000)).startswith(CHEAP)
+    assert (await query(b'a', None, 5)).startswith(EXPENSIVE)
+    assert (await query(b'a', None, 5)).startswith(CHEAP)
+    # A small limit keeps a known large query cheap, and a truncated result
+    # does not lower the estimate
+    await query(b'b', None, 3000)
+    assert (await query(b'b', 10, 10)).startswith(CHEAP)
+    assert db.query_rows[b'b'] == 3000
+    assert (await query(b'b', None, 3000)).startswith(EXPENSIVE)
+
+    # The first query of a key can be estimated a priori
+    result = await db.run_query(b'c', None, lambda: read(5), lambda: 2000)
+    assert result[0].startswith(EXPENSIVE)
+    assert db.query_rows[b'c'] == 5
+    db.executors.shutdown()
@@ -0,0 +1,189 @@
+import pytest
+
+from electrumx.lib.coins import Radiant
+from electrumx.lib.glyph import (
+    EnvelopeFlags, GlyphVersion, pack_glyph_record, parse_glyph_envelope, unpack_glyph_record,
+)
+from electrumx.lib.hash import hash_to_hex_str
+from electrumx.lib.script import is_unspendable_legacy
+from electrumx.lib.tx import Tx, TxInput, TxOutput, ZERO, MINUS_1
+from electrumx.lib.util import pack_le_uint32
+from electrumx.server.block_processor import BlockProcessor
+from electrumx.server.glyph_api import GlyphAPIMixin
+from electrumx.server.mempool import deserialize_txs
+
+
+COMMIT = bytes(range(32))
+ROOT = bytes(range(32, 64))
+CONTROLLER = bytes(range(64, 100))
+P2PKH = bytes([0x76, 0xa9, 0x14]) + b'\x11' * 20 + bytes([0x88, 0xac])
+
+
+def envelope_script(flags, *fields):
+    payload = b'gly' + bytes([GlyphVersion.V2, flags]) + b''.join(fields)
+    return bytes([0x6a, 0x4c, len(payload)]) + payload
+
+
+COMMIT_SCRIPT = envelope_script(EnvelopeFlags.HAS_CONTENT_ROOT, COMMIT, ROOT)
+
+
+@pytest.mark.parametrize('flags, fields', [
+    (0, (COMMIT, )),
+    (EnvelopeFlags.HAS_CONTENT_ROOT, (COMMIT, ROOT)),
+    (EnvelopeFlags.HAS_CONTROLLER, (COMMIT, CONTROLLER)),
+    (EnvelopeFlags.HAS_CONTENT_ROOT | EnvelopeFlags.HAS_CONTROLLER, (COMMIT, ROOT, CONTROLLER)),
+    (EnvelopeFlags.IS_REVEAL, (b'metadata', )),
+])
+def test_record_round_trip(flags, fields):
+    envelope = parse_glyph_envelope(envelope_script(flags, *fields))
+    record = unpack_glyph_record(pack_glyph_record(envelope, 123, 5000))
+    assert record.pop('height') == 123
+    assert record.pop('value') == 5000
+    envelope.pop('metadata_bytes', None)
+    assert record == envelope
+
+
+class FakeKV(dict):
+
+    def iterator(self, prefix=b'', reverse=False):
+        return iter([])
+
+
+class FakeDB:
+
+    def __init__(self):
+        self.utxo_db = FakeKV()
+        self.history = type('History', (), {'add_unflushed': lambda *args: None})()
+        self.tx_counts = []
+        self.undo = {}
+
+    def read_undo_info(self, height):
+        return self.undo.get(height, b'')
+
+    def read_ref_loc_undo_info(self, height):
+        return b''
+
+
+def test_advance_and_backup():
+    bp = BlockProcessor.__new__(BlockProcessor)
+    bp.coin = Radiant
+    bp.db = FakeDB()
+    bp.utxo_cache = {}
+    bp.ref_cache = {}
+    bp.ref_mint_cache = {}
+    bp.ref_loc_cache = {}
+    bp.data_cache = {}
+    bp.db_deletes = []
+    bp.db_spends = []
+    bp.db_ref_spends = []
+    bp.touched = set()
+    bp.tx_count = 0
+    bp.tx_hashes = []
+    bp.height = 4
+
+    coinbase_in = TxInput(ZERO, MINUS_1, b'\x00', 0xffffffff)
+    tx = Tx(1, [coinbase_in], [TxOutput(5000, P2PKH), TxOutput(1, COMMIT_SCRIPT)], 0)
+    tx_hash = b'\xcd' * 32
+    bp.advance_txs([(tx, tx_hash)], is_unspendable_legacy)
+    key = b'gl' + tx_hash + pack_le_uint32(1)
+    assert list(bp.data_cache) == [key]
+    record = unpack_glyph_record(bp.data_cache[key])
+    assert (record['height'], record['value'], record['content_root']) == (5, 1, ROOT.hex())
+
+    bp.height = 5
+    bp.tx_count = 1
+    bp._backup_txs([(tx, tx_hash)], is_unspendable_legacy)
+    assert key in bp.db_deletes
+
+
+class FakeMemPool:
+
+    def __init__(self, txs):
+        self.txs = txs
+
+    def glyph_record(self, tx_hash, index):
+        tx = self.txs.get(tx_hash)
+        return dict(tx.glyphs).get(index) if tx else None
+
+
+class GlyphDB:
+
+    def __init__(self, records, glyph_height, tx_heights=None):
+        self.records = records
+        self.glyph_height = glyph_height
+        self.tx_heights = tx_heights or {}
+
+    async def glyph_record(self, outpoint):
+        return self.records.get(outpoint)
+
+    async def tx_height(self, tx_hash):
+        return self.tx_heights.get(tx_hash)
+
+
+def session(db, mempool):
+    session = GlyphAPIMixin()
+    session.db = db
+    session.mempool = mempool
+    session.bump_cost = lambda cost: None
+    session.requests = []
+
+    async def daemon_request(method, *args):
+        session.requests.append((method, args))
+        return None
+
+    session.daemon_request = daemon_request
+    return session
+
+
+@pytest.mark.asyncio
+async def test_get_token_indexed():
+    tx_hash = b'\xcd' * 32
+    txid = hash_to_hex_str(tx_hash)
+    envelope = parse_glyph_envelope(COMMIT_SCRIPT)
+    db = GlyphDB({tx_hash + pack_le_uint32(1): pack_glyph_record(envelope, 5, 1)}, 0)
+    raw_tx = Tx(1, [TxInput(b'\x01' * 32, 0, b'', 0xffffffff)],
+                [TxOutput(700, COMMIT_SCRIPT)], 0).serialize()
+    mempool = FakeMemPool(deserialize_txs(Radiant, None, [raw_tx]))
+    mempool_txid = hash_to_hex_str(next(iter(mempool.txs)))
+    s = session(db, mempool)
+
+    result = await s.glyph_get_token(f'{txid}:1')
+    assert result == {'glyph_id': f'{txid}:1', 'txid': txid, 'vout': 1, 'value': 1,
+                      'height': 5, 'version': 2, 'is_reveal': False,
+                      'commit_hash': COMMIT.hex(), 'content_root': ROOT.hex()}
+    result = await s.glyph_get_token(f'{mempool_txid}:0')
+    assert (result['height'], result['value']) == (0, 700)
+
+    # Not an envelope, and every block is indexed
+    assert await s.glyph_get_token(f'{txid}:0') is None
+    assert not s.requests
+    assert 'error' in await s.glyph_get_token(f'{txid}:-1')
+    assert 'error' in await s.glyph_get_token('zz:0')
+
+
+@pytest.mark.asyncio
+async def test_get_token_daemon_fallback():
+    old_hash, new_hash, mempool_hash = b'\x01' * 32, b'\x02' * 32, b'\x03' * 32
+    db = GlyphDB({}, 100, {old_hash: 99, new_hash: 100})
+    s = session(db, FakeMemPool({mempool_hash: None}))
+
+    # Unknown to the index, or confirmed before it was added
+    for tx_hash in (bytes(32), old_hash):
+        txid = hash_to_hex_str(tx_hash)
+        assert await s.glyph_get_token(f'{txid}:0') is None
+        assert s.requests.pop() == ('getrawtransaction', (txid, True))
+
+    # Indexed transactions have no envelope at that output
+    for tx_hash in (new_hash, mempool_hash):
+        assert await s.glyph_get_token(f'{hash_to_hex_str(tx_hash)}:0') is None
+    assert not s.requests
+
+
+@pytest.mark.asyncio
+async def test_db_tx_height(db):
+    db.tx_store = None
+    tx_hash = b'\xcd' * 32
+    envelope = parse_glyph_envelope(COMMIT_SCRIPT)
+    db.utxo_db.put(b'gl' + tx_hash + pack_le_uint32(2), pack_glyph_record(envelope, 7, 1))
+    assert await db.tx_height(tx_hash) == 7
+    assert await db.tx_height(b'\xce' * 32) is None
@@ -0,0 +1,66 @@
+# Tests for ranged history reads used by paginated history requests.
+
+import pytest
+
+from electrumx.lib.util import pack_be_uint32, pack_le_uint64
+from electrumx.server.history import History
+
+
+HASHX = bytes(range(11))
+
+
+class FakeKVStore(dict):
+    '''Minimal stand-in for a leveldb/rocksdb handle.'''
+
+    def iterator(self, prefix=b'', reverse=False):
+        items = sorted((k, v) for k, v in self.items() if k.startswith(prefix))
+        if reverse:
+            items.reverse()
+        return iter(items)
+
+
+def _history(rows):
+    history = History()
+    history.db = FakeKVStore()
+    for flush_id, tx_nums in enumerate(rows):
+        history.db[HASHX + pack_be_uint32(flush_id)] = b''.join(
+            pack_le_uint64(tx_num)[:5] for tx_num in tx_nums)
+    return history
+
+
+ROWS = [[1, 4, 9], [12, 15], [20, 21, 22, 30]]
+ALL = [tx_num for row in ROWS for tx_num in row]
+
+
+@pytest.mark.parametrize('start', [None, 0, 1, 2, 9, 10, 12, 16, 30, 31])
+def test_get_txnums_start(start):
+    history = _history(ROWS)
+    expected = [n for n in ALL if start is None or n >= start]
+    assert list(history.get_txnums(HASHX, None, start_tx_num=start)) == expected
+
+
+@pytest.mark.parametrize('start', [0, 1, 3, 12, 19, 22, 30, 100])
+def test_get_txnums_start_reverse(start):
+    history = _history(ROWS)
+    expected = [n for n in reversed(ALL) if n <= start]
+    assert list(history.get_txnums(HASHX, None, reverse=True,
+                                   start_tx_num=start)) == expected
+
+
+def test_get_txnums_start_limit():
+    history = _history(ROWS)
+    assert list(history.get_txnums(HASHX, 3, start_tx_num=10)) == [12, 15, 20]
+    assert list(history.get_txnums(HASHX, 0, start_tx_num=10)) == []
+
+
+def test_get_txnums_pages():
+    history = _history(ROWS)
+    pages = []
+    start = 0
+    while start is not None:
+        tx_nums = list(history.get_txnums(HASHX, 3, start_tx_num=start))
+        start = tx_nums.pop() if len(tx_nums) == 3 else None
+        pages.append(tx_nums)
+    # Pages of two entries each, with each page's lookahead entry beginning
+    # the next page
+    assert [n for page in pages for n in page] == ALL
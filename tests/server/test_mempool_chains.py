@@ -0,0 +1,205 @@
+import os
+import random
+
+import pytest
+
+from electrumx.lib.coins import Radiant
+from electrumx.server.mempool import MemPool, MemPoolAPI, MemPoolTx, fee_bucket, pack_pairs
+
+
+class API(MemPoolAPI):
+
+    async def height(self):
+        return 0
+
+    def cached_height(self):
+        return 0
+
+    def db_height(self):
+        return 0
+
+    async def mempool_hashes(self):
+        return []
+
+    async def raw_transactions(self, hex_hashes):
+        return []
+
+    async def lookup_utxos(self, prevouts):
+        return []
+
+    async def on_mempool(self, touched, height):
+        pass
+
+
+def mempool_tx(prevouts, values):
+    return MemPoolTx(tuple(prevouts), None,
+                     pack_pairs((os.urandom(11), value) for value in values), 0, 200, (), (),
+                     os.urandom(32) * len(values))
+
+
+def chain(length, prevout):
+    tx_map = {}
+    for n in range(length):
+        tx_hash = os.urandom(32)
+        tx_map[tx_hash] = mempool_tx([prevout], [1000 - n])
+        prevout = (tx_hash, 0)
+    return tx_map
+
+
+def shuffled(tx_map):
+    items = list(tx_map.items())
+    random.shuffle(items)
+    return dict(items)
+
+
+def test_topological_order():
+    prevout = (os.urandom(32), 0)
+    tx_map = chain(50, prevout)
+    hashes = list(tx_map)
+    # A tx spending two txs of the chain
+    join_hash = os.urandom(32)
+    tx_map[join_hash] = mempool_tx([(hashes[40], 1), (hashes[10], 1)], [5])
+
+    order = MemPool._topological_order(shuffled(tx_map))
+    assert sorted(order) == sorted(tx_map)
+    positions = {tx_hash: n for n, tx_hash in enumerate(order)}
+    for tx_hash, tx in tx_map.items():
+        for prev_hash, _ in tx.prevouts:
+            if prev_hash in tx_map:
+                assert positions[prev_hash] < positions[tx_hash]
+
+
+def test_topological_order_cycle():
+    a, b = os.urandom(32), os.urandom(32)
+    tx_map = {a: mempool_tx([(b, 0)], [1]), b: mempool_tx([(a, 0)], [1])}
+    assert MemPool._topological_order(tx_map) == []
+
+
+def test_accept_chain_single_pass():
+    mempool = MemPool(Radiant, API())
+    prevout = (os.urandom(32), 0)
+    tx_map = chain(1000, prevout)
+    utxo_map = {prevout: (os.urandom(11), 1001, os.urandom(32))}
+    touched = set()
+
+    deferred, unspent = mempool._accept_transactions(shuffled(tx_map), utxo_map, touched)
+    assert not deferred
+    assert not unspent
+    assert set(mempool.txs) == set(tx_map)
+    assert all(tx.fee == 1 for tx in mempool.txs.values())
+
+
+def test_orphans_dropped():
+    mempool = MemPool(Radiant, API())
+    prevout = (os.urandom(32), 0)
+    tx_map = chain(3, prevout)
+    # A chain whose first tx spends an unknown output
+    orphans = chain(2, (os.urandom(32), 0))
+    tx_map.update(orphans)
+    utxo_map = {prevout: (os.urandom(11), 1001, os.urandom(32))}
+
+    deferred, _unspent = mempool._accept_transactions(shuffled(tx_map), utxo_map, set())
+    assert set(deferred) == set(orphans)
+    assert len(mempool.txs) == 3
+    mempool._drop_orphans(deferred)
+    assert mempool.orphan_count == 2
+
+
+def test_fee_bucket():
+    assert fee_bucket(0, 100) == 0
+    assert fee_bucket(99, 100) == 0
+    rates = [1, 1.5, 10, 999, 1000, 1049, 123456]
+    for rate in rates:
+        bucket = fee_bucket(rate * 250, 250)
+        assert bucket <= rate * 1.001
+        assert rate < bucket * 1.051
+    assert fee_bucket(1000, 1) == fee_bucket(1010, 1)
+    buckets = [fee_bucket(rate, 1) for rate in range(1, 100_000)]
+    assert buckets == sorted(buckets)
+    assert len(set(buckets)) < 250
+
+
+@pytest.mark.asyncio
+async def test_fee_histogram():
+    mempool = MemPool(Radiant, API())
+    tx_map = {}
+    utxo_map = {}
+    # 40 txs of 200 bytes at fee rates of 1 to 40 sats per byte
+    for rate in range(1, 41):
+        prevout = (os.urandom(32), 0)
+        utxo_map[prevout] = (os.urandom(11), 10_000 + rate * 200, os.urandom(32))
+        tx_map[os.urandom(32)] = mempool_tx([prevout], [10_000])
+    mempool._accept_transactions(tx_map, utxo_map, set())
+    assert sum(mempool.fee_histogram.values()) == 8000
+    assert await mempool.compact_fee_histogram() == []
+
+    mempool._update_compact_histogram(bin_size=1000)
+    compact = await mempool.compact_fee_histogram()
+    rates = [rate for rate, _size in compact]
+    assert rates == sorted(rates, reverse=True)
+    assert rates[0] <= 40
+    assert all(size > 1000 for _rate, size in compact)
+    assert sum(size for _rate, size in compact) <= 8000
+
+    touched = set()
+    for tx_hash in list(tx_map):
+        mempool._remove_tx(tx_hash, touched)
+    assert not mempool.fee_histogram
+    assert not mempool.spenders
+    mempool._update_compact_histogram()
+    assert await mempool.compact_fee_histogram() == []
+
+
+def test_eviction():
+    mempool = MemPool(Radiant, API(), max_mb=1000)
+    tx_map = {}
+    utxo_map = {}
+    # Txs paying 1 to 20 sats per byte, the cheapest with a child
+    for rate in range(1, 21):
+        prevout = (os.urandom(32), 0)
+        utxo_map[prevout] = (os.urandom(11), 10_000 + rate * 200, os.urandom(32))
+        tx_map[os.urandom(32)] = mempool_tx([prevout], [10_000])
+    cheapest = next(iter(tx_map))
+    child_hash = os.urandom(32)
+    tx_map[child_hash] = mempool_tx([(cheapest, 0)], [5000])
+    mempool._accept_transactions(tx_map, utxo_map, set())
+    assert mempool._children(cheapest) == {child_hash}
+    assert mempool.memsize == sum(mempool._indexed_memsize(tx) for tx in mempool.txs.values())
+    assert mempool.memsize > sum(tx.memsize() for tx in mempool.txs.values())
+
+    # Under budget nothing happens
+    mempool.max_memsize = mempool.memsize
+    mempool._evict(set())
+    assert len(mempool.txs) == 21
+
+    tx_memsize = mempool._indexed_memsize(mempool.txs[cheapest])
+    mempool.max_memsize = mempool.memsize - tx_memsize * 3
+    touched = set()
+    mempool._evict(touched)
+    assert mempool.memsize <= mempool.max_memsize * 0.9
+    assert cheapest in mempool.evicted and child_hash in mempool.evicted
+    assert set(mempool.evicted).isdisjoint(mempool.txs)
+    assert set(mempool.spenders).isdisjoint(mempool.evicted)
+    # The highest fee rate txs remain
+    rates = [tx.fee / tx.size for tx in mempool.txs.values()]
+    assert min(rates) > max(tx_map[tx_hash].fee / tx_map[tx_hash].size
+                            for tx_hash in mempool.evicted if tx_hash != child_hash)
+    assert tx_map[cheapest].out_pair(0)[:11] in touched
+    assert mempool.info()['evicted txs'] == len(mempool.evicted)
+
+    # A new child of an evicted tx is evicted rather than orphaned
+    grandchild = os.urandom(32)
+    deferred, _unspent = mempool._accept_transactions(
+        {grandchild: mempool_tx([(child_hash, 0)], [100])}, {}, set())
+    mempool._drop_orphans(deferred)
+    assert grandchild in mempool.evicted
+    assert mempool.orphan_count == 0
+
+    # Evicted txs are forgotten, to be fetched again, only if there is room
+    room = mempool.max_memsize * 0.9 - mempool.memsize
+    evicted = dict(mempool.evicted)
+    mempool._forget_evicted()
+    assert sum(evicted[tx_hash][1] for tx_hash in set(evicted).difference(mempool.evicted)) <= room
+    mempool.max_memsize *= 2
+    mempool._forget_evicted()
+    assert not mempool.evicted
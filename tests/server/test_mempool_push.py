@@ -0,0 +1,341 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from electrumx.lib.coins import Radiant
+from electrumx.lib.hash import double_sha256
+from electrumx.lib.tx import Tx, TxInput, TxOutput
+from electrumx.server.mempool import MemPool, MemPoolAPI, deserialize_txs
+
+
+coin = Radiant
+
+
+def make_tx(prevouts, values):
+    inputs = [TxInput(prev_hash, prev_idx, b'', 0xffffffff)
+              for prev_hash, prev_idx in prevouts]
+    outputs = [TxOutput(value, coin.hash160_to_P2PKH_script(os.urandom(20)))
+               for value in values]
+    raw = Tx(2, inputs, outputs, 0).serialize()
+    return raw, double_sha256(raw)
+
+
+class API(MemPoolAPI):
+
+    def __init__(self):
+        self._height = self._db_height = 10
+        self.db_utxos = {}
+        self.on_mempool_calls = []
+
+    async def height(self):
+        return self._height
+
+    def cached_height(self):
+        return self._height
+
+    def db_height(self):
+        return self._db_height
+
+    async def mempool_hashes(self):
+        return []
+
+    async def raw_transactions(self, hex_hashes):
+        return [None for _ in hex_hashes]
+
+    async def lookup_utxos(self, prevouts):
+        return [self.db_utxos.get(prevout) for prevout in prevouts]
+
+    async def on_mempool(self, touched, height):
+        self.on_mempool_calls.append((touched, height))
+
+
+def setup_mempool(**kwargs):
+    api = API()
+    prevout = (os.urandom(32), 0)
+    api.db_utxos[prevout] = (os.urandom(11), 1000, os.urandom(32))
+    parent, parent_hash = make_tx([prevout], [600, 300])
+    child, child_hash = make_tx([(parent_hash, 1)], [250])
+    return MemPool(coin, api, **kwargs), api, prevout, (parent, parent_hash), (child, child_hash)
+
+
+@pytest.mark.asyncio
+async def test_process_pushed():
+    mempool, api, prevout, (parent, parent_hash), (child, child_hash) = setup_mempool()
+    touched = set()
+    # Children can precede their parents
+    assert await mempool._process_pushed([child, parent], touched, 10)
+    assert set(mempool.txs) == {parent_hash, child_hash}
+    assert mempool.txs[parent_hash].fee == 100
+    assert mempool.txs[child_hash].fee == 50
+    assert api.db_utxos[prevout][0] in touched
+
+    # Transactions already in the mempool are ignored
+    touched = set()
+    assert await mempool._process_pushed([parent], touched, 10)
+    assert not touched
+
+    # As are the coinbases of new blocks
+    coinbase = Tx(1, [TxInput(bytes(32), 0xffffffff, b'\0', 0xffffffff)],
+                  [TxOutput(5000, b'\x51')], 0).serialize()
+    assert await mempool._process_pushed([coinbase], touched, 10)
+    assert set(mempool.txs) == {parent_hash, child_hash}
+
+
+@pytest.mark.asyncio
+async def test_process_pushed_db_not_synced():
+    mempool, api, _prevout, (parent, _parent_hash), _child = setup_mempool()
+    api._db_height = 9
+    assert not await mempool._process_pushed([parent], set(), 10)
+    assert not mempool.txs
+
+
+def test_on_push():
+    mempool = MemPool(coin, API())
+    mempool._on_push(b'rawtx', b'a')
+    mempool._on_push(b'rawtx', b'b')
+    assert mempool._pushed == [b'a', b'b']
+    assert not mempool._refresh_requested
+
+    # A block drops pending transactions and requests a refresh
+    mempool._on_push(b'hashblock', bytes(32))
+    assert mempool._pushed == []
+    assert mempool._refresh_requested
+
+    mempool._refresh_requested = False
+    mempool.MAX_PUSHED = 2
+    for raw in (b'a', b'b', b'c'):
+        mempool._on_push(b'rawtx', raw)
+    assert mempool._pushed == []
+    assert mempool._refresh_requested
+
+
+@pytest.mark.asyncio
+async def test_wait_for_refresh():
+    mempool, api, _prevout, (parent, parent_hash), _child = setup_mempool(
+        zmq_url='tcp://127.0.0.1:1', reconcile_secs=5)
+    mempool.PUSH_QUIET_SECS = 0.01
+    task = asyncio.ensure_future(mempool._wait_for_refresh())
+    await asyncio.sleep(0)
+    mempool._on_push(b'rawtx', parent)
+    await asyncio.sleep(0.05)
+    assert parent_hash in mempool.txs
+    assert len(api.on_mempool_calls) == 1
+    assert not task.done()
+
+    mempool._on_push(b'hashblock', bytes(32))
+    await asyncio.wait_for(task, 1)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_refresh_block_burst():
+    mempool, api, _prevout, (parent, _parent_hash), _child = setup_mempool(
+        zmq_url='tcp://127.0.0.1:1', reconcile_secs=5)
+    mempool.PUSH_QUIET_SECS = 0.05
+    task = asyncio.ensure_future(mempool._wait_for_refresh())
+    await asyncio.sleep(0)
+    # The transactions of a block are followed at once by the block
+    mempool._on_push(b'rawtx', parent)
+    await asyncio.sleep(0.01)
+    mempool._on_push(b'hashblock', bytes(32))
+    await asyncio.wait_for(task, 1)
+    assert not mempool.txs
+    assert not api.on_mempool_calls
+
+
+@pytest.mark.asyncio
+async def test_wait_for_refresh_reconcile_due():
+    mempool = MemPool(coin, API(), zmq_url='tcp://127.0.0.1:1', reconcile_secs=0.01)
+    await asyncio.wait_for(mempool._wait_for_refresh(), 1)
+
+
+@pytest.mark.asyncio
+async def test_zmq_feed():
+    zmq = pytest.importorskip('zmq')
+    import zmq.asyncio
+
+    context = zmq.asyncio.Context.instance()
+    publisher = context.socket(zmq.PUB)
+    port = publisher.bind_to_random_port('tcp://127.0.0.1')
+    mempool, _api, _prevout, (parent, _parent_hash), _child = setup_mempool(
+        zmq_url=f'tcp://127.0.0.1:{port}')
+    task = asyncio.ensure_future(mempool._zmq_feed())
+    try:
+        # Subscriptions take a moment to reach the publisher
+        for _ in range(100):
+            await publisher.send_multipart([b'rawtx', parent, b'\0\0\0\0'])
+            await asyncio.sleep(0.01)
+            if mempool._pushed:
+                break
+        assert mempool._pushed[0] == parent
+        await publisher.send_multipart([b'hashblock', bytes(32), b'\0\0\0\0'])
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if mempool._refresh_requested:
+                break
+        assert mempool._refresh_requested
+    finally:
+        task.cancel()
+        publisher.close(linger=0)
+
+
+@pytest.mark.asyncio
+async def test_compact_refs_and_removal():
+    mempool, api, prevout, (parent, parent_hash), _child = setup_mempool()
+    singleton = os.urandom(36)
+    # An output with a singleton ref, and one with a normal ref minted
+    # from the tx's own input
+    mint = parent_hash + bytes(4)
+    scripts = [b'\xd8' + singleton + b'\x75', b'\xd0' + mint + b'\x75']
+    outputs = [TxOutput(100, script) for script in scripts]
+    raw = Tx(2, [TxInput(parent_hash, 0, b'', 0xffffffff)], outputs, 0).serialize()
+    tx_hash = double_sha256(raw)
+
+    touched = set()
+    assert await mempool._process_pushed([parent, raw], touched, 10)
+    tx = mempool.txs[tx_hash]
+    assert isinstance(tx.in_pairs, bytes) and isinstance(tx.out_pairs, bytes)
+    assert tx.fee == 400
+    assert tx.memsize() > 0
+    singleton_hashX = coin.hashX_from_script(singleton)
+    assert tx.sref_hashXs == (singleton_hashX, coin.hashX_from_script(mint))
+    assert list(mempool.srefs[singleton_hashX]) == [tx_hash]
+    assert singleton_hashX in touched
+    assert mempool.get_refs_by_outpoint(tx_hash + bytes(4))[0]['type'] == 'single'
+    assert mempool.get_refs_by_outpoint(tx_hash + bytes([1, 0, 0, 0]))[0]['type'] == 'normal'
+    utxos = await mempool.ref_unordered_UTXOs(mint)
+    assert [(utxo.tx_hash, utxo.tx_pos, utxo.value, utxo.hashX) for utxo in utxos] == [
+        (tx_hash, 1, 100, coin.hashX_from_script(scripts[1]))]
+    assert await mempool.ref_unordered_UTXOs(bytes(36)) == []
+    summaries = await mempool.first_last_summaries(singleton_hashX)
+    assert [summary.hash for summary in summaries] == [tx_hash]
+    assert await mempool.balance_delta(api.db_utxos[prevout][0]) == -1000
+
+    # Dropping the txs cleans up the indexes
+    await mempool._process_mempool(set(), set(), 10)
+    assert not mempool.txs
+    assert not mempool.hashXs
+    assert not mempool.srefs
+    assert not mempool.outpointToRefs
+    assert not mempool.refToOutpoints
+    assert not mempool.spenders
+    assert mempool.memsize == 0
+
+
+def test_deserialize_txs():
+    _mempool, _api, prevout, (parent, parent_hash), _child = setup_mempool()
+    tx_map = deserialize_txs(coin, None, [parent, None])
+    assert list(tx_map) == [parent_hash]
+    assert tx_map[parent_hash].prevouts == (prevout, )
+    assert deserialize_txs(coin, [parent_hash], [parent]) == tx_map
+
+
+@pytest.mark.asyncio
+async def test_deserialize_in_process_pool():
+    mempool, _api, _prevout, (parent, parent_hash), (child, child_hash) = setup_mempool()
+    mempool._process_pool = ProcessPoolExecutor(1)
+    try:
+        assert await mempool._process_pushed([child, parent], set(), 10)
+    finally:
+        mempool._process_pool.shutdown()
+    assert set(mempool.txs) == {parent_hash, child_hash}
+
+
+@pytest.mark.asyncio
+async def test_code_script_hash_index():
+    mempool, api, prevout, (parent, parent_hash), (child, child_hash) = setup_mempool()
+    db_code_hash = api.db_utxos[prevout][2]
+    assert await mempool._process_pushed([parent, child], set(), 10)
+    parent_tx = mempool.txs[parent_hash]
+    out_code_hashes = [parent_tx.out_code_hash(n) for n in range(2)]
+    scripts = [txout.pk_script for txout in coin.DESERIALIZER(parent).read_tx().outputs]
+    assert out_code_hashes == [coin.codeScriptHash_from_script(script) for script in scripts]
+
+    # Spenders of DB UTXOs and mempool outputs are both indexed
+    assert mempool.codeScriptHashes[db_code_hash] == {parent_hash}
+    assert mempool.codeScriptHashes[out_code_hashes[1]] == {parent_hash, child_hash}
+    utxos = await mempool.codescripthash_unordered_UTXOs(out_code_hashes[0])
+    assert [(utxo.tx_hash, utxo.tx_pos, utxo.value) for utxo in utxos] == [(parent_hash, 0, 600)]
+    assert await mempool.codescripthash_potential_spends(db_code_hash) == {prevout}
+    assert await mempool.codescripthash_potential_spends(out_code_hashes[1]) == {
+        prevout, (parent_hash, 1)}
+    assert await mempool.codescripthash_unordered_UTXOs(bytes(32)) == []
+
+    await mempool._process_mempool(set(), set(), 10)
+    assert not mempool.codeScriptHashes
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'mempool')
+    mempool, api, prevout, (parent, parent_hash), (child, child_hash) = setup_mempool(
+        snapshot_path=path, max_mb=100)
+    assert await mempool._process_pushed([parent, child], set(), 10)
+    mempool.evicted[bytes(32)] = (1.0, 1000)
+    # Nothing is saved before the mempool has synchronized
+    mempool._save_snapshot_on_shutdown()
+    assert not os.path.exists(path)
+    mempool.synced_height = 10
+    mempool._save_snapshot_on_shutdown()
+
+    restarted = MemPool(coin, api, snapshot_path=path, max_mb=100)
+    await restarted._load_snapshot()
+    assert not os.path.exists(path)
+    assert restarted.txs == mempool.txs
+    assert restarted.evicted == mempool.evicted
+    assert restarted.memsize == mempool.memsize
+    assert restarted.hashXs == mempool.hashXs
+    assert restarted.codeScriptHashes == mempool.codeScriptHashes
+    assert restarted.fee_histogram == mempool.fee_histogram
+    assert await restarted.balance_delta(api.db_utxos[prevout][0]) == -1000
+
+
+@pytest.mark.asyncio
+async def test_snapshot_ignored_at_other_height(tmp_path):
+    path = str(tmp_path / 'mempool')
+    mempool, api, _prevout, (parent, _parent_hash), _child = setup_mempool(
+        snapshot_path=path)
+    assert await mempool._process_pushed([parent], set(), 10)
+    mempool.synced_height = 10
+    await mempool._save_snapshot()
+    assert os.path.exists(path)
+
+    api._db_height = 11
+    restarted = MemPool(coin, api, snapshot_path=path)
+    await restarted._load_snapshot()
+    assert not restarted.txs
+    assert not os.path.exists(path)
+
+    # Unreadable snapshots are discarded
+    with open(path, 'wb') as f:
+        f.write(b'junk')
+    await restarted._load_snapshot()
+    assert not restarted.txs
+    assert not os.path.exists(path)
+
+
+@pytest.mark.asyncio
+async def test_evicted_not_refetched():
+    mempool, api, _prevout, (parent, parent_hash), _child = setup_mempool()
+    fetched = []
+
+    async def raw_transactions(hex_hashes):
+        hex_hashes = list(hex_hashes)
+        fetched.extend(hex_hashes)
+        return [parent for _ in hex_hashes]
+
+    api.raw_transactions = raw_transactions
+    mempool.max_memsize = 1
+    mempool.evicted[parent_hash] = (1.0, 1000)
+    mempool.synced_height = 9
+    # A block leaves no room for it
+    await mempool._process_mempool({parent_hash}, set(), 10)
+    assert not fetched and not mempool.txs
+    # Pushed copies are ignored too
+    assert await mempool._process_pushed([parent], set(), 10)
+    assert not mempool.txs
+
+    # Evicted txs leaving the daemon's mempool are forgotten
+    await mempool._process_mempool(set(), set(), 10)
+    assert not mempool.evicted
@@ -0,0 +1,103 @@
+import types
+from collections import defaultdict
+
+import pytest
+from aiorpcx import JSONRPCv2, Request, RPCError
+
+from electrumx.server.metrics import Histogram, Metrics, metrics
+from electrumx.server.session import SessionBase
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(1, 1000)
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.count == 100
+    assert histogram.sum == 5050
+    assert histogram.max == 100
+    # Bucket bounds are within a quarter of a power of two of the value
+    assert 50 <= histogram.percentile(0.5) <= 64
+    assert 90 <= histogram.percentile(0.9) <= 100
+    assert histogram.percentile(1.0) == 100
+
+
+def test_histogram_buckets():
+    histogram = Histogram(1, 4, sub_buckets=2)
+    assert histogram.bounds == [1, 1.5, 2, 3, 4]
+    for value in (0.5, 1.2, 3, 10):
+        histogram.record(value)
+    assert list(histogram.cumulative_buckets()) == [
+        (1, 1), (1.5, 2), (2, 2), (3, 3), (4, 3), (None, 4)]
+    assert histogram.percentile(1.0) == 10
+    assert Histogram(1, 4).percentile(0.5) == 0
+
+
+def test_metrics_info_and_prometheus():
+    m = Metrics()
+    m.record_request('server.ping', 0.002, 0.5, False)
+    m.record_request('server.ping', 0.004, 0.5, True)
+    m.record_result_size('server.ping', 100)
+    with m.timer('flush'):
+        pass
+
+    info = m.info()
+    ping = info['methods']['server.ping']
+    assert ping['latency']['count'] == 2
+    assert ping['result bytes']['count'] == 1
+    assert ping['cost'] == 1.0
+    assert ping['errors'] == 1
+    assert info['stages']['flush']['count'] == 1
+
+    text = m.prometheus_text()
+    assert '# TYPE electrumx_request_seconds histogram' in text
+    assert 'electrumx_request_seconds_count{method="server.ping"} 2' in text
+    assert 'electrumx_request_seconds_bucket{method="server.ping",le="+Inf"} 2' in text
+    assert 'electrumx_request_cost_total{method="server.ping"} 1' in text
+    assert 'electrumx_request_errors_total{method="server.ping"} 1' in text
+    assert 'electrumx_stage_seconds_count{stage="flush"} 1' in text
+
+
+def _session(handler):
+    session = SessionBase.__new__(SessionBase)
+    session.session_mgr = types.SimpleNamespace(_method_counts=defaultdict(int))
+    session.request_handlers = {'test.method': handler}
+    session.cost = 0
+    session.cost_decay_per_sec = 0
+    session.cost_hard_limit = 0
+    session.cost_soft_limit = 0
+    session.cost_sleep = 0
+    session._cost_last = 0
+    session._cost_time = 0
+    session._cost_fraction = 0
+    return session
+
+
+@pytest.mark.asyncio
+async def test_handle_request_recorded():
+    async def handler():
+        session.bump_cost(2.5)
+        return 'result'
+
+    session = _session(handler)
+    request = Request('test.method', [])
+    request.send_result = lambda result: JSONRPCv2.response_message(result, 1)
+    before = metrics.method_latency['test.method'].count
+
+    assert await session.handle_request(request) == 'result'
+    assert request.send_result('result') == b'{"jsonrpc":"2.0","result":"result","id":1}'
+    assert metrics.method_latency['test.method'].count == before + 1
+    assert metrics.method_size['test.method'].max == 42
+    assert metrics.method_cost['test.method'] >= 2.5
+    assert session.cost == 2.5
+
+
+@pytest.mark.asyncio
+async def test_handle_request_error_recorded():
+    async def handler():
+        raise RPCError(1, 'bad')
+
+    session = _session(handler)
+    before = metrics.method_errors['test.method']
+    with pytest.raises(RPCError):
+        await session.handle_request(Request('test.method', []))
+    assert metrics.method_errors['test.method'] == before + 1
@@ -120,6 +120,8 @@ def _integration_bp():
     bp.ref_loc_cache = {}
     bp.data_cache = {}
     bp.db_deletes = []
+    bp.db_spends = []
+    bp.db_ref_spends = []
     bp.touched = set()
     bp.tx_count = 0
     bp.tx_hashes = []
@@ -0,0 +1,131 @@
+import array
+
+import pytest
+
+from electrumx.lib.hash import hash_to_hex_str
+from electrumx.lib.util import pack_le_uint32, pack_le_uint64
+from electrumx.server.block_processor import BlockProcessor
+from electrumx.server.db import FlushData, RefUTXO
+from electrumx.server.glyph_api import GlyphAPIMixin
+
+
+HASHX1 = bytes(range(11))
+HASHX2 = bytes(range(1, 12))
+HASHX3 = bytes(range(2, 13))
+CSH = bytes(32)
+REF1 = bytes([1]) * 36
+REF2 = bytes([2]) * 36
+
+
+@pytest.fixture
+def db(db):
+    db.hashes_file.write(0, b''.join(tx_hash(tx_num) for tx_num in range(10)))
+    # Two blocks of 5 txs
+    db.tx_counts = array.array('Q', [5, 10])
+    db.db_height = 1
+    db.db_tx_count = 10
+    return db
+
+
+def tx_hash(tx_num):
+    return bytes([tx_num + 1]) * 32
+
+
+def outpoint(tx_num, idx):
+    return tx_hash(tx_num) + pack_le_uint32(idx)
+
+
+def flush(db, adds, ref_adds, deletes=(), ref_spends=()):
+    flush_data = FlushData(1, 10, [], [], [], [], adds, ref_adds, {}, {}, {},
+                           list(deletes), [], list(ref_spends), None)
+    with db.utxo_db.write_batch() as batch:
+        db.flush_utxo_db(batch, flush_data)
+
+
+def add(hashX, tx_num, value):
+    return hashX + CSH + pack_le_uint64(tx_num)[:5] + pack_le_uint64(value)
+
+
+@pytest.mark.asyncio
+async def test_get_utxos_by_ref(db):
+    adds = {
+        outpoint(7, 1): add(HASHX1, 7, 100),
+        outpoint(2, 0): add(HASHX2, 2, 50),
+        outpoint(3, 0): add(HASHX2, 3, 9),
+    }
+    ref_adds = {
+        outpoint(7, 1): REF1 + b'\0' + REF2 + b'\1',
+        outpoint(2, 0): REF1 + b'\0',
+    }
+    flush(db, adds, ref_adds)
+
+    utxos = await db.get_utxos_by_ref(REF1)
+    assert [(utxo.tx_hash, utxo.tx_pos, utxo.height, utxo.value, utxo.hashX)
+            for utxo in utxos] == [(tx_hash(2), 0, 0, 50, HASHX2),
+                                   (tx_hash(7), 1, 1, 100, HASHX1)]
+    assert [utxo.tx_num for utxo in await db.get_utxos_by_ref(REF2)] == [7]
+    assert await db.get_utxos_by_ref(bytes(36)) == []
+
+
+@pytest.mark.asyncio
+async def test_spend_deletes_ref_utxos(db):
+    flush(db, {outpoint(7, 1): add(HASHX1, 7, 100)},
+          {outpoint(7, 1): REF1 + b'\0' + REF2 + b'\1'})
+
+    bp = BlockProcessor.__new__(BlockProcessor)
+    bp.db = db
+    bp.utxo_cache = {}
+    bp.db_deletes = []
+    bp.db_spends = []
+    bp.db_ref_spends = []
+    assert bp.spend_utxo(tx_hash(7), 1)[:11] == HASHX1
+    flush(db, {}, {}, bp.db_deletes, bp.db_ref_spends)
+    assert await db.get_utxos_by_ref(REF1) == []
+    assert await db.get_utxos_by_ref(REF2) == []
+    # The outpoint's refs are kept
+    assert db.get_refs_by_outpoint(outpoint(7, 1))
+
+
+@pytest.mark.asyncio
+async def test_build_ref_utxos(db):
+    flush(db, {outpoint(7, 1): add(HASHX1, 7, 100),
+               outpoint(4, 2): add(HASHX2, 4, 5)},
+          {outpoint(7, 1): REF1 + b'\0', outpoint(4, 2): REF1 + b'\1'})
+    # A spent output's refs are kept, but it has no UTXO rows
+    db.utxo_db.put(b'ri' + outpoint(5, 0), REF1 + b'\0')
+    with db.utxo_db.write_batch() as batch:
+        for key, _value in db.utxo_db.iterator(prefix=b'ru'):
+            batch.delete(key)
+
+    db.build_ref_utxos()
+    utxos = await db.get_utxos_by_ref(REF1)
+    assert [(utxo.tx_num, utxo.tx_pos, utxo.value) for utxo in utxos] == [
+        (4, 2, 5), (7, 1, 100)]
+
+
+@pytest.mark.asyncio
+async def test_glyph_get_by_ref_mempool_overlay(db):
+    flush(db, {outpoint(7, 1): add(HASHX1, 7, 100), outpoint(2, 0): add(HASHX2, 2, 50)},
+          {outpoint(7, 1): REF1 + b'\0', outpoint(2, 0): REF1 + b'\0'})
+    mempool_hash = bytes([9]) * 32
+    spent_mempool_hash = bytes([10]) * 32
+
+    class MemPool:
+        async def potential_spends(self, hashX):
+            if hashX == HASHX1:
+                return {(tx_hash(7), 1)}
+            if hashX == HASHX3:
+                return {(spent_mempool_hash, 0)}
+            return set()
+
+        async def ref_unordered_UTXOs(self, ref):
+            return [RefUTXO(-1, 0, mempool_hash, 0, 99, HASHX2),
+                    RefUTXO(-1, 0, spent_mempool_hash, 0, 98, HASHX3)]
+
+    session = GlyphAPIMixin()
+    session.db = db
+    session.mempool = MemPool()
+    session.bump_cost = lambda cost: None
+    result = await session.glyph_get_by_ref(REF1.hex())
+    assert [(item['tx_hash'], item['value']) for item in result] == [
+        (hash_to_hex_str(tx_hash(2)), 50), (hash_to_hex_str(mempool_hash), 99)]
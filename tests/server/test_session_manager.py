@@ -0,0 +1,395 @@
+import asyncio
+import json
+import types
+from collections import defaultdict
+from functools import partial
+
+import pylru
+import pytest
+from aiorpcx import JSONRPCv1, JSONRPCv2, Notification, RPCError, RPCSession, SessionKind
+
+from electrumx.lib import util
+from electrumx.lib.hash import hash_to_hex_str
+from electrumx.lib.jsonrpc import EncodingConnection, RawJSON, encoding_protocol
+from electrumx.lib.util import pack_le_uint32
+from electrumx.server.db import UTXO
+
+from electrumx.server.session import ElectrumX, SessionManager
+
+
+class FakeDB:
+
+    def __init__(self):
+        self.history = {}
+        self.reads = 0
+
+    async def limited_history(self, hashX, *, limit=1000, reverse=False):
+        self.reads += 1
+        return list(self.history.get(hashX, []))
+
+    async def history_page(self, hashX, start_tx_num, count):
+        return [(bytes(32), start_tx_num)], start_tx_num + count
+
+
+class FakeMemPool:
+
+    def __init__(self):
+        self.txs = {}
+
+    async def transaction_summaries(self, hashX):
+        return list(self.txs.get(hashX, []))
+
+
+def _session_mgr():
+    mgr = SessionManager.__new__(SessionManager)
+    mgr.env = types.SimpleNamespace(max_send=1_000_000)
+    mgr.db = FakeDB()
+    mgr.mempool = FakeMemPool()
+    mgr._history_cache = pylru.lrucache(1000)
+    mgr._history_lookups = 0
+    mgr._history_hits = 0
+    mgr._status_cache = pylru.lrucache(1000)
+    mgr._status_lookups = 0
+    mgr._status_hits = 0
+    mgr._status_generation = 0
+    mgr._flights = {}
+    mgr._flight_joins = 0
+    return mgr
+
+
+@pytest.mark.asyncio
+async def test_status_cache_shared():
+    mgr = _session_mgr()
+    mgr.db.history[b'a'] = [(bytes(32), 5)]
+    status, has_mempool, _cost = await mgr.address_status(b'a')
+    assert status is not None and not has_mempool
+    assert (await mgr.address_status(b'a'))[0] == status
+    assert (await mgr.address_status(b'b'))[0] is None
+    assert mgr._status_lookups == 3
+    assert mgr._status_hits == 1
+    assert mgr.db.reads == 2
+
+
+@pytest.mark.asyncio
+async def test_status_cache_invalidation():
+    mgr = _session_mgr()
+    mempool_tx = types.SimpleNamespace(hash=bytes(32), has_unconfirmed_inputs=False)
+    mgr.mempool.txs[b'b'] = [mempool_tx]
+    await mgr.address_status(b'a')
+    await mgr.address_status(b'b')
+    await mgr.address_status(b'c')
+
+    # Touched hashXs are dropped
+    mgr._invalidate_statuses({b'a'}, False)
+    assert set(mgr._status_cache) == {b'b', b'c'}
+    # A new block also drops statuses depending on the mempool
+    mgr._invalidate_statuses(set(), True)
+    assert set(mgr._status_cache) == {b'c'}
+
+
+@pytest.mark.asyncio
+async def test_status_not_cached_across_invalidation():
+    mgr = _session_mgr()
+
+    async def transaction_summaries(hashX):
+        mgr._invalidate_statuses({hashX}, False)
+        return []
+
+    mgr.mempool.transaction_summaries = transaction_summaries
+    await mgr.address_status(b'a')
+    assert b'a' not in mgr._status_cache
+
+
+class FakeSession:
+
+    def __init__(self, subscribe_headers=False, mempool_statuses=None):
+        self.subscribe_headers = subscribe_headers
+        self.mempool_statuses = mempool_statuses or {}
+
+    def is_closing(self):
+        return False
+
+
+def test_sessions_to_notify():
+    mgr = _session_mgr()
+    mgr.hashX_sessions = defaultdict(set)
+    idle = FakeSession()
+    headers = FakeSession(subscribe_headers=True)
+    subs = FakeSession()
+    mempool = FakeSession(mempool_statuses={b'm': 'status'})
+    mgr.sessions = {idle: (), headers: (), subs: (), mempool: ()}
+    mgr.subscribe_hashX(subs, b'a')
+    mgr.subscribe_hashX(subs, b'b')
+    mgr.subscribe_hashX(mempool, b'm')
+    mgr.subscribe_hashX(mempool, b'b')
+
+    assert mgr._sessions_to_notify({b'a', b'c'}, False) == {subs: {b'a'}}
+    assert mgr._sessions_to_notify({b'b'}, False) == {subs: {b'b'}, mempool: {b'b'}}
+    assert mgr._sessions_to_notify(set(), True) == {headers: set(), mempool: set()}
+
+    mgr.unsubscribe_hashX(subs, b'a')
+    mgr.unsubscribe_hashX(subs, b'a')
+    assert b'a' not in mgr.hashX_sessions
+    assert mgr._sessions_to_notify({b'a'}, False) == {}
+
+
+@pytest.mark.asyncio
+async def test_history_page_cursor():
+    mgr = _session_mgr()
+    history, cursor, _cost = await mgr.history_page(b'a', None, 5)
+    assert history == [(bytes(32), 0)] and cursor == '0000000005'
+    history, cursor, _cost = await mgr.history_page(b'a', 'ffffffffff', 5)
+    assert history == [(bytes(32), 0xffffffffff)]
+
+    for bad_cursor in ('', '-1', '+a', '0x5', 'A', ' 5', '1' * 11, 'zz'):
+        with pytest.raises(RPCError):
+            await mgr.history_page(b'a', bad_cursor, 5)
+
+
+@pytest.mark.asyncio
+async def test_disconnect_during_subscribe():
+    mgr = _session_mgr()
+    mgr.hashX_sessions = defaultdict(set)
+    mgr.session_event = asyncio.Event()
+    status_event = asyncio.Event()
+
+    session = ElectrumX.__new__(ElectrumX)
+    session.session_mgr = mgr
+    session.hashX_subs = {}
+    session.mempool_statuses = {}
+    session.is_closing = lambda: session not in mgr.sessions
+
+    async def address_status(hashX):
+        await status_event.wait()
+        return 'status'
+
+    session.address_status = address_status
+    mgr.sessions = {session: []}
+    task = asyncio.ensure_future(session.hashX_subscribe(b'a', 'alias'))
+    await asyncio.sleep(0)
+    # The client disconnects while its status is computed
+    mgr.remove_session(session)
+    status_event.set()
+    assert await task == 'status'
+    assert not mgr.hashX_sessions
+
+
+def test_headers_notification_shared():
+    mgr = _session_mgr()
+    mgr._hsub_messages = {}
+    mgr.hsub_results = {'hex': '00' * 80, 'height': 7}
+    notification = Notification('blockchain.headers.subscribe', (mgr.hsub_results, ))
+    for protocol in (JSONRPCv1, JSONRPCv2):
+        message = mgr.headers_notification(protocol)
+        assert message == protocol.notification_message(notification)
+        assert mgr.headers_notification(protocol) is message
+    assert len(mgr._hsub_messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_send_raw_notification():
+    # Shared notifications are sent through aiorpcx internals; this fails if
+    # an upgrade changes them
+    class Transport:
+        kind = SessionKind.SERVER
+
+        def __init__(self):
+            self.written = []
+
+        async def write(self, message):
+            self.written.append(message)
+
+    session = RPCSession(Transport(), connection=EncodingConnection())
+    session.connection.receive_message(b'{"jsonrpc": "2.0", "method": "server.ping", "id": 1}')
+    protocol = session.connection.protocol
+    assert protocol is encoding_protocol(JSONRPCv2)
+    message = protocol.notification_message(Notification('blockchain.headers.subscribe', ()))
+    await ElectrumX.send_raw_notification(session, message)
+    assert session.transport.written == [message]
+    assert session.send_count == 1 and session.send_size == len(message)
+
+
+@pytest.mark.asyncio
+async def test_raw_transaction_coalesced_and_cached():
+    mgr = _session_mgr()
+    mgr.db.tx_store = None
+    mgr._reorg_count = 0
+    mgr._tx_cache = util.SizedLRUCache(1000)
+    mgr._tx_lookups = 0
+    mgr._tx_hits = 0
+    requests = []
+
+    async def daemon_request(method, *args):
+        requests.append((method, args))
+        await asyncio.sleep(0.01)
+        return 'abcd'
+
+    mgr.daemon_request = daemon_request
+    tx_hash = bytes(range(32))
+    results = await asyncio.gather(*(mgr.raw_transaction(tx_hash) for _ in range(5)))
+    assert results == ['abcd'] * 5
+    assert requests == [('getrawtransaction', (hash_to_hex_str(tx_hash), False))]
+    assert not mgr._flights
+    assert mgr._flight_joins == 4
+
+    assert await mgr.raw_transaction(tx_hash) == 'abcd'
+    assert len(requests) == 1
+    assert (mgr._tx_lookups, mgr._tx_hits) == (6, 1)
+
+
+@pytest.mark.asyncio
+async def test_raw_transaction_error_shared():
+    mgr = _session_mgr()
+    mgr.db.tx_store = None
+    mgr._reorg_count = 0
+    mgr._tx_cache = util.SizedLRUCache(1000)
+    mgr._tx_lookups = 0
+    mgr._tx_hits = 0
+
+    async def daemon_request(method, *args):
+        await asyncio.sleep(0.01)
+        raise RPCError(1, 'no such tx')
+
+    mgr.daemon_request = daemon_request
+    results = await asyncio.gather(*(mgr.raw_transaction(bytes(32)) for _ in range(3)),
+                                   return_exceptions=True)
+    assert all(isinstance(result, RPCError) for result in results)
+    assert len(mgr._tx_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    mgr = _session_mgr()
+    calls = []
+
+    async def query(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key * 2
+
+    results = await asyncio.gather(
+        mgr._single_flight('q', 1, partial(query, 1)),
+        mgr._single_flight('q', 1, partial(query, 1)),
+        mgr._single_flight('q', 2, partial(query, 2)),
+        mgr._single_flight('r', 1, partial(query, 1)),
+    )
+    assert results == [2, 2, 4, 2]
+    assert calls == [1, 2, 1]
+    assert not mgr._flights
+
+
+@pytest.mark.asyncio
+async def test_single_flight_retried_after_cancel():
+    mgr = _session_mgr()
+    calls = []
+
+    async def query():
+        calls.append(None)
+        await asyncio.sleep(0.05 if len(calls) == 1 else 0)
+        return len(calls)
+
+    task = asyncio.ensure_future(mgr._single_flight('q', 1, query))
+    await asyncio.sleep(0.01)
+    # As done on a reorg
+    for flight in mgr._flights.values():
+        flight.cancel()
+    assert await task == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_caller_cancelled():
+    mgr = _session_mgr()
+
+    async def query():
+        await asyncio.sleep(0.02)
+        return 5
+
+    first = asyncio.ensure_future(mgr._single_flight('q', 1, query))
+    second = asyncio.ensure_future(mgr._single_flight('q', 1, query))
+    await asyncio.sleep(0.005)
+    first.cancel()
+    assert await second == 5
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+def decode(result):
+    '''Decode a result that may have been built as RawJSON.'''
+    return json.loads(result.json) if isinstance(result, RawJSON) else result
+
+
+@pytest.mark.asyncio
+async def test_listunspent_refs_batched():
+    utxo = partial(UTXO, tx_num=0, height=5, value=100)
+    utxos = [utxo(tx_pos=n, tx_hash=bytes([n]) * 32) for n in range(4)]
+    mempool_refs = {utxos[1].tx_hash + pack_le_uint32(1): [{'ref': 'm', 'type': 'normal'}]}
+    batches = []
+
+    class DB:
+        async def refs_by_outpoints(self, outpoints):
+            batches.append(outpoints)
+            return [[{'ref': outpoint[:1].hex(), 'type': 'single'}] if outpoint[0] else []
+                    for outpoint in outpoints]
+
+    class MemPool:
+        async def unordered_UTXOs(self, hashX):
+            return []
+
+        async def potential_spends(self, hashX):
+            return {(utxos[3].tx_hash, 3)}
+
+        def get_refs_by_outpoint(self, outpoint):
+            return mempool_refs.get(outpoint, [])
+
+    async def all_utxos(hashX):
+        return utxos
+
+    session = ElectrumX.__new__(ElectrumX)
+    session.session_mgr = types.SimpleNamespace(all_utxos=all_utxos)
+    session.db = DB()
+    session.mempool = MemPool()
+    session.bump_cost = lambda cost: None
+
+    result = decode(await session.hashX_listunspent(b'a'))
+    assert [item['tx_pos'] for item in result] == [0, 1, 2]
+    assert [item['refs'] for item in result] == [
+        [], [{'ref': 'm', 'type': 'normal'}], [{'ref': '02', 'type': 'single'}]]
+    # One DB batch, for the UTXOs without mempool refs
+    assert batches == [[utxos[0].tx_hash + pack_le_uint32(0),
+                        utxos[2].tx_hash + pack_le_uint32(2)]]
+
+
+@pytest.mark.asyncio
+async def test_listunspent_page():
+    utxo = partial(UTXO, tx_num=0, height=5, value=100)
+    confirmed = [utxo(tx_pos=n, tx_hash=bytes([n]) * 32) for n in range(2)]
+    mempool_utxo = utxo(tx_pos=0, tx_hash=bytes([9]) * 32, height=0)
+
+    async def utxos_page(hashX, cursor, page_size):
+        if cursor is None:
+            return [confirmed[0]], 'next', 0.1
+        return [confirmed[1]], None, 0.1
+
+    async def unordered_UTXOs(hashX):
+        return [mempool_utxo]
+
+    async def potential_spends(hashX):
+        return set()
+
+    async def refs_by_utxos(utxos):
+        return [[] for _ in utxos]
+
+    session = ElectrumX.__new__(ElectrumX)
+    session.session_mgr = types.SimpleNamespace(utxos_page=utxos_page)
+    session.mempool = types.SimpleNamespace(unordered_UTXOs=unordered_UTXOs,
+                                            potential_spends=potential_spends)
+    session.refs_by_utxos = refs_by_utxos
+    session.bump_cost = lambda cost: None
+
+    scripthash = '00' * 32
+    first = decode(await session.scripthash_listunspent_page(scripthash))
+    assert first['cursor'] == 'next'
+    assert [item['tx_hash'] for item in first['utxos']] == ['00' * 32]
+    last = decode(await session.scripthash_listunspent_page(scripthash, 'next'))
+    assert last['cursor'] is None
+    assert [item['tx_hash'] for item in last['utxos']] == ['01' * 32, '09' * 32]
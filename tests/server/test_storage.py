@@ -33,6 +33,13 @@ def test_put_get(db):
     assert db.get(b"x") == b"y"
 
 
+def test_multi_get(db):
+    db.put(b"a", b"1")
+    db.put(b"c", b"3")
+    assert db.multi_get([b"c", b"b", b"a", b"c"]) == [b"3", None, b"1", b"3"]
+    assert db.multi_get([]) == []
+
+
 def test_batch(db):
     db.put(b"a", b"1")
     with db.write_batch() as b:
@@ -68,6 +75,22 @@ def test_iterator_reverse(db):
         ]
 
 
+def test_iterator_from(db):
+    for i in range(5):
+        db.put(b"abc" + str.encode(str(i)), str.encode(str(i)))
+    db.put(b"a", b"xyz")
+    db.put(b"abd", b"x")
+    assert list(db.iterator_from(b"abc", b"abc2")) == [
+            (b"abc" + str.encode(str(i)), str.encode(str(i))) for
+            i in range(2, 5)
+        ]
+    assert len(list(db.iterator_from(b"abc", b""))) == 5
+    assert list(db.iterator_from(b"abc", b"abc9")) == []
+    db.put(b"\xff\xff", b"y")
+    db.put(b"\xff\xff1", b"z")
+    assert list(db.iterator_from(b"\xff\xff", b"\xff\xff0")) == [(b"\xff\xff1", b"z")]
+
+
 def test_close(db):
     db.put(b"a", b"b")
     db.close()
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from electrumx.server.storage import db_class
+from electrumx.server.tx_store import TxStore
+
+
+@pytest.fixture
+def tx_store(tmpdir):
+    try:
+        klass = db_class('leveldb')
+        klass.import_module()
+    except ImportError:
+        pytest.skip('leveldb not installed')
+    cwd = os.getcwd()
+    os.chdir(str(tmpdir))
+    os.mkdir('meta')
+    store = TxStore()
+    store.open_db(klass, False, -1)
+    yield store
+    store.close_db()
+    os.chdir(cwd)
+
+
+def _block(txs):
+    '''Return (raw_block, tx_hashes, tx_spans) for a fake block.'''
+    raw = bytearray(b'header')
+    spans = []
+    for raw_tx in txs:
+        spans.append((len(raw), len(raw_tx)))
+        raw += raw_tx
+    hashes = [raw_tx[:1] * 32 for raw_tx in txs]
+    return bytes(raw), hashes, spans
+
+
+@pytest.mark.asyncio
+async def test_flush_and_read(tx_store):
+    raw0, hashes0, spans0 = _block([b'a' * 10, b'b' * 20])
+    raw1, hashes1, spans1 = _block([b'c' * 5])
+    tx_store.add_unflushed(0, raw0, hashes0, spans0)
+    tx_store.add_unflushed(1, raw1, hashes1, spans1)
+    assert tx_store.unflushed_memsize() == len(raw0) + len(raw1)
+    assert await tx_store.raw_tx(hashes0[0]) is None
+
+    tx_store.flush()
+    tx_store.assert_flushed()
+    assert tx_store.height == 1
+    assert tx_store.size == 35
+    assert await tx_store.raw_tx(hashes0[0]) == b'a' * 10
+    assert await tx_store.raw_tx(hashes0[1]) == b'b' * 20
+    assert await tx_store.raw_tx(hashes1[0]) == b'c' * 5
+    assert await tx_store.raw_tx(b'x' * 32) is None
+    assert await tx_store.tx_height(hashes1[0]) == 1
+    assert await tx_store.tx_height(b'x' * 32) is None
+
+    # State survives re-opening
+    tx_store.close_db()
+    store = TxStore()
+    store.open_db(db_class('leveldb'), False, 1)
+    assert (store.height, store.size) == (1, 35)
+    assert await store.raw_tx(hashes0[1]) == b'b' * 20
+    store.close_db()
+
+
+@pytest.mark.asyncio
+async def test_backup(tx_store):
+    raw0, hashes0, spans0 = _block([b'a' * 10])
+    raw1, hashes1, spans1 = _block([b'c' * 5, b'd' * 3])
+    tx_store.add_unflushed(0, raw0, hashes0, spans0)
+    tx_store.add_unflushed(1, raw1, hashes1, spans1)
+    tx_store.flush()
+    assert await tx_store.raw_tx(hashes1[0]) == b'c' * 5
+
+    tx_store.backup(hashes1, 0)
+    assert (tx_store.height, tx_store.size) == (0, 10)
+    assert await tx_store.raw_tx(hashes1[0]) is None
+    assert await tx_store.raw_tx(hashes1[1]) is None
+    assert await tx_store.raw_tx(hashes0[0]) == b'a' * 10
+
+    # The space is reused by the replacement block
+    raw1, hashes1, spans1 = _block([b'e' * 4])
+    tx_store.add_unflushed(1, raw1, hashes1, spans1)
+    tx_store.flush()
+    assert tx_store.size == 14
+    assert await tx_store.raw_tx(hashes1[0]) == b'e' * 4
@@ -0,0 +1,96 @@
+import array
+import types
+
+import pytest
+from aiorpcx import RPCError
+
+from electrumx.lib.util import pack_le_uint32, pack_le_uint64
+from electrumx.server.session import SessionManager
+
+
+HASHX = bytes(range(11))
+OTHER = bytes(range(1, 12))
+
+
+@pytest.fixture
+def db(db):
+    db.fs_tx_hash = lambda tx_num: (bytes([tx_num]) * 32, tx_num + 100)
+    db.hashes_file.write(0, b''.join(bytes([tx_num]) * 32 for tx_num in range(200)))
+    db.tx_counts = array.array('Q', [200])
+    db.db_height = 0
+    for hashX in (HASHX, OTHER):
+        for tx_pos in range(3):
+            for tx_num in range(4):
+                key = (b'u' + hashX + pack_le_uint32(tx_pos) + pack_le_uint64(tx_num)[:5])
+                db.utxo_db.put(key, pack_le_uint64(tx_pos * 10 + tx_num))
+    return db
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('count', [1, 5, 12, 13])
+async def test_utxos_page(db, count):
+    pages = []
+    suffix = b''
+    while suffix is not None:
+        utxos, suffix = await db.utxos_page(HASHX, suffix, count)
+        assert len(utxos) <= count
+        pages.append(utxos)
+    utxos = [utxo for page in pages for utxo in page]
+    assert len(pages) == (12 + count - 1) // count
+    assert [(utxo.tx_pos, utxo.tx_num) for utxo in utxos] == [
+        (tx_pos, tx_num) for tx_pos in range(3) for tx_num in range(4)]
+    assert all(utxo.value == utxo.tx_pos * 10 + utxo.tx_num for utxo in utxos)
+    assert all(utxo.height == utxo.tx_num + 100 for utxo in utxos)
+
+
+@pytest.mark.asyncio
+async def test_utxos_page_cursor(db):
+    mgr = SessionManager.__new__(SessionManager)
+    mgr.env = types.SimpleNamespace(max_send=2500)
+    mgr.db = db
+    utxos, cursor, _cost = await mgr.utxos_page(HASHX, None, 5)
+    assert len(utxos) == 5
+    assert cursor == (pack_le_uint32(1) + pack_le_uint64(1)[:5]).hex()
+    utxos, cursor, _cost = await mgr.utxos_page(HASHX, cursor, None)
+    assert len(utxos) == 7 and cursor is None
+
+    for bad_cursor in ('zz', '00', 5):
+        with pytest.raises(RPCError):
+            await mgr.utxos_page(HASHX, bad_cursor, 5)
+    for bad_size in (0, 11):
+        with pytest.raises(RPCError):
+            await mgr.utxos_page(HASHX, None, bad_size)
+
+
+@pytest.mark.asyncio
+async def test_lookup_utxos(db):
+    code_hash = bytes(range(32))
+    tx_hash = bytes([2]) * 32
+    db.utxo_db.put(b'h' + tx_hash[:4] + pack_le_uint32(1) + pack_le_uint64(2)[:5],
+                   HASHX + code_hash)
+    result = await db.lookup_utxos([(tx_hash, 1), (tx_hash, 2), (bytes([3]) * 32, 1)])
+    assert result == [(HASHX, 12, code_hash), None, None]
+    # Outputs of recent blocks are found without reading the b'h' rows
+    other_hash = bytes([7]) * 32
+    db.hot_outputs = {other_hash + pack_le_uint32(2): HASHX + code_hash
+                      + pack_le_uint32(2) + pack_le_uint64(3)[:5]}
+    result = await db.lookup_utxos([(other_hash, 2), (tx_hash, 1)])
+    assert result == [(HASHX, 23, code_hash), (HASHX, 12, code_hash)]
+
+
+def test_fs_tx_hashes(db):
+    reads = []
+    read = db.hashes_file.read
+    db.hashes_file.read = lambda offset, size: reads.append((offset, size)) or read(offset, size)
+    tx_nums = [0, 3, 60, 150, 199, 250]
+    assert db.fs_tx_hashes(tx_nums) == {tx_num: bytes([tx_num]) * 32
+                                        for tx_num in tx_nums[:-1]}
+    assert reads == [(0, 61 * 32), (150 * 32, 50 * 32)]
+
+
+def test_prefix_groups(db):
+    prefixes = [b'u' + HASHX + pack_le_uint32(2), b'u' + bytes(11), b'u' + OTHER]
+    groups = db.utxo_db.prefix_groups(prefixes)
+    assert [len(group) for group in groups] == [4, 0, 12]
+    assert all(key.startswith(prefix) for prefix, group in zip(prefixes, groups)
+               for key, _value in group)